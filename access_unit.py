@@ -0,0 +1,65 @@
+from h264_unit import H264Unit
+
+
+class AccessUnit:
+    """All NAL units that belong to one coded picture."""
+
+    def __init__(self):
+        self.units = []
+        self.slice_count = 0
+        self.is_key_frame = False
+
+    def append(self, h264_unit: H264Unit):
+        self.units.append(h264_unit)
+        if h264_unit.is_slice:
+            self.slice_count += 1
+            self.is_key_frame = self.is_key_frame or h264_unit.type == H264Unit.NALUType.IFR
+
+    def slice_data(self):
+        return b''.join(h264_unit.data for h264_unit in self.units if h264_unit.is_slice)
+
+    @property
+    def data(self):
+        return b''.join(h264_unit.data for h264_unit in self.units)
+
+
+class AccessUnitAssembler:
+    """
+    Groups NAL units into access units so multi-slice pictures are decoded
+    once. A picture ends when an AUD arrives, when a parameter set or SEI
+    follows a slice, or when a slice with first_mb_in_slice 0 starts the next
+    picture. Without AUDs a picture is therefore only complete once the first
+    unit of the next one has been received.
+    """
+    NEW_ACCESS_UNIT_TYPES = (H264Unit.NALUType.AUD, H264Unit.NALUType.SPS,
+                             H264Unit.NALUType.PPS, H264Unit.NALUType.SEI)
+
+    def __init__(self):
+        self.access_unit = AccessUnit()
+        self.access_unit_handler = None  # Callback for completed access units
+        self.access_unit_count = 0
+
+    def push(self, h264_unit: H264Unit):
+        if self.starts_access_unit(h264_unit):
+            self.complete()
+        self.access_unit.append(h264_unit.detach())
+
+    def starts_access_unit(self, h264_unit: H264Unit):
+        if not self.access_unit.slice_count:
+            return False
+        if h264_unit.type in AccessUnitAssembler.NEW_ACCESS_UNIT_TYPES:
+            return True
+        return h264_unit.is_slice and h264_unit.first_mb_in_slice == 0
+
+    def complete(self):
+        # Only called with at least one slice, parameter sets without a picture stay with the next one
+        access_unit = self.access_unit
+        self.access_unit = AccessUnit()
+        self.access_unit_count += 1
+        if self.access_unit_handler:
+            self.access_unit_handler(access_unit)
+
+    def flush(self):
+        """Emits the last picture, for when the stream ends."""
+        if self.access_unit.slice_count:
+            self.complete()
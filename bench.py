@@ -0,0 +1,382 @@
+import argparse
+import contextlib
+import json
+import platform
+import re
+import subprocess
+import sys
+import threading
+import time
+from fractions import Fraction
+
+import numpy as np
+
+from builder import FrameDataBuilder
+from capture import CaptureReader
+from decode_pool import DecodeWorkerPool
+from frame_decoder import FrameDecoder, StreamingDecoder
+from frame_processor import FrameProcessor
+from h264_unit import H264Unit
+from nalu_parser import NALUParser
+
+
+def synthesize_stream(width=1280, height=720, frame_count=120, gop=60, bitrate=4_000_000, fps=30):
+    """Encodes a moving test pattern with PyAV into an Annex-B H.264 stream."""
+    import av
+    codec = av.CodecContext.create('libx264', 'w')
+    codec.width = width
+    codec.height = height
+    codec.pix_fmt = 'yuv420p'
+    codec.time_base = Fraction(1, fps)
+    codec.bit_rate = bitrate
+    codec.gop_size = gop
+    codec.options = {'tune': 'zerolatency', 'preset': 'ultrafast', 'keyint_min': str(gop)}
+
+    ys, xs = np.mgrid[0:height, 0:width]
+    stream = bytearray()
+    for index in range(frame_count):
+        image = np.empty((height, width, 3), np.uint8)
+        image[..., 0] = (xs + index * 4) % 256
+        image[..., 1] = (ys + index * 2) % 256
+        image[..., 2] = (xs + ys + index * 8) % 256
+        frame = av.VideoFrame.from_ndarray(image, format='bgr24')
+        for packet in codec.encode(frame):
+            stream += bytes(packet)
+    for packet in codec.encode(None):
+        stream += bytes(packet)
+    return bytes(stream)
+
+
+def load_capture(path):
+    reader = CaptureReader(path)
+    connection_id = reader.connection_ids[0]
+    chunks = [bytes(chunk) for _, _, chunk in reader.records(connection_id)]
+    reader.close()
+    return chunks
+
+
+def split_chunks(stream, chunk_size=65000):
+    return [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+
+
+def parse_units(chunks):
+    units = []
+    parser = NALUParser(short_start_codes=True)
+    parser.h264_unit_handler = lambda unit, count: units.append(unit)
+    for count, chunk in enumerate(chunks):
+        parser.enqueue(chunk, count)
+    parser.enqueue(NALUParser.START_CODE, len(chunks))
+    return units
+
+
+def build_frames(units, incremental):
+    builder = FrameDataBuilder(incremental=incremental)
+    frames = []
+    for unit in units:
+        build_data = builder.build(unit)
+        if build_data is not None:
+            frames.append(build_data)
+    return frames
+
+
+def latency_stats(latencies):
+    if not latencies:
+        return {"p50_ms": None, "p99_ms": None}
+    ordered = sorted(latencies)
+    return {
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000
+    }
+
+
+def status_mb(field):
+    """VmRSS or VmHWM of this process from /proc (Linux), None elsewhere."""
+    try:
+        with open('/proc/self/status') as file:
+            match = re.search(rf'^{field}:\s+(\d+) kB', file.read(), re.MULTILINE)
+    except OSError:
+        return None
+    return int(match.group(1)) / 1024 if match else None
+
+
+def reset_peak_rss():
+    # Writing 5 to clear_refs resets VmHWM, so the next reading is the peak of one stage only
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def measure_memory(measure):
+    """
+    Runs measure and adds the RSS it left behind and, where the kernel lets
+    the high-water mark be reset, its own peak RSS. ru_maxrss can't be used,
+    it is the peak of the whole process lifetime. Child processes such as
+    FrameProcessor's ffmpeg are not included.
+    """
+    peak_reset = reset_peak_rss()
+    before = status_mb('VmRSS')
+    result = measure()
+    after = status_mb('VmRSS')
+    if before is not None and after is not None:
+        result["rss_delta_mb"] = after - before
+    if peak_reset:
+        result["peak_rss_mb"] = status_mb('VmHWM')
+    return result
+
+
+class BaselineNALUParser:
+    """The byte-at-a-time parser NALUParser replaced, kept to measure the speedup against."""
+
+    def __init__(self):
+        self.data_stream = bytearray()
+        self.search_index = 0
+        self.h264_unit_handler = None
+
+    def enqueue(self, data, count):
+        self.data_stream.extend(data)
+        units = []
+        while self.search_index < len(self.data_stream) - 3:
+            if (self.data_stream[self.search_index] == 0 and
+                    self.data_stream[self.search_index + 1] == 0 and
+                    self.data_stream[self.search_index + 2] == 0 and
+                    self.data_stream[self.search_index + 3] == 1):
+                if self.search_index > 0:
+                    units.append(H264Unit(self.data_stream[:self.search_index]))
+                    self.data_stream = self.data_stream[self.search_index:]
+                    self.search_index = 0
+                else:
+                    self.search_index += 4
+            else:
+                self.search_index += 1
+
+        if self.h264_unit_handler:
+            for unit in units:
+                if unit.type is not None:
+                    self.h264_unit_handler(unit, count)
+
+
+def bench_parser(chunks, create_parser, repeat=5):
+    total_bytes = sum(len(chunk) for chunk in chunks)
+    unit_count = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parser = create_parser()
+        counter = [0]
+        parser.h264_unit_handler = lambda unit, count: counter.__setitem__(0, counter[0] + 1)
+        for count, chunk in enumerate(chunks):
+            parser.enqueue(chunk, count)
+        unit_count += counter[0]
+    elapsed = time.perf_counter() - start
+    return {
+        "units_per_sec": unit_count / elapsed,
+        "mb_per_sec": total_bytes * repeat / elapsed / 1e6
+    }
+
+
+def bench_builder(units, incremental):
+    start = time.perf_counter()
+    frames = build_frames(units, incremental)
+    elapsed = time.perf_counter() - start
+    total = sum(len(frame_data) for frame_data in frames)
+    return {
+        "frames": len(frames),
+        "bytes_per_frame": total / max(len(frames), 1),
+        "total_bytes": total,
+        "frames_per_sec": len(frames) / elapsed
+    }
+
+
+def bench_calls(decode, frames):
+    """Times decode(frame_data) once per built frame."""
+    latencies = []
+    decoded = 0
+    start = time.perf_counter()
+    for frame_data in frames:
+        call_start = time.perf_counter()
+        result = decode(frame_data)
+        latencies.append(time.perf_counter() - call_start)
+        if isinstance(result, list):
+            decoded += len(result)
+        elif result is not None:
+            decoded += 1
+    elapsed = time.perf_counter() - start
+    return dict(frames=decoded, frames_per_sec=decoded / elapsed, **latency_stats(latencies))
+
+
+def bench_frame_processor(frames):
+    submitted = []
+    latencies = []
+
+    def frame_handler(frame):
+        # FFmpeg emits frames in submission order
+        latencies.append(time.perf_counter() - submitted[len(latencies)])
+
+    processor = FrameProcessor(frame_handler=frame_handler)
+    start = time.perf_counter()
+    for frame_data in frames:
+        submitted.append(time.perf_counter())
+        processor.nal_units_to_cv2_frame(frame_data)
+    processor.close()
+    elapsed = time.perf_counter() - start
+    return dict(frames=len(latencies), frames_per_sec=len(latencies) / elapsed, **latency_stats(latencies))
+
+
+def bench_decode_pool(frames, worker_count, stream_count, slot_count=8):
+    """Decodes stream_count copies of the stream in a DecodeWorkerPool of worker_count processes."""
+    # Slots sized to the decoded picture, the first one tells how big that is
+    decoder = StreamingDecoder()
+    slot_size = next(picture.nbytes for frame_data in frames for picture in decoder.decode_data(frame_data))
+    decoder.close()
+
+    pool = DecodeWorkerPool(worker_count=worker_count, slot_count=slot_count, slot_size=slot_size)
+    pool.start()
+    condition = threading.Condition()
+    decoded = [0] * stream_count
+
+    def make_handler(index):
+        def frame_handler(shared_frame):
+            shared_frame.release()
+            with condition:
+                decoded[index] += 1
+                condition.notify_all()
+        return frame_handler
+
+    def wait_for_slots(index, stream_id, submitted):
+        # Keep no more frames in flight than the stream has slots, like a consumer that keeps up
+        with condition:
+            condition.wait_for(lambda: decoded[index] + pool.dropped_frames.get(stream_id, 0)
+                               >= submitted - slot_count + 1, timeout=5)
+
+    try:
+        stream_ids = [pool.open_stream(make_handler(index)) for index in range(stream_count)]
+        # The first picture of every stream pays for starting the workers, it is not timed
+        for stream_id in stream_ids:
+            pool.submit(stream_id, frames[0])
+        for index, stream_id in enumerate(stream_ids):
+            wait_for_slots(index, stream_id, slot_count)
+        warm = sum(decoded)
+        start = time.perf_counter()
+        for submitted, frame_data in enumerate(frames[1:], 2):
+            for index, stream_id in enumerate(stream_ids):
+                wait_for_slots(index, stream_id, submitted)
+                pool.submit(stream_id, frame_data)
+        dropped = sum(pool.dropped_frames.values())
+        for stream_id in stream_ids:
+            pool.close_stream(stream_id)
+        # A stream is forgotten once its worker flushed and closed it
+        while pool.streams:
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.stop()
+    frame_count = sum(decoded) - warm
+    return {
+        "workers": worker_count,
+        "streams": stream_count,
+        "frames": frame_count,
+        "frames_dropped": dropped,
+        "frames_per_sec": frame_count / elapsed
+    }
+
+
+def run(args):
+    if args.capture:
+        chunks = load_capture(args.capture)
+        source = {"capture": args.capture}
+    else:
+        stream = synthesize_stream(args.width, args.height, args.frames, args.gop, args.bitrate)
+        chunks = split_chunks(stream)
+        source = {"width": args.width, "height": args.height, "frames": args.frames,
+                  "gop": args.gop, "bitrate": args.bitrate}
+
+    units = parse_units(chunks)
+    legacy_frames = build_frames(units, incremental=False)
+    incremental_frames = build_frames(units, incremental=True)
+    # The per-frame FrameDecoder approaches decode the whole GOP every call
+    slow_frames = legacy_frames[:args.slow_frames]
+
+    results = {}
+
+    def record(name, measure):
+        print(f"Running {name}", file=sys.stderr)
+        try:
+            results[name] = measure_memory(measure)
+        except Exception as e:
+            results[name] = {"error": str(e)}
+
+    # The baseline scans byte by byte in Python, one pass is plenty
+    record("parser_baseline", lambda: bench_parser(chunks, BaselineNALUParser, repeat=1))
+    record("parser", lambda: bench_parser(chunks, NALUParser))
+    record("parser_short_start_codes", lambda: bench_parser(chunks, lambda: NALUParser(short_start_codes=True)))
+    if "error" not in results["parser_baseline"] and "error" not in results["parser"]:
+        results["parser"]["speedup_vs_baseline"] = \
+            results["parser"]["mb_per_sec"] / results["parser_baseline"]["mb_per_sec"]
+    record("builder", lambda: bench_builder(units, incremental=False))
+    record("builder_incremental", lambda: bench_builder(units, incremental=True))
+    decoder = FrameDecoder()
+    for approach in args.approaches:
+        record(f"frame_decoder_{approach}", lambda: bench_calls(lambda data: decoder.decode(data, approach), slow_frames))
+    record("streaming_decoder", lambda: bench_calls(StreamingDecoder().decode_data, incremental_frames))
+    record("frame_processor", lambda: bench_frame_processor(incremental_frames))
+    for worker_count in args.pool_workers:
+        record(f"decode_pool_{worker_count}", lambda: bench_decode_pool(incremental_frames, worker_count,
+                                                                        args.pool_streams))
+    # Throughput relative to one worker, how well decoding scales across cores
+    single = results.get(f"decode_pool_{args.pool_workers[0]}", {}) if args.pool_workers else {}
+    if "frames_per_sec" in single:
+        for worker_count in args.pool_workers:
+            result = results[f"decode_pool_{worker_count}"]
+            if "frames_per_sec" in result:
+                result["speedup"] = result["frames_per_sec"] / single["frames_per_sec"]
+
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "source": source,
+        "chunks": len(chunks),
+        "units": len(units),
+        "results": results
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the recv -> parse -> build -> decode pipeline")
+    parser.add_argument('--capture', help="capture recorded by TCPServer.capture instead of a synthesized stream")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--frames', type=int, default=120)
+    parser.add_argument('--gop', type=int, default=60)
+    parser.add_argument('--bitrate', type=int, default=4_000_000)
+    parser.add_argument('--approaches', type=int, nargs='*', default=[1, 3, 4, 5],
+                        help="FrameDecoder approaches to run")
+    parser.add_argument('--slow-frames', type=int, default=30,
+                        help="frames given to the FrameDecoder approaches, which decode the GOP per call")
+    parser.add_argument('--pool-workers', type=int, nargs='*', default=[1, 2, 4],
+                        help="DecodeWorkerPool sizes to sweep, speedups are relative to the first")
+    parser.add_argument('--pool-streams', type=int, default=4, help="streams decoded at once by each pool")
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    # The pipeline reports progress with print, keep stdout for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
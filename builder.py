@@ -1,12 +1,19 @@
+from access_unit import AccessUnit
 from h264_unit import H264Unit
 
 
 class FrameDataBuilder:
-    def __init__(self):
+    def __init__(self, incremental=False):
         self.key_frame = None
         self.sps = None
         self.pps = None
         self.description = None
+        # Incremental mode emits every slice once and the parameter sets only
+        # when they change, for decoders that keep state between calls
+        self.incremental = incremental
+        self.sent_description = None
+        self.sps_info = None
+        self.resolution_handler = None  # Called with (width, height) whenever an SPS changes the frame size
 
     def create_description(self, sps: bytes, pps: bytes):
         self.description = sps + pps
@@ -16,7 +23,7 @@ class FrameDataBuilder:
             print("Missing SPS/PPS")
             return None
 
-        data = block_buffer
+        data = bytes(block_buffer)
         if not is_key_frame:
             data = self.key_frame + block_buffer
         frame_data = self.description + data
@@ -24,24 +31,78 @@ class FrameDataBuilder:
 
         return frame_data
 
+    def create_incremental_buffer(self, block_buffer):
+        if not self.description:
+            print("Missing SPS/PPS")
+            return None
+
+        if self.key_frame is None:
+            # Nothing to predict from until the first IDR arrives
+            return None
+
+        if self.description == self.sent_description:
+            return block_buffer
+        self.sent_description = self.description
+        return self.description + block_buffer
+
+    def update_sps_info(self, h264_unit: H264Unit):
+        try:
+            sps_info = h264_unit.sps_info
+        except ValueError as e:
+            print(f"Failed to parse SPS: {e}")
+            return
+
+        previous = self.sps_info
+        self.sps_info = sps_info
+        if previous is None or previous.resolution != sps_info.resolution:
+            print(f"Stream geometry: {sps_info}")
+            if self.resolution_handler:
+                self.resolution_handler(*sps_info.resolution)
+
     def build(self, h264_unit: H264Unit):
         is_key_frame = False
 
         if h264_unit.type == 'sps':
-            self.sps = h264_unit.data
+            if h264_unit.data != self.sps:
+                self.update_sps_info(h264_unit)
+            # Parameter sets are kept, units may be views of a receive buffer
+            self.sps = bytes(h264_unit.data)
             return None
         elif h264_unit.type == 'pps':
-            self.pps = h264_unit.data
+            self.pps = bytes(h264_unit.data)
 
             if self.sps and self.pps:
                 self.create_description(self.sps, self.pps)
             return None
 
+        elif not h264_unit.is_slice:
+            # SEI and access unit delimiters carry nothing the decoders need
+            return None
+
         if h264_unit.type == 'ifr':
             self.key_frame = h264_unit.data
             is_key_frame = True
 
+        if self.incremental:
+            return self.create_incremental_buffer(h264_unit.data)
         return self.create_sample_buffer(h264_unit.data, is_key_frame)
 
+    def build_access_unit(self, access_unit: AccessUnit):
+        """Like build, but for all slices of one picture so it is decoded with a single call."""
+        for h264_unit in access_unit.units:
+            if not h264_unit.is_slice:
+                self.build(h264_unit)
+
+        block_buffer = access_unit.slice_data()
+        if not block_buffer:
+            return None
+
+        if access_unit.is_key_frame:
+            self.key_frame = block_buffer
+
+        if self.incremental:
+            return self.create_incremental_buffer(block_buffer)
+        return self.create_sample_buffer(block_buffer, access_unit.is_key_frame)
+
 
 frame_data_builder = FrameDataBuilder()
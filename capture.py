@@ -0,0 +1,73 @@
+import mmap
+import struct
+import threading
+import time
+
+
+class CaptureWriter:
+    """
+    Records received chunks exactly as they came off the socket.
+
+    The data file starts with MAGIC and holds every chunk behind a small
+    record header. A separate index file (path + '.idx') lists offset,
+    timestamp, connection id and length of each record, so a reader can map
+    the data file and slice chunks out of it without parsing it front to back.
+    """
+    MAGIC = b'H264CAP1'
+    RECORD_HEADER = struct.Struct('<QII')  # timestamp_ns, connection_id, length
+    INDEX_ENTRY = struct.Struct('<QQII')  # offset, timestamp_ns, connection_id, length
+
+    def __init__(self, path):
+        self.path = path
+        self.data_file = open(path, 'wb')
+        self.index_file = open(path + '.idx', 'wb')
+        self.data_file.write(CaptureWriter.MAGIC)
+        self.offset = len(CaptureWriter.MAGIC)
+        self.start = time.monotonic_ns()
+        self.lock = threading.Lock()
+        self.record_count = 0
+
+    def write(self, connection_id, data):
+        length = len(data)
+        with self.lock:
+            # Taken under the lock, so records from concurrent connections stay in timestamp order
+            timestamp = time.monotonic_ns() - self.start
+            self.data_file.write(CaptureWriter.RECORD_HEADER.pack(timestamp, connection_id, length))
+            self.data_file.write(data)
+            offset = self.offset + CaptureWriter.RECORD_HEADER.size
+            self.index_file.write(CaptureWriter.INDEX_ENTRY.pack(offset, timestamp, connection_id, length))
+            self.offset = offset + length
+            self.record_count += 1
+
+    def close(self):
+        with self.lock:
+            self.data_file.close()
+            self.index_file.close()
+
+
+class CaptureReader:
+    """Reads a capture back, chunks are memoryviews of the mapped data file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + '.idx', 'rb') as index_file:
+            self.index = list(CaptureWriter.INDEX_ENTRY.iter_unpack(index_file.read()))
+        with open(path, 'rb') as data_file:
+            if data_file.read(len(CaptureWriter.MAGIC)) != CaptureWriter.MAGIC:
+                raise ValueError(f"{path} is not a capture file")
+            self.data = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.data)
+
+    @property
+    def connection_ids(self):
+        return sorted({connection_id for _, _, connection_id, _ in self.index})
+
+    def records(self, connection_id=None):
+        """Yields (timestamp_ns, connection_id, chunk) in capture order."""
+        for offset, timestamp, record_connection_id, length in self.index:
+            if connection_id is None or record_connection_id == connection_id:
+                yield timestamp, record_connection_id, self.view[offset:offset + length]
+
+    def close(self):
+        self.view.release()
+        self.data.close()
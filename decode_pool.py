@@ -0,0 +1,211 @@
+import itertools
+import multiprocessing
+import threading
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedFrame:
+    """
+    Decoded frame living in a shared memory ring slot. The array is a view
+    into the slot, so it has to be released (or used as a context manager)
+    before the worker can reuse the slot for a later frame.
+    """
+
+    def __init__(self, pool, stream_id, slot, array):
+        self.pool = pool
+        self.stream_id = stream_id
+        self.slot = slot
+        self.array = array
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.array = None
+            self.pool.release(self.stream_id, self.slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class WorkerStream:
+    def __init__(self, shm_name, slot_count, slot_size):
+        from frame_decoder import StreamingDecoder
+        self.shm = shared_memory.SharedMemory(name=shm_name)
+        self.slot_size = slot_size
+        self.free_slots = deque(range(slot_count))
+        self.decoder = StreamingDecoder()
+
+    def write_frame(self, frame):
+        if not self.free_slots or frame.nbytes > self.slot_size:
+            return None
+        slot = self.free_slots.popleft()
+        view = np.ndarray(frame.shape, np.uint8, buffer=self.shm.buf, offset=slot * self.slot_size)
+        np.copyto(view, frame)
+        del view
+        return slot
+
+    def close(self):
+        self.decoder.close()
+        self.shm.close()
+
+
+def decode_worker(input_queue, result_queue):
+    streams = {}
+    while True:
+        message = input_queue.get()
+        if message is None:
+            break
+        kind, stream_id = message[0], message[1]
+
+        if kind == 'open':
+            streams[stream_id] = WorkerStream(*message[2:])
+            continue
+
+        stream = streams.get(stream_id)
+        if stream is None:
+            continue
+
+        if kind == 'data':
+            frames = stream.decoder.decode_data(message[2])
+        elif kind == 'release':
+            stream.free_slots.append(message[2])
+            continue
+        else:
+            frames = stream.decoder.flush()
+
+        for frame in frames:
+            slot = stream.write_frame(frame)
+            if slot is None:
+                result_queue.put(('dropped', stream_id))
+            else:
+                result_queue.put(('frame', stream_id, slot, frame.shape))
+
+        if kind == 'close':
+            stream.close()
+            del streams[stream_id]
+            result_queue.put(('closed', stream_id))
+
+    for stream in streams.values():
+        stream.close()
+
+
+class DecodeWorkerPool:
+    """
+    Decodes streams in worker processes, each stream pinned to one worker.
+    Builder output goes to the worker over a queue and decoded frames come
+    back through a per-stream ring of shared memory slots, so only the slot
+    index is pickled. A frame is dropped when all slots of its stream are
+    still held by the consumer.
+    """
+
+    def __init__(self, worker_count=None, slot_count=4, slot_size=1280 * 720 * 3):
+        self.worker_count = worker_count or multiprocessing.cpu_count()
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.context = multiprocessing.get_context('spawn')
+        self.result_queue = self.context.Queue()
+        self.input_queues = []
+        self.workers = []
+        self.streams = {}  # stream_id -> (worker index, shared memory, frame handler, slot size)
+        self.dropped_frames = {}
+        self.stream_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.collector = None
+
+    def start(self):
+        for _ in range(self.worker_count):
+            input_queue = self.context.Queue()
+            worker = self.context.Process(target=decode_worker, args=(input_queue, self.result_queue), daemon=True)
+            worker.start()
+            self.input_queues.append(input_queue)
+            self.workers.append(worker)
+
+        self.collector = threading.Thread(target=self.collect_frames, daemon=True)
+        self.collector.start()
+
+    def open_stream(self, frame_handler, slot_size=None):
+        """
+        Registers a stream, frame_handler is called with a SharedFrame for every decoded picture.
+        slot_size defaults to the pool setting, pass the frame size from the SPS to fit the stream exactly.
+        """
+        slot_size = slot_size or self.slot_size
+        stream_id = next(self.stream_ids)
+        worker_index = stream_id % self.worker_count
+        shm = shared_memory.SharedMemory(create=True, size=self.slot_count * slot_size)
+        with self.lock:
+            self.streams[stream_id] = (worker_index, shm, frame_handler, slot_size)
+            self.dropped_frames[stream_id] = 0
+        self.input_queues[worker_index].put(('open', stream_id, shm.name, self.slot_count, slot_size))
+        return stream_id
+
+    def submit(self, stream_id, frame_data):
+        # FrameDataBuilder output, see StreamingDecoder.decode_data
+        worker_index = self.streams[stream_id][0]
+        self.input_queues[worker_index].put(('data', stream_id, bytes(frame_data)))
+
+    def release(self, stream_id, slot):
+        stream = self.streams.get(stream_id)
+        if stream:
+            self.input_queues[stream[0]].put(('release', stream_id, slot))
+
+    def close_stream(self, stream_id):
+        stream = self.streams.get(stream_id)
+        if stream:
+            self.input_queues[stream[0]].put(('close', stream_id))
+
+    def collect_frames(self):
+        while True:
+            message = self.result_queue.get()
+            if message is None:
+                break
+            kind, stream_id = message[0], message[1]
+            with self.lock:
+                stream = self.streams.get(stream_id)
+            if stream is None:
+                continue
+            _, shm, frame_handler, slot_size = stream
+
+            if kind == 'frame':
+                slot, shape = message[2], message[3]
+                array = np.ndarray(shape, np.uint8, buffer=shm.buf, offset=slot * slot_size)
+                shared_frame = SharedFrame(self, stream_id, slot, array)
+                try:
+                    frame_handler(shared_frame)
+                except Exception as e:
+                    # One stream's failing handler must not stop the collector for every other stream
+                    print(f"Frame handler of stream {stream_id} failed: {e}")
+                    shared_frame.release()
+            elif kind == 'dropped':
+                with self.lock:
+                    self.dropped_frames[stream_id] += 1
+            elif kind == 'closed':
+                with self.lock:
+                    del self.streams[stream_id]
+                    del self.dropped_frames[stream_id]
+                self.free_shared_memory(shm)
+
+    def free_shared_memory(self, shm):
+        try:
+            shm.close()
+        except BufferError:
+            print("Shared frame still in use while closing stream")
+        shm.unlink()
+
+    def stop(self):
+        for input_queue in self.input_queues:
+            input_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.result_queue.put(None)
+        if self.collector:
+            self.collector.join()
+        for stream in self.streams.values():
+            self.free_shared_memory(stream[1])
+        self.streams.clear()
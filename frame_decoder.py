@@ -1,12 +1,13 @@
+import os
 import subprocess
 import tempfile
 from io import BytesIO
 
 # import av
-import cv2
-import ffmpeg
 import numpy as np
 
+from h264_unit import H264Unit
+
 
 class FrameDecoder:
     def decode(self, data, approach):
@@ -22,6 +23,7 @@ class FrameDecoder:
             return self.nal_units_to_cv2_frames(data)
 
     def decode_tempfile(self, frame_data):
+        import cv2
         try:
             with tempfile.NamedTemporaryFile(delete=False, suffix=".h264") as tmpfile:
                 tmpfile.write(frame_data)
@@ -35,6 +37,7 @@ class FrameDecoder:
                     break
                 new_frame = frame
             cap.release()
+            os.unlink(h264_filename)
             return new_frame
         except Exception as e:
             print(f"Failed to decode frame: {e}")
@@ -82,6 +85,12 @@ class FrameDecoder:
         return frames[-1]  # Return a list of decoded frames
 
     def decode_ffmpeg(self, frame_data):
+        import ffmpeg
+        sps_info = H264Unit.find_sps(frame_data)
+        if sps_info is None:
+            print("Missing SPS")
+            return None
+
         # Combine SPS, PPS, and I-frame to form a complete NAL unit stream
         h264_data = frame_data
 
@@ -93,13 +102,20 @@ class FrameDecoder:
             .run(input=h264_data, capture_stdout=True, capture_stderr=True)
         )
 
-        # Convert bytes to a NumPy array
-        width, height = 720, 1280  # Use your frame's actual resolution
-        frame = np.frombuffer(out, np.uint8).reshape([height, width, 3])
+        # Convert bytes to a NumPy array, the output holds every frame of the GOP
+        width, height = sps_info.resolution
+        frames = np.frombuffer(out, np.uint8).reshape([-1, height, width, 3])
 
-        return frame
+        return frames[-1] if len(frames) else None
+
+    def nal_units_to_cv2_frames(self, frame_data, width=None, height=None):
+        if width is None or height is None:
+            sps_info = H264Unit.find_sps(frame_data)
+            if sps_info is None:
+                print("Missing SPS")
+                return None
+            width, height = sps_info.resolution
 
-    def nal_units_to_cv2_frames(self, frame_data, width = 720, height = 1280):
         # Start FFmpeg process to read H.264 frames from stdin and output raw video to stdout
         process = subprocess.Popen(
             [
@@ -136,3 +152,207 @@ class FrameDecoder:
         process.stdout.close()
         process.wait()
         return result_frame
+
+
+class OutputFormat:
+    """Pixel layouts the decoders hand out, values are FFmpeg pixel format names."""
+    BGR24 = 'bgr24'  # (height, width, 3) array, what OpenCV expects
+    GRAY8 = 'gray'  # (height, width) array
+    YUV420P = 'yuv420p'  # Y, U and V plane arrays
+    FRAME = 'frame'  # The av.VideoFrame itself, the consumer converts it when it needs pixels
+
+
+class FrameConverter:
+    """
+    Turns decoded av.VideoFrames into output_format, scaled to width x height
+    when given, with one libswscale context that is reused across frames.
+    GRAY8 and YUV420P at the stream's own size need no conversion at all, the
+    arrays are views of the decoder's yuv420p planes. Scaled GRAY8 scales the
+    luma plane alone.
+
+    With a frame_pool.FramePool, frames are copied into pooled arrays and
+    handed out as PooledFrame objects the consumer releases, YUV420P as one
+    (height * 3 // 2, width) array like FrameProcessor. Pooled BGR24 frames
+    of BT.601 limited range streams, what H.264 defaults to, are converted by
+    OpenCV straight into the pooled array from a reused I420 scratch array.
+    Other streams go through libswscale and a copy.
+
+    The swscale context is not thread safe, threads need a converter each.
+    """
+
+    # AVColorSpace values COLOR_YUV2BGR_I420 matches: unspecified, BT.470BG and SMPTE 170M
+    BT601_COLORSPACES = (2, 5, 6)
+    FULL_RANGE = 2  # AVCOL_RANGE_JPEG
+
+    def __init__(self, output_format=OutputFormat.BGR24, width=None, height=None, frame_pool=None):
+        import av
+        self.output_format = output_format
+        self.width = width
+        self.height = height
+        self.reformatter = av.video.reformatter.VideoReformatter()
+        self.frame_pool = frame_pool
+        self.cv2 = None
+        if (frame_pool is not None and output_format == OutputFormat.BGR24
+                or output_format == OutputFormat.GRAY8 and width and height):
+            import cv2
+            self.cv2 = cv2
+        self.yuv = None  # I420 scratch array the pooled BGR24 conversion reads from
+
+    def convert(self, frame):
+        scaled = self.width and self.height and (frame.width, frame.height) != (self.width, self.height)
+        if self.output_format == OutputFormat.FRAME:
+            return self.reformatter.reformat(frame, self.width, self.height) if scaled else frame
+
+        if self.output_format == OutputFormat.GRAY8 and scaled and frame.format.name in ('yuv420p', 'yuvj420p'):
+            return self.scale_luma(self.plane_views(frame)[0])
+
+        if self.output_format in (OutputFormat.GRAY8, OutputFormat.YUV420P):
+            if scaled or frame.format.name not in ('yuv420p', 'yuvj420p'):
+                frame = self.reformatter.reformat(frame, self.width, self.height, OutputFormat.YUV420P)
+            planes = self.plane_views(frame)
+            # The luma plane is the grayscale picture
+            if self.output_format == OutputFormat.GRAY8:
+                planes = planes[:1]
+            if self.frame_pool is None:
+                return planes[0] if self.output_format == OutputFormat.GRAY8 else planes
+            return self.copy_to_pool(planes)
+
+        if self.frame_pool is not None and self.converts_with_cv2(frame):
+            return self.convert_to_pool(frame)
+        frame = self.reformatter.reformat(frame, self.width, self.height, self.output_format)
+        if self.frame_pool is None:
+            return frame.to_ndarray()
+        plane = frame.planes[0]
+        rows = np.frombuffer(plane, np.uint8).reshape(-1, plane.line_size)
+        return self.copy_to_pool([rows[:frame.height, :frame.width * 3].reshape(frame.height, frame.width, 3)])
+
+    def scale_luma(self, luma):
+        """
+        Scales the Y plane alone, into a pooled array when there is a pool.
+        libswscale would scale the chroma planes too for yuv420p, and its gray
+        output is full range unlike the Y plane handed out unscaled.
+        """
+        cv2 = self.cv2
+        interpolation = cv2.INTER_AREA if self.width < luma.shape[1] else cv2.INTER_LINEAR
+        if self.frame_pool is None:
+            return cv2.resize(luma, (self.width, self.height), interpolation=interpolation)
+        pooled = self.frame_pool.acquire((self.height, self.width), self.output_format)
+        cv2.resize(luma, (self.width, self.height), dst=pooled.array, interpolation=interpolation)
+        return pooled
+
+    def converts_with_cv2(self, frame):
+        # COLOR_YUV2BGR_I420 is BT.601 limited range with even dimensions only
+        width, height = (self.width, self.height) if self.width and self.height else (frame.width, frame.height)
+        return (frame.format.name == 'yuv420p' and frame.colorspace in FrameConverter.BT601_COLORSPACES
+                and frame.color_range != FrameConverter.FULL_RANGE and width % 2 == 0 and height % 2 == 0)
+
+    def convert_to_pool(self, frame):
+        """Converts a yuv420p frame into a pooled BGR24 array, scaling the planes into the scratch array first."""
+        cv2 = self.cv2
+        width, height = (self.width, self.height) if self.width and self.height else (frame.width, frame.height)
+        if self.yuv is None or self.yuv.shape != (height * 3 // 2, width):
+            self.yuv = np.empty((height * 3 // 2, width), np.uint8)
+        flat = self.yuv.reshape(-1)
+        offset = 0
+        for plane, (plane_width, plane_height) in zip(self.plane_views(frame),
+                                                      [(width, height)] + [(width // 2, height // 2)] * 2):
+            target = flat[offset:offset + plane_width * plane_height].reshape(plane_height, plane_width)
+            if plane.shape == target.shape:
+                np.copyto(target, plane)
+            else:
+                cv2.resize(plane, (plane_width, plane_height), dst=target, interpolation=cv2.INTER_LINEAR)
+            offset += target.size
+        pooled = self.frame_pool.acquire((height, width, 3), self.output_format)
+        cv2.cvtColor(self.yuv, cv2.COLOR_YUV2BGR_I420, dst=pooled.array)
+        return pooled
+
+    def copy_to_pool(self, planes):
+        """Copies the planes back to back into one pooled array, without a temporary in between."""
+        shape = planes[0].shape
+        if len(planes) == 3:
+            shape = (shape[0] * 3 // 2, shape[1])
+        pooled = self.frame_pool.acquire(shape, self.output_format)
+        flat = pooled.array.reshape(-1)
+        offset = 0
+        for plane in planes:
+            np.copyto(flat[offset:offset + plane.size].reshape(plane.shape), plane)
+            offset += plane.size
+        return pooled
+
+    @staticmethod
+    def plane_views(frame):
+        """Arrays over the frame's own plane buffers without the line padding, they keep the frame alive."""
+        views = []
+        for plane in frame.planes:
+            rows = np.frombuffer(plane, np.uint8).reshape(-1, plane.line_size)
+            views.append(rows[:plane.height, :plane.width])
+        return views
+
+
+class StreamingDecoder:
+    """
+    Long-lived H.264 decoder that keeps one codec context per connection.
+    Units are fed one at a time, so every call only decodes the picture
+    carried by that unit instead of the whole GOP. Decoded frames go through
+    a FrameConverter, see there for the output options.
+    """
+
+    def __init__(self, output_format=OutputFormat.BGR24, width=None, height=None, frame_pool=None):
+        import av
+        self.av = av
+        self.codec = av.CodecContext.create('h264', 'r')
+        self.codec.flags |= av.codec.context.Flags.LOW_DELAY
+        self.converter = FrameConverter(output_format, width, height, frame_pool)
+        # Parameter sets and SEI are held back until the next slice arrives,
+        # the decoder rejects packets that carry no picture data
+        self.pending = bytearray()
+
+    def decode(self, h264_unit: H264Unit):
+        if h264_unit.type not in (H264Unit.NALUType.IFR, H264Unit.NALUType.PFR):
+            self.pending.extend(h264_unit.data)
+            return []
+
+        if self.pending:
+            self.pending.extend(h264_unit.data)
+            packet = self.av.Packet(bytes(self.pending))
+            self.pending.clear()
+        else:
+            packet = self.av.Packet(bytes(h264_unit.data))
+        return self._decode_packet(packet)
+
+    def decode_data(self, frame_data):
+        # Builder output that already bundles parameter sets with a slice
+        return self._decode_packet(self.av.Packet(bytes(frame_data)))
+
+    def flush(self):
+        return self._decode_packet(None)
+
+    def _decode_packet(self, packet):
+        try:
+            frames = self.codec.decode(packet)
+        except self.av.error.FFmpegError as e:
+            print(f"Failed to decode unit: {e}")
+            return []
+        return [self.converter.convert(frame) for frame in frames]
+
+    def close(self):
+        self.pending.clear()
+        self.codec = None
+
+
+def warm_up(decoder_count=1, frame_pool=None, frame_shapes=(), **decoder_options):
+    """
+    Loads the codec libraries, opens decoder_count StreamingDecoders and fills
+    frame_pool with arrays for every (shape, pixel_format) in frame_shapes.
+    Call it before the server accepts connections and hand the decoders to
+    the first sessions, so the first frames do not pay for any of it.
+    """
+    decoders = []
+    for _ in range(decoder_count):
+        decoder = StreamingDecoder(frame_pool=frame_pool, **decoder_options)
+        decoder.codec.open()
+        decoders.append(decoder)
+    if frame_pool:
+        for shape, pixel_format in frame_shapes:
+            frame_pool.preallocate(shape, pixel_format)
+    return decoders
@@ -0,0 +1,75 @@
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+
+class PooledFrame:
+    """
+    Frame array borrowed from a FramePool. Releasing it (or leaving its
+    context manager) hands the array back for the next frame of the same
+    shape and format. A frame that is never released is simply garbage
+    collected, the pool only loses the chance to reuse it.
+    """
+
+    def __init__(self, pool, key, array):
+        self.pool = pool
+        self.key = key
+        self.array = array
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def release(self):
+        if self.array is not None:
+            array, self.array = self.array, None
+            self.pool.put_back(self.key, array)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class FramePool:
+    """
+    Free lists of uint8 frame arrays keyed by shape and pixel format, shared
+    by all decoders of a process. At most max_free arrays are kept per key,
+    releases beyond that are left to the garbage collector.
+    """
+
+    def __init__(self, max_free=8):
+        self.max_free = max_free
+        self.free = defaultdict(list)
+        self.lock = threading.Lock()
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self, shape, pixel_format='bgr24'):
+        key = (tuple(shape), pixel_format)
+        with self.lock:
+            free = self.free[key]
+            if free:
+                self.reused += 1
+                return PooledFrame(self, key, free.pop())
+            self.allocated += 1
+        return PooledFrame(self, key, np.empty(key[0], np.uint8))
+
+    def put_back(self, key, array):
+        with self.lock:
+            free = self.free[key]
+            if len(free) < self.max_free:
+                free.append(array)
+
+    def preallocate(self, shape, pixel_format='bgr24', count=None):
+        """Fills the free list of one key up front, so the first frames skip the allocator."""
+        frames = [self.acquire(shape, pixel_format) for _ in range(count or self.max_free)]
+        for frame in frames:
+            frame.release()
+
+    def stats(self):
+        with self.lock:
+            return {"allocated": self.allocated, "reused": self.reused,
+                    "free": sum(len(free) for free in self.free.values())}
@@ -1,47 +1,195 @@
-import select
+import queue
 import subprocess
+import threading
+
 import numpy as np
 
+from frame_decoder import OutputFormat
+from h264_unit import H264Unit
+
 
 class FrameProcessor:
-    def __init__(self, width=720, height=1280):
+    """
+    Persistent FFmpeg decoder with the pipe handled by three threads: one
+    feeds stdin, one reads fixed-size frames from stdout into a small ring of
+    preallocated buffers and one drains stderr. Writing never waits for a
+    frame to come out, so FFmpeg's internal frame delay cannot deadlock it.
+
+    FFmpeg converts to output_format and scales to output_size (width, height)
+    itself, so only the requested pixels cross the pipe. YUV420P frames come
+    out as one (height * 3 // 2, width) array holding the Y, U and V planes.
+
+    With a frame_pool.FramePool, stdout is read straight into pooled arrays
+    instead of the ring and frames are PooledFrame objects. The frame_handler
+    owns every frame it gets, without one the frame returned by
+    nal_units_to_cv2_frame belongs to the caller and frames nobody took are
+    released when a newer one arrives.
+    """
+    OUTPUT_FORMATS = (OutputFormat.BGR24, OutputFormat.GRAY8, OutputFormat.YUV420P)
+
+    def __init__(self, width=None, height=None, buffer_count=3, frame_handler=None,
+                 output_format=OutputFormat.BGR24, output_size=None, frame_pool=None):
+        if output_format not in FrameProcessor.OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format {output_format}")
+        self.output_format = output_format
+        self.output_size = output_size
+        self.width = None
+        self.height = None
+        self.frame_size = None
+        self.process = None
+        self.input_queue = None
+        self.threads = []
+        # Decoded frames are views of these buffers, a frame stays valid until
+        # buffer_count newer frames have been read
+        self.buffer_count = buffer_count
+        self.buffers = []
+        self.frame_pool = frame_pool
+        self.frame_handler = frame_handler  # Called on the reader thread with every decoded frame
+        self.frame_lock = threading.Lock()
+        self.latest_frame = None
+        self.frame_count = 0
+        self.returned_count = 0
+        # Without a size the process is started once the first SPS shows the stream geometry
+        if width and height:
+            self.configure(width, height)
+
+    def configure(self, width, height):
+        if self.process:
+            print(f"Resolution changed to {width}x{height}, restarting FFmpeg")
+            self.close()
         self.width = width
         self.height = height
-        # Initialize the FFmpeg process once
+        shape = self.frame_shape(*(self.output_size or (width, height)))
+        self.frame_size = int(np.prod(shape))
+        if self.frame_pool:
+            self.frame_pool.preallocate(shape, self.output_format, self.buffer_count)
+        else:
+            self.buffers = [np.empty(shape, np.uint8) for _ in range(self.buffer_count)]
+        self.input_queue = queue.Queue(maxsize=64)
+        scale = ['-s', '{}x{}'.format(*self.output_size)] if self.output_size else []
+        # Initialize the FFmpeg process once per resolution
         self.process = subprocess.Popen(
             [
                 'ffmpeg',
+                '-loglevel', 'error', '-nostats',
+                '-flags', 'low_delay',  # Output frames as soon as they are decoded
+                '-probesize', '32', '-analyzeduration', '0',
                 '-f', 'h264',  # Specify raw H.264 input format
                 '-i', 'pipe:0',  # Read from standard input
-                '-pix_fmt', 'bgr24',  # Pixel format for OpenCV compatibility
+                '-pix_fmt', self.output_format,
+                *scale,  # Scaled by libswscale inside FFmpeg
                 '-f', 'rawvideo',  # Output as raw video
                 'pipe:1'  # Output to standard output
             ],
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            bufsize=10 ** 6  # Set buffer size to handle high data rate
+            stderr=subprocess.PIPE
         )
+        if self.frame_pool:
+            reader = threading.Thread(target=self.read_pooled_frames, args=(self.process, shape), daemon=True)
+        else:
+            reader = threading.Thread(target=self.read_frames, args=(self.process, self.buffers), daemon=True)
+        self.threads = [
+            threading.Thread(target=self.write_input, args=(self.process, self.input_queue), daemon=True),
+            reader,
+            threading.Thread(target=self.drain_stderr, args=(self.process,), daemon=True)
+        ]
+        for thread in self.threads:
+            thread.start()
 
-    def nal_units_to_cv2_frame(self, frame_data):
+    def frame_shape(self, width, height):
+        if self.output_format == OutputFormat.YUV420P:
+            return height * 3 // 2, width
+        if self.output_format == OutputFormat.GRAY8:
+            return height, width
+        return height, width, 3
+
+    def write_input(self, process, input_queue):
+        while True:
+            frame_data = input_queue.get()
+            if frame_data is None:
+                break
+            try:
+                process.stdin.write(frame_data)
+                process.stdin.flush()
+            except (BrokenPipeError, ValueError) as e:
+                print(f"FFmpeg input closed: {e}")
+                break
         try:
-            # Write frame data to FFmpeg process stdin
-            self.process.stdin.write(frame_data)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
 
-            # Read one frame from FFmpeg's stdout
-            in_bytes = self.process.stdout.read(self.width * self.height * 3)
-            if not in_bytes:
-                return None  # No data received, possibly end of stream or error
+    def read_frames(self, process, buffers):
+        index = 0
+        while True:
+            frame = buffers[index % len(buffers)]
+            if not self.read_exactly(process.stdout, memoryview(frame).cast('B')):
+                break
+            with self.frame_lock:
+                self.latest_frame = frame
+                self.frame_count += 1
+            if self.frame_handler:
+                self.frame_handler(frame)
+            index += 1
 
-            # Convert to numpy array and reshape for OpenCV
-            frame = np.frombuffer(in_bytes, np.uint8).reshape([self.height, self.width, 3])
-            return frame
+    def read_pooled_frames(self, process, shape):
+        while True:
+            frame = self.frame_pool.acquire(shape, self.output_format)
+            if not self.read_exactly(process.stdout, memoryview(frame.array).cast('B')):
+                frame.release()
+                break
+            if self.frame_handler:
+                with self.frame_lock:
+                    self.frame_count += 1
+                self.frame_handler(frame)
+                continue
+            with self.frame_lock:
+                if self.latest_frame is not None and self.returned_count != self.frame_count:
+                    self.latest_frame.release()
+                self.latest_frame = frame
+                self.frame_count += 1
 
-        except Exception as e:
-            print(f"Error in processing frame: {e}")
+    @staticmethod
+    def read_exactly(stream, view):
+        position = 0
+        while position < len(view):
+            size = stream.readinto(view[position:])
+            if not size:
+                return False
+            position += size
+        return True
+
+    def drain_stderr(self, process):
+        for line in process.stderr:
+            print(f"FFmpeg error output: {line.decode(errors='replace').rstrip()}")
+
+    def nal_units_to_cv2_frame(self, frame_data):
+        """Queues frame data for decoding and returns the newest frame decoded since the last call, or None."""
+        sps_info = H264Unit.find_sps(frame_data)
+        if sps_info and sps_info.resolution != (self.width, self.height):
+            self.configure(*sps_info.resolution)
+        if not self.process:
+            print("Missing SPS")
             return None
 
+        self.input_queue.put(bytes(frame_data))
+
+        with self.frame_lock:
+            if self.frame_count == self.returned_count:
+                return None
+            self.returned_count = self.frame_count
+            return self.latest_frame
+
     def close(self):
-        # Close FFmpeg process streams
-        self.process.stdout.close()
+        if not self.process:
+            return
+        # Closing stdin lets FFmpeg flush the remaining frames and exit
+        self.input_queue.put(None)
+        for thread in self.threads:
+            thread.join(timeout=5)
         self.process.wait()
+        self.process.stdout.close()
+        self.process.stderr.close()
+        self.process = None
+        self.threads = []
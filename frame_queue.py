@@ -0,0 +1,69 @@
+import queue
+import threading
+from collections import deque
+
+
+class FrameQueue:
+    """
+    Bounded hand-off between decoding and frame consumers.
+
+    The policy decides what happens when the consumer falls behind:
+    DROP_OLDEST discards the oldest queued frame, LATEST_ONLY keeps nothing
+    but the newest frame and BLOCK makes the producer wait for space.
+    Every frame that is dropped, or not queued because BLOCK timed out, is
+    passed to drop_handler on the producer's thread.
+    """
+    DROP_OLDEST = 'drop_oldest'
+    LATEST_ONLY = 'latest_only'
+    BLOCK = 'block'
+
+    def __init__(self, maxsize=4, policy=DROP_OLDEST):
+        if policy not in (FrameQueue.DROP_OLDEST, FrameQueue.LATEST_ONLY, FrameQueue.BLOCK):
+            raise ValueError(f"Unknown frame queue policy: {policy}")
+        self.policy = policy
+        self.maxsize = 1 if policy == FrameQueue.LATEST_ONLY else maxsize
+        self.frames = deque()
+        self.condition = threading.Condition()
+        self.put_count = 0
+        self.dropped_count = 0
+        self.drop_handler = None  # Called with frames that never reach a consumer, e.g. to release them
+
+    def put(self, frame, timeout=None):
+        """Queues a frame, returns False if it was not queued because BLOCK timed out."""
+        dropped = None
+        queued = True
+        with self.condition:
+            if self.policy == FrameQueue.BLOCK:
+                if not self.condition.wait_for(lambda: len(self.frames) < self.maxsize, timeout):
+                    self.dropped_count += 1
+                    dropped = frame
+                    queued = False
+            elif len(self.frames) >= self.maxsize:
+                dropped = self.frames.popleft()
+                self.dropped_count += 1
+
+            if queued:
+                self.frames.append(frame)
+                self.put_count += 1
+                self.condition.notify_all()
+        # Outside the lock, the handler may take its time
+        if dropped is not None and self.drop_handler:
+            self.drop_handler(dropped)
+        return queued
+
+    def get(self, timeout=None):
+        """Returns the next frame, raises queue.Empty if none arrived within timeout."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.frames, timeout):
+                raise queue.Empty
+            frame = self.frames.popleft()
+            self.condition.notify_all()
+            return frame
+
+    def qsize(self):
+        with self.condition:
+            return len(self.frames)
+
+    def stats(self):
+        with self.condition:
+            return {"queued": len(self.frames), "put": self.put_count, "dropped": self.dropped_count}
@@ -0,0 +1,202 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from frame_decoder import FrameConverter, OutputFormat, StreamingDecoder
+from h264_unit import H264Unit
+
+
+class H264Converter:
+    """
+    Converts a stream of H264 units into frames through a fixed pipeline:
+
+    - one decode thread feeds a persistent StreamingDecoder from a bounded
+      input queue, in arrival order;
+    - worker_count threads convert the decoded frames to output_format, in
+      parallel since libswscale runs without the GIL;
+    - one delivery thread hands the frames out in decode order, to
+      sample_buffer_callback or to the async iterator of frames().
+
+    convert blocks while max_pending units are queued, so a producer faster
+    than the pipeline is slowed down instead of piling up threads or memory.
+
+    Without a sample_buffer_callback, frames wait for frames() to take them,
+    max_pending of them before the pipeline backs up. An exception from the
+    decoder or a frame consumer stops delivery, the threads keep draining
+    and the next convert or close raises it.
+    """
+    _CLOSE = object()
+
+    def __init__(self, worker_count=2, max_pending=64, output_format=OutputFormat.BGR24, width=None, height=None):
+        self.worker_count = worker_count
+        self.max_pending = max_pending
+        self.output_format = output_format
+        self.width = width
+        self.height = height
+        self.sample_buffer_callback = None  # Called on the delivery thread with every frame
+        self.input_queue = queue.Queue(maxsize=max_pending)
+        # Conversions in flight, in decode order, bounded like the input
+        self.conversions = queue.Queue(maxsize=max_pending)
+        self.frame_sink = None  # Set by frames()
+        # Frames waiting for frames() to attach, and whether the last of them has been delivered
+        self.undelivered = deque()
+        self.delivered_all = False
+        self.closing = False
+        self.sink_condition = threading.Condition()
+        self.error = None  # First exception of the decode or delivery thread
+        self.converters = threading.local()
+        self.executor = None
+        self.threads = []
+        self.start_lock = threading.Lock()
+        self.frame_count = 0
+
+    def start(self):
+        with self.start_lock:
+            if self.threads:
+                return
+            self.executor = ThreadPoolExecutor(self.worker_count, thread_name_prefix='h264-convert')
+            self.threads = [threading.Thread(target=self.decode_loop, daemon=True),
+                            threading.Thread(target=self.deliver_loop, daemon=True)]
+            for thread in self.threads:
+                thread.start()
+
+    def convert(self, h264_unit: H264Unit, timeout=None):
+        """Queues a unit, returns False if the pipeline stayed full for timeout seconds."""
+        self.raise_error()
+        self.start()
+        try:
+            self.input_queue.put(h264_unit, timeout=timeout)
+        except queue.Full:
+            return False
+        return True
+
+    def decode_loop(self):
+        # The decoder hands out av.VideoFrames, the workers convert them
+        decoder = StreamingDecoder(OutputFormat.FRAME)
+        while True:
+            h264_unit = self.input_queue.get()
+            try:
+                frames = decoder.flush() if h264_unit is H264Converter._CLOSE else decoder.decode(h264_unit)
+            except Exception as e:
+                self.fail(e)
+                frames = []
+            for frame in frames:
+                self.conversions.put(self.executor.submit(self.convert_frame, frame))
+            if h264_unit is H264Converter._CLOSE:
+                break
+        decoder.close()
+        self.conversions.put(H264Converter._CLOSE)
+
+    def convert_frame(self, frame):
+        converter = getattr(self.converters, 'converter', None)
+        if converter is None:
+            converter = self.converters.converter = FrameConverter(self.output_format, self.width, self.height)
+        return converter.convert(frame)
+
+    def deliver_loop(self):
+        while True:
+            conversion = self.conversions.get()
+            if conversion is H264Converter._CLOSE:
+                break
+            try:
+                frame = conversion.result()
+            except Exception as e:
+                print(f"Failed to convert frame: {e}")
+                continue
+            self.frame_count += 1
+            if self.error is not None:
+                # Keep draining so convert and close never block on a failed pipeline
+                continue
+            try:
+                self.deliver(frame)
+            except Exception as e:
+                self.fail(e)
+        with self.sink_condition:
+            self.delivered_all = True
+            sink = self.frame_sink
+        if sink:
+            sink(H264Converter._CLOSE)
+
+    def deliver(self, frame):
+        if self.sample_buffer_callback:
+            self.sample_buffer_callback(frame)
+            return
+        with self.sink_condition:
+            sink = self.frame_sink
+            if sink is None:
+                self.undelivered.append(frame)
+                # Backs up the pipeline until frames() attaches, or close() gives up on it
+                self.sink_condition.wait_for(lambda: len(self.undelivered) < self.max_pending
+                                             or self.frame_sink is not None or self.closing)
+                return
+        sink(frame)
+
+    def fail(self, error):
+        print(f"H264Converter failed: {error!r}")
+        if self.error is None:
+            self.error = error
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def frames(self, max_buffered=8):
+        """
+        Returns an async iterator of the converted frames, in order, until
+        close() has flushed the decoder. Frames decoded before the call are
+        buffered for it. close() waits for the frames to be taken, call it
+        from another thread (or run_in_executor) than the one iterating.
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        frames = asyncio.Queue(max_buffered)
+
+        def put(frame):
+            # Waits for the consumer, so a slow iterator backs up the pipeline too
+            asyncio.run_coroutine_threadsafe(frames.put(frame), loop).result()
+
+        with self.sink_condition:
+            buffered = list(self.undelivered)
+            self.undelivered.clear()
+            finished = self.delivered_all
+            self.frame_sink = put
+            self.sink_condition.notify_all()
+
+        async def iterate():
+            for frame in buffered:
+                yield frame
+            if finished:
+                return
+            while True:
+                frame = await frames.get()
+                if frame is H264Converter._CLOSE:
+                    return
+                yield frame
+
+        return iterate()
+
+    def close(self):
+        """Flushes the decoder, delivers the remaining frames and stops the threads."""
+        if not self.threads:
+            self.raise_error()
+            return
+        with self.sink_condition:
+            # Frames nobody asked for stay in undelivered for a later frames()
+            self.closing = True
+            self.sink_condition.notify_all()
+        self.input_queue.put(H264Converter._CLOSE)
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self.executor.shutdown()
+        self.threads = []
+        self.raise_error()
+
+
+# Example usage
+def sample_buffer_callback(frame):
+    print("Received frame with shape:", frame.shape)
+
+
+h264_converter = H264Converter()
@@ -1,8 +1,4 @@
 import struct
-import threading
-
-import ffmpeg
-import numpy as np
 
 
 class H264Unit:
@@ -11,23 +7,32 @@ class H264Unit:
         PPS = 'pps'
         IFR = 'ifr'
         PFR = 'pfr'
-
-    def __init__(self, payload: bytes):
+        SEI = 'sei'
+        AUD = 'aud'
+
+    type_map = {
+        7: NALUType.SPS,
+        8: NALUType.PPS,
+        5: NALUType.IFR,
+        1: NALUType.PFR,
+        6: NALUType.SEI,
+        9: NALUType.AUD
+    }
+
+    def __init__(self, payload: bytes, header_offset=4):
         self.payload = payload
-        self.type_number = payload[4] & 0x1F
+        # Length of the start code in front of the NAL header, 3 or 4 bytes
+        self.header_offset = header_offset
+        self.type_number = payload[header_offset] & 0x1F
         self.length_data = None
         self.byte_length = None
+        self._rbsp = None
+        self._sps_info = None
 
-        type_map = {
-            7: H264Unit.NALUType.SPS,
-            8: H264Unit.NALUType.PPS,
-            5: H264Unit.NALUType.IFR,
-            1: H264Unit.NALUType.PFR
-        }
-        self.type = type_map.get(self.type_number)
+        self.type = H264Unit.type_map.get(self.type_number)
 
-        if self.type == H264Unit.NALUType.IFR or self.type == H264Unit.NALUType.PFR:
-            nalu_length = len(payload[4:])
+        if self.is_slice:
+            nalu_length = len(payload) - header_offset
             # Convert the length to a 4-byte big-endian format
             self.length_data = struct.pack('>I', nalu_length)
             self.byte_length = nalu_length
@@ -38,79 +43,168 @@ class H264Unit:
         #     return self.length_data + self.payload
         return self.payload
 
+    def detach(self):
+        """Copies a payload that is a view of a receive buffer, for units kept after their handler returns."""
+        if isinstance(self.payload, memoryview):
+            self.payload = bytes(self.payload)
+        return self
 
-class H264Converter:
-    def __init__(self):
-        self.sps = None
-        self.pps = None
-        self.description = None
-        self.sample_buffer_callback = None
-        self.lock = threading.Lock()
-
-    def create_description(self, h264_format: H264Unit):
-        if h264_format.type == 'sps':
-            self.sps = h264_format
-        elif h264_format.type == 'pps':
-            self.pps = h264_format
-
-        if self.sps and self.pps:
-            # Build a description from SPS and PPS
-            # SPS and PPS are parameter sets used in H264; we would typically pass them to a decoder.
-            self.description = (self.sps.data, self.pps.data)
-            print("Description created with SPS and PPS.")
-
-    def create_block_buffer(self, h264_format: H264Unit) -> bytes:
+    @property
+    def rbsp(self):
         """
-        Allocates memory for the H264 frame data to simulate a block buffer.
-        In Python, this can be handled with a simple copy of the data,
-        but the purpose is to emulate the concept of a block buffer.
+        Unit payload after the NAL header with emulation prevention bytes removed.
+        Built on first access only, so units that are just passed along never pay for it.
         """
-        # Allocate a memory block and copy the data
-        block_buffer = bytes(h264_format.data)  # Copy the data to ensure isolated block buffer
-        return block_buffer
-
-    def create_sample_buffer(self, block_buffer: bytes) -> np.ndarray:
-        try:
-            # Decode block buffer using ffmpeg-python, which wraps FFmpeg
-            out, err = (
-                ffmpeg
-                .input('pipe:', format='h264')  # Input from raw H264 byte stream
-                .output('pipe:', format='rawvideo', pix_fmt='rgb24')  # Convert to RGB frames
-                .run(input=block_buffer, capture_stdout=True, capture_stderr=True)
-            )
-
-            # Convert to numpy array for the resulting frame
-            video_frame = np.frombuffer(out, np.uint8).reshape([-1, 3])  # Adjust shape to frame dimensions if known
-            return video_frame
-        except ffmpeg.Error as e:
-            print("Failed to create sample buffer:", e)
-            return None
-
-    def convert(self, h264_unit: H264Unit):
-        # Run conversion in a separate thread (similar to DispatchQueue)
-        threading.Thread(target=self._convert_async, args=(h264_unit,)).start()
+        if self._rbsp is None:
+            self._rbsp = bytes(self.payload[self.header_offset + 1:]).replace(b'\x00\x00\x03', b'\x00\x00')
+        return self._rbsp
 
-    def _convert_async(self, h264_unit: H264Unit):
-        with self.lock:
-            if h264_unit.type in ['sps', 'pps']:
-                self.description = None
-                self.create_description(h264_unit)
-                return
-            else:
-                self.sps = None
-                self.pps = None
-
-            block_buffer = self.create_block_buffer(h264_unit)
-            sample_buffer = self.create_sample_buffer(block_buffer)
+    @property
+    def is_slice(self):
+        return self.type == H264Unit.NALUType.IFR or self.type == H264Unit.NALUType.PFR
 
-            if sample_buffer is not None and self.sample_buffer_callback:
-                # Call the callback with the sample buffer (numpy array frame)
-                self.sample_buffer_callback(sample_buffer)
+    @property
+    def nal_ref_idc(self):
+        """0 for units no other picture references, non-reference slices can be dropped without breaking decoding."""
+        return (self.payload[self.header_offset] >> 5) & 0x03
 
+    @property
+    def first_mb_in_slice(self):
+        """First macroblock of a slice, 0 for the first slice of a picture."""
+        if not self.is_slice:
+            return None
+        # The field leads the slice header, a short prefix is enough to read it
+        start = self.header_offset + 1
+        prefix = bytes(self.payload[start:start + 8]).replace(b'\x00\x00\x03', b'\x00\x00')
+        return BitReader(prefix).read_ue()
 
-# Example usage
-def sample_buffer_callback(frame):
-    print("Received frame with shape:", frame.shape)
+    @property
+    def sps_info(self):
+        if self.type != H264Unit.NALUType.SPS:
+            return None
+        if self._sps_info is None:
+            self._sps_info = SPSInfo(self.rbsp)
+        return self._sps_info
+
+    @staticmethod
+    def find_sps(frame_data):
+        """Returns SPSInfo of the first SPS in Annex-B data, looking no further than the first slice."""
+        index = frame_data.find(b'\x00\x00\x01')
+        while 0 <= index < len(frame_data) - 3:
+            type_number = frame_data[index + 3] & 0x1F
+            if type_number in (1, 5):
+                return None
+            next_index = frame_data.find(b'\x00\x00\x01', index + 3)
+            if type_number == 7:
+                end = len(frame_data) if next_index < 0 else next_index
+                try:
+                    return H264Unit(frame_data[index:end], 3).sps_info
+                except ValueError:
+                    # Truncated SPS at the end of a partial chunk
+                    return None
+            index = next_index
+        return None
+
+
+class BitReader:
+    """Reads fixed-width and exp-Golomb coded fields from RBSP data."""
+
+    def __init__(self, data: bytes):
+        self.value = int.from_bytes(data, 'big')
+        self.bit_count = len(data) * 8
+        self.position = 0
+
+    def read_bits(self, count):
+        if self.position + count > self.bit_count:
+            raise ValueError("Read past the end of the RBSP")
+        self.position += count
+        return (self.value >> (self.bit_count - self.position)) & ((1 << count) - 1)
+
+    def read_bit(self):
+        return self.read_bits(1)
+
+    def read_ue(self):
+        leading_zeros = 0
+        while not self.read_bit():
+            leading_zeros += 1
+        return (1 << leading_zeros) - 1 + self.read_bits(leading_zeros)
+
+    def read_se(self):
+        value = self.read_ue()
+        return (value + 1) // 2 if value % 2 else -(value // 2)
+
+
+class SPSInfo:
+    """Fields of a sequence parameter set that decide frame geometry."""
+    HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+
+    def __init__(self, rbsp: bytes):
+        reader = BitReader(rbsp)
+        self.profile_idc = reader.read_bits(8)
+        self.constraint_flags = reader.read_bits(8)
+        self.level_idc = reader.read_bits(8)
+        self.sps_id = reader.read_ue()
+
+        self.chroma_format_idc = 1
+        separate_colour_plane = 0
+        if self.profile_idc in SPSInfo.HIGH_PROFILES:
+            self.chroma_format_idc = reader.read_ue()
+            if self.chroma_format_idc == 3:
+                separate_colour_plane = reader.read_bit()
+            reader.read_ue()  # bit_depth_luma_minus8
+            reader.read_ue()  # bit_depth_chroma_minus8
+            reader.read_bit()  # qpprime_y_zero_transform_bypass_flag
+            if reader.read_bit():  # seq_scaling_matrix_present_flag
+                for i in range(8 if self.chroma_format_idc != 3 else 12):
+                    if reader.read_bit():
+                        self.skip_scaling_list(reader, 16 if i < 6 else 64)
+
+        reader.read_ue()  # log2_max_frame_num_minus4
+        pic_order_cnt_type = reader.read_ue()
+        if pic_order_cnt_type == 0:
+            reader.read_ue()  # log2_max_pic_order_cnt_lsb_minus4
+        elif pic_order_cnt_type == 1:
+            reader.read_bit()  # delta_pic_order_always_zero_flag
+            reader.read_se()  # offset_for_non_ref_pic
+            reader.read_se()  # offset_for_top_to_bottom_field
+            for _ in range(reader.read_ue()):
+                reader.read_se()  # offset_for_ref_frame
+
+        self.max_num_ref_frames = reader.read_ue()
+        reader.read_bit()  # gaps_in_frame_num_value_allowed_flag
+        width_in_mbs = reader.read_ue() + 1
+        height_in_map_units = reader.read_ue() + 1
+        self.frame_mbs_only = reader.read_bit()
+        if not self.frame_mbs_only:
+            reader.read_bit()  # mb_adaptive_frame_field_flag
+        reader.read_bit()  # direct_8x8_inference_flag
+
+        self.crop = (0, 0, 0, 0)  # left, right, top, bottom in crop units
+        if reader.read_bit():
+            self.crop = (reader.read_ue(), reader.read_ue(), reader.read_ue(), reader.read_ue())
+
+        if separate_colour_plane or self.chroma_format_idc == 0:
+            crop_unit_x, crop_unit_y = 1, 2 - self.frame_mbs_only
+        else:
+            crop_unit_x = 1 if self.chroma_format_idc == 3 else 2
+            crop_unit_y = (2 if self.chroma_format_idc == 1 else 1) * (2 - self.frame_mbs_only)
+
+        left, right, top, bottom = self.crop
+        self.width = width_in_mbs * 16 - crop_unit_x * (left + right)
+        self.height = (2 - self.frame_mbs_only) * height_in_map_units * 16 - crop_unit_y * (top + bottom)
+
+    @staticmethod
+    def skip_scaling_list(reader: BitReader, size):
+        last_scale, next_scale = 8, 8
+        for _ in range(size):
+            if next_scale:
+                next_scale = (last_scale + reader.read_se() + 256) % 256
+            last_scale = next_scale or last_scale
 
+    @property
+    def resolution(self):
+        return self.width, self.height
 
-h264_converter = H264Converter()
\ No newline at end of file
+    def __repr__(self):
+        return (f"SPSInfo(profile={self.profile_idc}, level={self.level_idc}, "
+                f"width={self.width}, height={self.height})")
@@ -0,0 +1,121 @@
+from h264_unit import H264Unit
+from nalu_parser import NALUParser
+
+
+class IngestBuffer:
+    """
+    Fixed-capacity receive buffer and Annex-B parser of one connection, a
+    drop-in for NALUParser that never grows. The server receives straight
+    into writable() and reports the size with commit(), units are handed out
+    as memoryviews of the buffer.
+
+    A unit's payload is only valid during the h264_unit_handler call, the
+    next commit may move new data over it. Code that keeps a unit longer
+    calls H264Unit.detach() first.
+
+    Data is moved back to the front of the buffer once the free space at the
+    end drops below a quarter of the capacity. A unit that does not fit the
+    whole buffer is an overflow: RESYNC drops it and resumes at the next start
+    code, DISCONNECT raises OverflowError so the server closes the connection.
+    """
+    RESYNC = 'resync'
+    DISCONNECT = 'disconnect'
+
+    def __init__(self, capacity=4 << 20, overflow=RESYNC, short_start_codes=True):
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.capacity = capacity
+        self.overflow = overflow
+        self.short_start_codes = short_start_codes
+        self.pattern_length = 3 if short_start_codes else 4
+        self.read_index = 0  # Start of the unit that is still being received
+        self.search_index = 0  # Where the next start code search resumes
+        self.write_index = 0  # End of the received data
+        self.start_code_length = 0  # Start code length of the current unit, 0 before the first one
+        self.h264_unit_handler = None  # Callback for parsed H264 units
+        self.pending_slices = 0  # Like NALUParser.pending_slices
+        self.overflow_count = 0
+        self.discarded_bytes = 0  # Garbage in front of start codes and units dropped by overflows
+
+    def writable(self):
+        """Free space at the end of the buffer, compacted or resynchronized first when needed."""
+        if self.capacity - self.write_index < self.capacity // 4 and self.read_index:
+            self.compact()
+        if self.write_index == self.capacity:
+            self.handle_overflow()
+        return self.view[self.write_index:]
+
+    def commit(self, size, count):
+        """Parses size bytes just received into writable()."""
+        self.write_index += size
+        units = []
+        while True:
+            index, start_code_length = self.find_start_code()
+            if index < 0:
+                # Keep the tail searchable, a start code may be split across receives
+                self.search_index = max(self.search_index, self.write_index - self.pattern_length + 1)
+                if not self.start_code_length:
+                    # No unit started yet, everything in front of the last bytes of a
+                    # possible 4-byte start code is garbage
+                    self.discard_to(self.write_index - 3)
+                break
+            if self.start_code_length and index > self.read_index + self.start_code_length:
+                units.append(H264Unit(self.view[self.read_index:index], self.start_code_length))
+            elif not self.start_code_length:
+                self.discard_to(index)
+            self.read_index = index
+            self.start_code_length = start_code_length
+            self.search_index = index + start_code_length
+
+        if self.h264_unit_handler:
+            self.pending_slices = sum(1 for unit in units if unit.is_slice)
+            for unit in units:
+                if unit.is_slice:
+                    self.pending_slices -= 1
+                if unit.type is not None:
+                    self.h264_unit_handler(unit, count)
+
+    def enqueue(self, data, count):
+        """NALUParser interface for servers that receive into their own buffer, copies data in."""
+        data = memoryview(data)
+        while data:
+            view = self.writable()
+            size = min(len(view), len(data))
+            view[:size] = data[:size]
+            data = data[size:]
+            self.commit(size, count)
+
+    def find_start_code(self):
+        buffer = self.buffer
+        if not self.short_start_codes:
+            return buffer.find(NALUParser.START_CODE, self.search_index, self.write_index), 4
+
+        index = buffer.find(NALUParser.SHORT_START_CODE, self.search_index, self.write_index)
+        if index > self.read_index and buffer[index - 1] == 0:
+            return index - 1, 4
+        return index, 3
+
+    def discard_to(self, index):
+        if index > self.read_index:
+            self.discarded_bytes += index - self.read_index
+            self.read_index = index
+
+    def compact(self):
+        # Moves the unfinished unit to the front, the units handed out before are done with
+        size = self.write_index - self.read_index
+        tail = self.view[self.read_index:self.write_index]
+        # Slice assignment copies with memcpy, overlapping ranges go through a temporary
+        self.buffer[:size] = tail if self.read_index >= size else bytes(tail)
+        self.search_index = max(self.search_index - self.read_index, 0)
+        self.write_index = size
+        self.read_index = 0
+
+    def handle_overflow(self):
+        self.overflow_count += 1
+        if self.overflow == IngestBuffer.DISCONNECT:
+            raise OverflowError(f"Unit larger than the {self.capacity} byte ingest buffer")
+        # Drop the unit but keep the tail, it may hold the start of the next start code
+        self.discard_to(self.write_index - 3)
+        self.start_code_length = 0
+        self.compact()
+        print(f"Ingest buffer overflow, dropped a unit larger than {self.capacity} bytes")
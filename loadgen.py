@@ -0,0 +1,297 @@
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import resource
+import socket
+import sys
+import threading
+import time
+
+from access_unit import AccessUnitAssembler
+from bench import git_commit, parse_units, synthesize_stream
+from metrics import Histogram, StreamMetrics
+from overload import OverloadController
+from server import TCPServer
+from session import StreamSession
+
+
+def split_pictures(stream):
+    """Splits an Annex-B stream into one bytes object per picture, parameter sets stay with their IDR."""
+    pictures = []
+    assembler = AccessUnitAssembler()
+    assembler.access_unit_handler = lambda access_unit: pictures.append(access_unit.data)
+    for unit in parse_units([stream]):
+        assembler.push(unit)
+    assembler.flush()
+    return pictures
+
+
+class CameraSender:
+    """
+    Plays a precomputed stream in a loop at fps to a server, the way a camera
+    on a real network would:
+
+    - pictures are written coalesced and cut into segments of segment_size
+      bytes, like Nagle's algorithm does with small writes, so units arrive
+      split at arbitrary points;
+    - with burst_probability per picture the sender stalls for up to
+      burst_frames pictures and then writes them all at once;
+    - every reconnect_interval seconds the connection is closed and reopened,
+      the stream then restarts at its first IDR.
+    """
+
+    def __init__(self, pictures, host, port, fps=30, segment_size=1448, burst_probability=0.0,
+                 burst_frames=10, reconnect_interval=None, seed=None):
+        self.pictures = pictures
+        self.host = host
+        self.port = port
+        self.fps = fps
+        self.segment_size = segment_size
+        self.burst_probability = burst_probability
+        self.burst_frames = burst_frames
+        self.reconnect_interval = reconnect_interval
+        self.random = random.Random(seed)
+        self.stopped = threading.Event()
+        self.thread = None
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.connections = 0
+        self.bursts = 0
+        self.errors = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                with socket.create_connection((self.host, self.port)) as connection:
+                    self.connections += 1
+                    self.send_until_reconnect(connection)
+            except OSError:
+                # Server restarted or refused us, retry like a camera would
+                self.errors += 1
+                self.stopped.wait(1)
+
+    def send_until_reconnect(self, connection):
+        interval = 1 / self.fps
+        started = next_frame = time.monotonic()
+        index = 0
+        pending = bytearray()
+        held_back = 0
+        while not self.stopped.is_set():
+            if self.reconnect_interval and time.monotonic() - started >= self.reconnect_interval:
+                break
+            picture = self.pictures[index % len(self.pictures)]
+            index += 1
+            pending += picture
+            self.frames_sent += 1
+
+            if held_back:
+                held_back -= 1
+            elif self.burst_probability and self.random.random() < self.burst_probability:
+                held_back = self.random.randint(1, self.burst_frames)
+                self.bursts += 1
+            if not held_back:
+                self.send_segments(connection, pending)
+                pending = bytearray()
+
+            next_frame += interval
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                self.stopped.wait(delay)
+        if pending:
+            self.send_segments(connection, pending)
+
+    def send_segments(self, connection, data):
+        view = memoryview(data)
+        for position in range(0, len(view), self.segment_size):
+            connection.sendall(view[position:position + self.segment_size])
+        self.bytes_sent += len(data)
+
+
+class SoakHarness:
+    """
+    Runs stream_count CameraSenders against a TCPServer on localhost whose
+    sessions parse, build and decode every stream, and samples CPU time, RSS,
+    frame rates, drops and latency every sample_interval seconds. Samples are
+    scheduled on clock and waited for with sleep, both replaceable in tests.
+    """
+
+    def __init__(self, pictures, stream_count=4, overload=False, max_fps=None, sample_interval=10,
+                 clock=time.monotonic, sleep=time.sleep, **sender_options):
+        self.pictures = pictures
+        self.stream_count = stream_count
+        self.overload = overload
+        self.max_fps = max_fps
+        self.sample_interval = sample_interval
+        self.clock = clock
+        self.sleep = sleep
+        self.sender_options = sender_options
+        self.server = TCPServer(host='127.0.0.1', port=0)
+        self.server.session_factory = self.create_session
+        self.lock = threading.Lock()
+        self.stream_metrics = []  # Every session's metrics, closed sessions included
+        self.senders = []
+        self.samples = []
+
+    def create_session(self, addr):
+        metrics = StreamMetrics(f"{addr[0]}:{addr[1]}")
+        overload = OverloadController(self.max_fps, metrics=metrics) if self.overload else None
+        with self.lock:
+            self.stream_metrics.append(metrics)
+        # StreamSession.close marks its metrics closed, which is all the harness needs to know
+        return StreamSession(addr, metrics=metrics, overload=overload)
+
+    def run(self, duration):
+        self.server.start()
+        self.senders = [CameraSender(self.pictures, '127.0.0.1', self.server.port, seed=index, **self.sender_options)
+                        for index in range(self.stream_count)]
+        for sender in self.senders:
+            sender.start()
+
+        start = self.clock()
+        last = (start, cpu_seconds(), 0, 0)
+        # One sample per interval and a last, shorter one at the end, however late the sleeps wake up
+        for index in range(1, math.ceil(duration / self.sample_interval) + 1):
+            self.sleep(max(0.0, start + min(index * self.sample_interval, duration) - self.clock()))
+            last = self.sample(start, last)
+
+        for sender in self.senders:
+            sender.stop()
+        # Sessions close once their connection has been read to the end
+        deadline = time.monotonic() + 10
+        while not self.all_closed() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.server.stop()
+        return self.report(duration)
+
+    def all_closed(self):
+        with self.lock:
+            return all(metrics.closed for metrics in self.stream_metrics)
+
+    def sample(self, start, last):
+        now = self.clock()
+        cpu = cpu_seconds()
+        sent = sum(sender.frames_sent for sender in self.senders)
+        decoded = self.total('frames_decoded')
+        last_time, last_cpu, last_sent, last_decoded = last
+        elapsed = now - last_time
+        self.samples.append({
+            "elapsed_s": round(now - start, 1),
+            "cpu_percent": round((cpu - last_cpu) / elapsed * 100, 1),
+            "rss_mb": round(current_rss_mb(), 1),
+            "sent_fps": round((sent - last_sent) / elapsed, 1),
+            "decoded_fps": round((decoded - last_decoded) / elapsed, 1),
+            "frames_dropped": self.total('frames_dropped'),
+            "total_p99_ms": self.latency_ms(0.99)
+        })
+        print(f"Soak sample: {self.samples[-1]}", file=sys.stderr)
+        return now, cpu, sent, decoded
+
+    def total(self, counter):
+        with self.lock:
+            return sum(getattr(metrics, counter) for metrics in self.stream_metrics)
+
+    def latency(self):
+        """Receive to delivery latency of all sessions in one histogram."""
+        merged = Histogram()
+        with self.lock:
+            histograms = [metrics.latency.get('total') for metrics in self.stream_metrics]
+        for histogram in filter(None, histograms):
+            merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+            merged.sum += histogram.sum
+            merged.count += histogram.count
+        return merged
+
+    def latency_ms(self, q):
+        value = self.latency().quantile(q)
+        return None if value is None else value * 1000
+
+    def report(self, duration):
+        frames_sent = sum(sender.frames_sent for sender in self.senders)
+        frames_decoded = self.total('frames_decoded')
+        return {
+            "streams": self.stream_count,
+            "duration_s": duration,
+            "frames_sent": frames_sent,
+            "frames_decoded": frames_decoded,
+            "frames_dropped": self.total('frames_dropped'),
+            # Everything sent but not decoded, dropped on purpose or lost to reconnects and decode errors
+            "loss_rate": 1 - frames_decoded / frames_sent if frames_sent else None,
+            "bytes_sent": sum(sender.bytes_sent for sender in self.senders),
+            "connections": sum(sender.connections for sender in self.senders),
+            "bursts": sum(sender.bursts for sender in self.senders),
+            "sender_errors": sum(sender.errors for sender in self.senders),
+            "latency_p50_ms": self.latency_ms(0.5),
+            "latency_p99_ms": self.latency_ms(0.99),
+            "cpu_seconds": round(cpu_seconds(), 2),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "samples": self.samples
+        }
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def current_rss_mb():
+    try:
+        # Second field of statm is the resident set in pages, Linux only
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1 << 20)
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak the parse -> build -> decode pipeline with synthetic cameras")
+    parser.add_argument('--streams', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=60, help="seconds")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--gop', type=int, default=60)
+    parser.add_argument('--bitrate', type=int, default=4_000_000)
+    parser.add_argument('--frames', type=int, default=300, help="frames encoded once and looped")
+    parser.add_argument('--segment-size', type=int, default=1448, help="bytes per write, a TCP segment by default")
+    parser.add_argument('--burst-probability', type=float, default=0.01)
+    parser.add_argument('--burst-frames', type=int, default=10)
+    parser.add_argument('--reconnect-interval', type=float, help="seconds between reconnects of each stream")
+    parser.add_argument('--overload', action='store_true', help="shed frames with an OverloadController")
+    parser.add_argument('--max-fps', type=float, help="decode rate cap per stream, with --overload")
+    parser.add_argument('--sample-interval', type=float, default=10)
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    # The pipeline reports progress with print, keep stdout for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        pictures = split_pictures(synthesize_stream(args.width, args.height, args.frames, args.gop,
+                                                    args.bitrate, args.fps))
+        harness = SoakHarness(pictures, args.streams, args.overload, args.max_fps, args.sample_interval,
+                              fps=args.fps, segment_size=args.segment_size,
+                              burst_probability=args.burst_probability, burst_frames=args.burst_frames,
+                              reconnect_interval=args.reconnect_interval)
+        report = dict(harness.run(args.duration), commit=git_commit(), python=platform.python_version(),
+                      machine=platform.machine(), source=vars(args))
+    report = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,73 +1,99 @@
 from datetime import datetime
 
-import cv2
 import queue
-import threading
+import sys
 import time
 
-import numpy as np
-#
-from builder import frame_data_builder
-from frame_decoder import FrameDecoder
-from frame_processor import FrameProcessor
-from h264_unit import H264Unit
-from nalu_parser import NALUParser
+from capture import CaptureWriter
+from frame_decoder import warm_up
+from frame_pool import FramePool
+from frame_queue import FrameQueue
+from metrics import MetricsRegistry
 from server import TCPServer
+from session import StreamSession
 
-# Frame queue for buffering decoded frames
-frame_queue = queue.Queue()
+# Bounded hand-off between the network threads and the display loop,
+# a slow window only ever shows older frames and never stalls recv
+frame_queue = FrameQueue(maxsize=2, policy=FrameQueue.DROP_OLDEST)
 
 
 def get_fps_info(fps_data):
-    fps_data["count"] = fps_data["count"] + 1
+    fps_data["count"] = fps_data.get("count", 0) + 1
     frame_count = fps_data["count"]
-    prev = fps_data["start"]
-    now = datetime.now()
-    seconds_pass = (now - prev).total_seconds()
+    now = time.monotonic()
+    last = fps_data.get("start")
     fps_data["start"] = now
-    fps = round(1 / seconds_pass)
-    fps_string = f"FPS: {fps} / FC: {frame_count} {now.strftime("%H:%M:%S")}"
+    if last is not None:
+        interval = now - last
+        # Smooth the interval so one short gap does not read as a spike, and track
+        # how far single intervals stray from it as jitter. The first interval
+        # is between the first two frames, the average starts there
+        average = fps_data.get("interval", interval)
+        average = average * 0.9 + interval * 0.1
+        fps_data["interval"] = average
+        fps_data["jitter"] = fps_data.get("jitter", 0) * 0.9 + abs(interval - average) * 0.1
+    average = fps_data.get("interval", 0)
+    fps = 1 / average if average > 0 else 0
+    fps_string = (f"FPS: {fps:.0f} / FC: {frame_count} / jitter: {fps_data.get('jitter', 0) * 1000:.1f}ms "
+                  f"{datetime.now().strftime('%H:%M:%S')}")
     return fps_string
 
 # Function to handle data reception and processing
-def data_receiver():
+def data_receiver(capture_path=None, metrics_port=9469, warm_up_decoders=0):
     server = TCPServer()
-    parser = NALUParser()
-    frame_processor = FrameProcessor()
-    fps_data = {"count": 0, "start": datetime.now()}
+    metrics_registry = MetricsRegistry()
+    metrics_registry.serve(port=metrics_port)
+    if capture_path:
+        # Record the raw stream for replay.py
+        server.capture = CaptureWriter(capture_path)
+    # Every connection gets its own window and FPS counter
+    fps_data = {}
+    # Frames are drawn on and shown in place, then go back to the pool for the next decode,
+    # frames the queue drops go back right away
+    frame_pool = FramePool()
+    # Optionally open decoders and fill the pool for 720p before accepting, so the first cameras start at full speed
+    spare_decoders = warm_up(warm_up_decoders, frame_pool, [((720, 1280, 3), 'bgr24')]) if warm_up_decoders else []
 
-    def on_data_received(data, count):
-        parser.enqueue(data, count)
+    def frame_handler(frame, session: StreamSession):
+        fps_string = get_fps_info(fps_data.setdefault(session.address, {}))
+        frame_queue.put((session.address, frame, fps_string, session.metrics, session.trace))
 
-    def unit_handler(unit: H264Unit, count):
-        decoder = FrameDecoder()
-        print(f"unit: type - {unit.type} [{unit.type_number}], length - {unit.byte_length}")
-        build_data = frame_data_builder.build(unit)
-        if build_data is None:
-            return
-
-        # fps_string = get_fps_info(fps_data)
-        # print(fps_string)
-        # Decode the frame data
-        frame = decoder.decode(build_data, 1)
-        # frame = frame_processor.nal_units_to_cv2_frame(build_data)
-        if frame is not None:
-            fps_string = get_fps_info(fps_data)
+    def show_frame(address, pooled_frame, fps_string, metrics, trace):
+        with pooled_frame:
+            frame = pooled_frame.array
             print("Frame received and decoded", frame.shape)
             cv2.putText(frame, fps_string, (7, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (100, 255, 0), 3, cv2.LINE_AA)
-            cv2.imshow("MyWindow", frame)
+            cv2.imshow(f"MyWindow {address}", frame)
+            cv2.waitKey(1)
+        # Delivery is when the frame reaches the screen, not when it was queued
+        metrics.deliver(trace)
+
+    def drop_frame(queued_frame):
+        address, pooled_frame, fps_string, metrics, trace = queued_frame
+        pooled_frame.release()
+        # Counted against the stream the frame came from, which may not be the one that pushed it out.
+        # The stages up to decoding happened, the frame just never reached the screen
+        metrics.drop(trace)
+
+    frame_queue.drop_handler = drop_frame
 
-            key = cv2.waitKey(1)
-            if key & 0xFF == ord('q'):
-                return
+    def session_factory(addr):
+        metrics = metrics_registry.stream(f"{addr[0]}:{addr[1]}")
+        decoder = spare_decoders.pop() if spare_decoders else None
+        return StreamSession(addr, frame_handler=frame_handler, metrics=metrics, report_delivery=False,
+                             frame_pool=frame_pool, decoder=decoder)
 
-    server.received_data_handler = on_data_received
-    parser.h264_unit_handler = unit_handler
+    server.session_factory = session_factory
     server.start()
+    # The GUI library is only needed for the first frame, the listener is already up
+    import cv2
 
     try:
         while True:
-            time.sleep(1)  # Keep the thread alive
+            try:
+                show_frame(*frame_queue.get(timeout=1))
+            except queue.Empty:
+                print(f"No frames, queue stats: {frame_queue.stats()}")
     except KeyboardInterrupt:
         cv2.destroyAllWindows()
         print("Stopped by user.")
@@ -75,8 +101,10 @@ def data_receiver():
         print(f"Error in data receiver: {e}")
     finally:
         server.stop()
-        frame_processor.close()
+        metrics_registry.stop()
+        if server.capture:
+            server.capture.close()
 
 
 if __name__ == '__main__':
-    data_receiver()
+    data_receiver(sys.argv[1] if len(sys.argv) > 1 else None)
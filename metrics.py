@@ -0,0 +1,192 @@
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FrameTrace:
+    """Monotonic timestamps (ns) of one frame as it moves through the pipeline."""
+    __slots__ = ('recv', 'split', 'build', 'decode_start', 'decode_end', 'delivered')
+
+    def __init__(self, recv=0, split=0):
+        self.recv = recv
+        self.split = split
+        self.build = 0
+        self.decode_start = 0
+        self.decode_end = 0
+        self.delivered = 0
+
+    def stages(self):
+        """Yields (stage, seconds) for every stage whose both ends were recorded."""
+        points = (('split', self.recv, self.split), ('build', self.split, self.build),
+                  ('queue', self.build, self.decode_start), ('decode', self.decode_start, self.decode_end),
+                  ('deliver', self.decode_end, self.delivered), ('total', self.recv, self.delivered))
+        for stage, start, end in points:
+            if start and end:
+                yield stage, (end - start) / 1e9
+
+
+class Histogram:
+    # Upper bounds in seconds, the last bucket catches everything above
+    BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(Histogram.BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(Histogram.BUCKETS) and value > Histogram.BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return Histogram.BUCKETS[index] if index < len(Histogram.BUCKETS) else float('inf')
+        return float('inf')
+
+
+class StreamMetrics:
+    """
+    Counters and stage latency histograms of one connection. Updated from
+    the connection's own thread without locking, readers may see a frame
+    counted in one metric but not yet in another. Frames can be delivered
+    and dropped by consumers on other threads, deliver and drop lock.
+    """
+    COUNTERS = ('bytes_received', 'chunks_received', 'units_parsed', 'frames_built',
+                'frames_decoded', 'frames_delivered', 'frames_dropped')
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.monotonic()
+        self.closed = False  # Set when the connection ends, the registry drops it on the next connect
+        for counter in StreamMetrics.COUNTERS:
+            setattr(self, counter, 0)
+        self.latency = {}
+        self.lock = threading.Lock()
+
+    def record_trace(self, trace: FrameTrace):
+        for stage, seconds in trace.stages():
+            histogram = self.latency.get(stage)
+            if histogram is None:
+                histogram = self.latency[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def deliver(self, trace: FrameTrace):
+        """Marks a frame as handed to its consumer, call it once the consumer is done."""
+        if trace is None:
+            return
+        trace.delivered = time.monotonic_ns()
+        with self.lock:
+            self.frames_delivered += 1
+            self.record_trace(trace)
+
+    def drop(self, trace: FrameTrace = None):
+        """Counts a dropped frame, with the stages its trace got through when there is one."""
+        with self.lock:
+            self.frames_dropped += 1
+            if trace:
+                self.record_trace(trace)
+
+    def summary(self):
+        summary = {counter: getattr(self, counter) for counter in StreamMetrics.COUNTERS}
+        summary["uptime_s"] = round(time.monotonic() - self.started, 1)
+        for stage, histogram in self.latency.items():
+            summary[f"{stage}_p50_ms"] = histogram.quantile(0.5) * 1000
+            summary[f"{stage}_p99_ms"] = histogram.quantile(0.99) * 1000
+        return summary
+
+
+class MetricsRegistry:
+    """All live StreamMetrics, rendered as Prometheus text or dumped periodically."""
+
+    def __init__(self):
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.http_server = None
+
+    def stream(self, name):
+        name = str(name)
+        with self.lock:
+            for closed in [key for key, stream in self.streams.items() if stream.closed]:
+                del self.streams[closed]
+            if name not in self.streams:
+                self.streams[name] = StreamMetrics(name)
+            return self.streams[name]
+
+    def remove(self, name):
+        with self.lock:
+            self.streams.pop(str(name), None)
+
+    def render_prometheus(self):
+        with self.lock:
+            streams = list(self.streams.values())
+
+        lines = []
+        for counter in StreamMetrics.COUNTERS:
+            lines.append(f"# TYPE h264_{counter}_total counter")
+            for stream in streams:
+                lines.append(f'h264_{counter}_total{{stream="{stream.name}"}} {getattr(stream, counter)}')
+
+        lines.append("# TYPE h264_stage_latency_seconds histogram")
+        for stream in streams:
+            for stage, histogram in list(stream.latency.items()):
+                labels = f'stream="{stream.name}",stage="{stage}"'
+                cumulative = 0
+                for bound, count in zip(Histogram.BUCKETS + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'h264_stage_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'h264_stage_latency_seconds_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'h264_stage_latency_seconds_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, host='127.0.0.1', port=9469):
+        """Serves the Prometheus text format on http://host:port/metrics from a daemon thread."""
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on http://{host}:{self.http_server.server_port}/metrics")
+
+    def start_dump(self, interval=10, file=sys.stdout):
+        """Prints a per-stream summary every interval seconds from a daemon thread."""
+        def dump():
+            while True:
+                time.sleep(interval)
+                with self.lock:
+                    streams = list(self.streams.values())
+                for stream in streams:
+                    print(f"Metrics {stream.name}: {stream.summary()}", file=file)
+
+        threading.Thread(target=dump, daemon=True).start()
+
+    def stop(self):
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
@@ -1,41 +1,108 @@
-import cv2
-
 from h264_unit import H264Unit
 
 
 class NALUParser:
+    START_CODE = b'\x00\x00\x00\x01'
+    SHORT_START_CODE = b'\x00\x00\x01'
+    # Stream framings: Annex-B start codes, or every unit behind a 4-byte big-endian length (AVCC style)
+    ANNEX_B = 'annexb'
+    LENGTH_PREFIXED = 'length'
+    # Largest length prefix accepted, a bigger one is a broken or hostile sender and not buffered
+    MAX_UNIT_SIZE = 4 << 20
 
-    def __init__(self):
+    def __init__(self, short_start_codes=False, framing=ANNEX_B, max_unit_size=MAX_UNIT_SIZE):
         self.data_stream = bytearray()
-        self.search_index = 0
+        self.read_index = 0  # Start of the unit that is still being received
+        self.search_index = 0  # Where the next start code search resumes
+        self.start_code_length = 0  # Start code length of the current unit, 0 before the first one
+        # Also split on 3-byte 00 00 01 start codes, which encoders use inside access units
+        self.short_start_codes = short_start_codes
+        self.framing = framing
+        self.max_unit_size = max_unit_size
         self.h264_unit_handler = None  # Callback for parsed H264 units
+        # Slices already received but not handed to h264_unit_handler yet, a decoder falling
+        # behind makes recv return bigger chunks and this grows
+        self.pending_slices = 0
+
+    def find_start_code(self):
+        data_stream = self.data_stream
+        if not self.short_start_codes:
+            return data_stream.find(NALUParser.START_CODE, self.search_index), 4
+
+        index = data_stream.find(NALUParser.SHORT_START_CODE, self.search_index)
+        if index > self.read_index and data_stream[index - 1] == 0:
+            return index - 1, 4
+        return index, 3
 
     def enqueue(self, data, count):
+        if self.framing == NALUParser.LENGTH_PREFIXED:
+            self.enqueue_length_prefixed(data, count)
+            return
+        self.data_stream.extend(data)
+        data_stream = self.data_stream
+        units = []
+        while True:
+            index, start_code_length = self.find_start_code()
+            if index < 0:
+                # Keep the tail searchable, a start code may be split across chunks
+                pattern_length = 3 if self.short_start_codes else 4
+                self.search_index = max(self.search_index, len(data_stream) - pattern_length + 1)
+                break
+            # Bytes in front of the first start code are not a unit and are dropped
+            if self.start_code_length and index > self.read_index + self.start_code_length:
+                units.append(H264Unit(data_stream[self.read_index:index], self.start_code_length))
+            self.read_index = index
+            self.start_code_length = start_code_length
+            self.search_index = index + start_code_length
+
+        self.compact()
+        self.handle_units(units, count)
+
+    def enqueue_length_prefixed(self, data, count):
+        # Lengths say where every unit ends, nothing is scanned
         self.data_stream.extend(data)
+        data_stream = self.data_stream
         units = []
-        while self.search_index < len(self.data_stream) - 3:
-            if (self.data_stream[self.search_index] == 0 and
-                    self.data_stream[self.search_index + 1] == 0 and
-                    self.data_stream[self.search_index + 2] == 0 and
-                    self.data_stream[self.search_index + 3] == 1):
-                if self.search_index > 0:
-                    unit_data = self.data_stream[:self.search_index]
-                    unit = H264Unit(unit_data)
-                    units.append(unit)
-                    self.data_stream = self.data_stream[self.search_index:]
-                    self.search_index = 0
-                else:
-                    self.search_index += 4
-            else:
-                self.search_index += 1
+        length = 0
+        while len(data_stream) - self.read_index >= 4:
+            length = int.from_bytes(data_stream[self.read_index:self.read_index + 4], 'big')
+            end = self.read_index + 4 + length
+            if end > len(data_stream) or length > self.max_unit_size:
+                break
+            if length:
+                units.append(self.length_prefixed_unit(data_stream[self.read_index:end]))
+            self.read_index = end
+
+        self.compact()
+        self.handle_units(units, count)
+        if length > self.max_unit_size:
+            # Lengths can't be resynchronized, the caller has to drop the connection
+            raise OverflowError(f"Unit length {length} exceeds the limit of {self.max_unit_size} bytes")
+
+    def unit_received(self, payload: bytearray, count):
+        """Takes one length-prefixed unit the caller already read whole, see TCPServer.framing."""
+        self.handle_units([self.length_prefixed_unit(payload)], count)
+
+    @staticmethod
+    def length_prefixed_unit(payload: bytearray):
+        # The 4 length bytes become a start code in place, units look the same in both framings
+        payload[:4] = NALUParser.START_CODE
+        return H264Unit(payload, 4)
 
+    def handle_units(self, units, count):
         if self.h264_unit_handler:
             # print(f"{len(units)} units parsed")
+            self.pending_slices = sum(1 for unit in units if unit.is_slice)
             for unit in units:
+                if unit.is_slice:
+                    self.pending_slices -= 1
                 if unit.type is not None:
                     self.h264_unit_handler(unit, count)
 
+    def compact(self):
+        # Drop consumed bytes once they make up half of the buffer instead of after every unit
+        if self.read_index and self.read_index * 2 >= len(self.data_stream):
+            del self.data_stream[:self.read_index]
+            self.search_index = max(self.search_index - self.read_index, 0)
+            self.read_index = 0
 
-if __name__ == '__main__':
-    cv2.namedWindow("MyWindow")
-    print("hello world")
\ No newline at end of file
@@ -0,0 +1,85 @@
+import time
+
+from h264_unit import H264Unit
+
+
+class OverloadController:
+    """
+    Decides per picture whether a stream's slices reach the decoder, so a
+    box short on CPU drops frames instead of falling seconds behind.
+
+    The backlog passed to admit is the number of frames received but not
+    decoded yet. From drop_backlog on, non-reference pictures are dropped,
+    which costs nothing but the picture itself. From skip_backlog on,
+    everything is dropped until the next IDR, since any reference picture
+    missing breaks the pictures after it. max_fps caps decoding with a token
+    bucket holding a second worth of frames. Non-reference pictures over the
+    budget are dropped, reference pictures borrow up to a second worth of
+    tokens instead, which the non-reference pictures after them pay back.
+    Only with the backlog at drop_backlog as well does a reference picture
+    over the budget skip to the next IDR, so a stream that is just over the
+    rate loses single frames rather than the rest of every GOP. Parameter
+    sets and SEI always pass.
+    """
+    ADMITTED = 'admitted'
+    DROPPED_NON_REFERENCE = 'non_reference'
+    DROPPED_UNTIL_IDR = 'until_idr'
+    DROPPED_RATE = 'rate'
+
+    def __init__(self, max_fps=None, drop_backlog=2, skip_backlog=8, metrics=None):
+        self.max_fps = max_fps
+        self.drop_backlog = drop_backlog
+        self.skip_backlog = skip_backlog
+        self.metrics = metrics  # Optional metrics.StreamMetrics, dropped pictures count as frames_dropped
+        self.tokens = max_fps or 0
+        self.refill_time = time.monotonic()
+        self.waiting_for_idr = False
+        self.picture_decision = OverloadController.ADMITTED  # Applies to every slice of the current picture
+        self.dropped = {
+            OverloadController.DROPPED_NON_REFERENCE: 0,
+            OverloadController.DROPPED_UNTIL_IDR: 0,
+            OverloadController.DROPPED_RATE: 0
+        }
+
+    def admit(self, h264_unit: H264Unit, backlog=0):
+        if not h264_unit.is_slice:
+            return True
+        if h264_unit.first_mb_in_slice == 0:
+            self.picture_decision = self.decide(h264_unit, backlog)
+            if self.picture_decision != OverloadController.ADMITTED:
+                self.dropped[self.picture_decision] += 1
+                if self.metrics:
+                    self.metrics.drop()
+        return self.picture_decision == OverloadController.ADMITTED
+
+    def decide(self, h264_unit: H264Unit, backlog):
+        key_frame = h264_unit.type == H264Unit.NALUType.IFR
+        if key_frame:
+            self.waiting_for_idr = False
+        elif self.waiting_for_idr:
+            return OverloadController.DROPPED_UNTIL_IDR
+
+        if not key_frame and backlog >= self.skip_backlog:
+            self.waiting_for_idr = True
+            return OverloadController.DROPPED_UNTIL_IDR
+        if h264_unit.nal_ref_idc == 0 and backlog >= self.drop_backlog:
+            return OverloadController.DROPPED_NON_REFERENCE
+
+        if self.max_fps and not self.take_token():
+            if h264_unit.nal_ref_idc == 0:
+                return OverloadController.DROPPED_RATE
+            if not key_frame and backlog >= self.drop_backlog:
+                self.waiting_for_idr = True
+                return OverloadController.DROPPED_RATE
+            # Dropping a reference picture would cost the rest of the GOP, it borrows a token instead
+            self.tokens = max(-self.max_fps, self.tokens - 1)
+        return OverloadController.ADMITTED
+
+    def take_token(self):
+        now = time.monotonic()
+        self.tokens = min(self.max_fps, self.tokens + (now - self.refill_time) * self.max_fps)
+        self.refill_time = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
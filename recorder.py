@@ -0,0 +1,177 @@
+import io
+import os
+import queue
+import struct
+import threading
+import time
+from fractions import Fraction
+
+from access_unit import AccessUnit, AccessUnitAssembler
+from h264_unit import H264Unit
+from nalu_parser import NALUParser
+
+
+class SegmentRecorder:
+    """
+    Archives a stream without decoding it. Annex-B units are converted to
+    length-prefixed (AVCC) samples and muxed by PyAV into MP4 or MKV segments
+    that always start on an IDR. Muxing runs on a worker thread behind a
+    bounded queue, so a slow disk drops units (and waits for the next IDR)
+    instead of stalling the receive thread. A unit the worker fails on is
+    dropped like one that did not fit the queue.
+    """
+    TIME_BASE = Fraction(1, 90000)
+    FORMATS = {'mp4': 'mp4', 'mkv': 'matroska'}  # File extension to FFmpeg muxer
+
+    def __init__(self, directory, prefix='stream', container_format='mp4', segment_seconds=60, max_queue=512):
+        self.directory = directory
+        self.prefix = prefix
+        self.container_format = container_format
+        self.segment_seconds = segment_seconds
+        self.units = queue.Queue(maxsize=max_queue)
+        self.assembler = AccessUnitAssembler()
+        self.assembler.access_unit_handler = self.write_access_unit
+        self.sps = None
+        self.pps = None
+        self.sps_info = None
+        self.container = None
+        self.stream = None
+        self.receive_time = 0  # Of the first unit of the access unit being written
+        self.access_unit_time = 0  # Of the first unit of the access unit being assembled
+        self.segment_start = None
+        self.segment_extradata = None
+        self.last_pts = -1
+        self.segment_count = 0
+        self.segment_paths = []
+        self.dropped_units = 0
+        self.failed_units = 0
+        self.resync = False  # Set after a drop, the current segment resumes at the next IDR
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def record(self, h264_unit: H264Unit):
+        """Called from the receive thread, never blocks."""
+        try:
+            self.units.put_nowait((h264_unit.detach(), time.monotonic_ns()))
+        except queue.Full:
+            self.dropped_units += 1
+            self.resync = True
+
+    def run(self):
+        try:
+            while True:
+                item = self.units.get()
+                if item is None:
+                    break
+                h264_unit, receive_time = item
+                # A unit that starts the next access unit completes the one stamped before it
+                self.receive_time = self.access_unit_time
+                try:
+                    self.assembler.push(h264_unit)
+                except Exception as e:
+                    self.fail(e)
+                    continue
+                if len(self.assembler.access_unit.units) == 1:
+                    self.access_unit_time = receive_time
+            self.receive_time = self.access_unit_time
+            self.assembler.flush()
+        except Exception as e:
+            print(f"Recorder stopped: {e}")
+        finally:
+            self.close_segment()
+
+    def fail(self, error):
+        # The segment may be unusable after a muxing error, a new one starts at the next IDR
+        print(f"Recorder dropped a unit: {error}")
+        self.failed_units += 1
+        self.assembler = AccessUnitAssembler()
+        self.assembler.access_unit_handler = self.write_access_unit
+        try:
+            self.close_segment()
+        except Exception:
+            self.container = None
+            self.stream = None
+
+    def write_access_unit(self, access_unit: AccessUnit):
+        for h264_unit in access_unit.units:
+            if h264_unit.type == H264Unit.NALUType.SPS:
+                self.sps = bytes(h264_unit.data[h264_unit.header_offset:])
+                self.sps_info = h264_unit.sps_info
+            elif h264_unit.type == H264Unit.NALUType.PPS:
+                self.pps = bytes(h264_unit.data[h264_unit.header_offset:])
+
+        if access_unit.is_key_frame:
+            self.resync = False
+            if self.should_rotate():
+                self.open_segment()
+        if self.container is None or self.resync:
+            return
+
+        pts = max(self.last_pts + 1, (self.receive_time - self.segment_start) * 90000 // 1_000_000_000)
+        self.last_pts = pts
+        packet = self.av.Packet(self.to_avcc(access_unit))
+        packet.stream = self.stream
+        packet.time_base = SegmentRecorder.TIME_BASE
+        packet.pts = packet.dts = pts
+        packet.is_keyframe = access_unit.is_key_frame
+        self.container.mux(packet)
+
+    def should_rotate(self):
+        if not (self.sps and self.pps and self.sps_info):
+            return False
+        if self.container is None or self.extradata() != self.segment_extradata:
+            return True
+        return self.receive_time - self.segment_start >= self.segment_seconds * 1_000_000_000
+
+    def extradata(self):
+        # AVCDecoderConfigurationRecord with one SPS and one PPS, 4-byte NAL lengths
+        return (bytes([1, self.sps[1], self.sps[2], self.sps[3], 0xFF, 0xE1])
+                + struct.pack('>H', len(self.sps)) + self.sps
+                + bytes([1]) + struct.pack('>H', len(self.pps)) + self.pps)
+
+    @staticmethod
+    def to_avcc(access_unit: AccessUnit):
+        samples = []
+        for h264_unit in access_unit.units:
+            if h264_unit.type in (H264Unit.NALUType.SPS, H264Unit.NALUType.PPS, H264Unit.NALUType.AUD):
+                continue  # Parameter sets live in the extradata
+            nal = h264_unit.data[h264_unit.header_offset:]
+            samples.append(h264_unit.length_data or struct.pack('>I', len(nal)))
+            samples.append(bytes(nal))
+        return b''.join(samples)
+
+    def open_segment(self):
+        import av
+        self.av = av
+        self.close_segment()
+        path = os.path.join(self.directory, f"{self.prefix}_{self.segment_count:05d}.{self.container_format}")
+        self.container = av.open(path, 'w', format=SegmentRecorder.FORMATS[self.container_format])
+        # add_stream('h264') would open an encoder that replaces the extradata, a stream
+        # probed from the parameter sets alone carries the codec parameters without one
+        parameter_sets = NALUParser.START_CODE + self.sps + NALUParser.START_CODE + self.pps
+        probe = av.open(io.BytesIO(parameter_sets), format='h264')
+        self.stream = self.container.add_stream(template=probe.streams.video[0])
+        probe.close()
+        self.segment_extradata = self.extradata()
+        self.stream.codec_context.extradata = self.segment_extradata
+        self.stream.codec_context.width, self.stream.codec_context.height = self.sps_info.resolution
+        self.segment_start = self.receive_time
+        self.last_pts = -1
+        self.segment_count += 1
+        self.segment_paths.append(path)
+        print(f"Recording segment {path}")
+
+    def close_segment(self):
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+            self.stream = None
+
+    def close(self, timeout=5):
+        """Lets the worker write what is queued, waits at most timeout seconds for each step."""
+        if self.thread.is_alive():
+            try:
+                self.units.put(None, timeout=timeout)
+            except queue.Full:
+                print("Recorder worker is stuck, leaving it behind")
+        self.thread.join(timeout)
@@ -0,0 +1,319 @@
+import socket
+import threading
+from collections import deque
+
+from h264_unit import H264Unit
+from nalu_parser import NALUParser
+from server import TCPServer
+
+
+class RelaySubscriber:
+    """
+    One viewer of a relayed stream. Units are queued as shared memoryviews
+    and written by the subscriber's own thread, so a slow viewer never holds
+    up the ingest thread or the other viewers. Once more than
+    max_pending_bytes are queued the backlog is dropped and the subscriber
+    waits for the next keyframe. finish() closes the subscriber once what is
+    queued has been sent.
+    """
+    MAX_BUFFERS_PER_SEND = 512  # Stays below IOV_MAX for sendmsg
+
+    def __init__(self, client_socket, address=None, max_pending_bytes=4 << 20):
+        self.socket = client_socket
+        self.address = address
+        self.max_pending_bytes = max_pending_bytes
+        self.pending = deque()
+        self.pending_bytes = 0
+        self.waiting_for_key_frame = False
+        self.closed = False
+        self.finishing = False
+        self.condition = threading.Condition()
+        self.sent_bytes = 0
+        self.sent_units = 0
+        self.dropped_units = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.send_loop, daemon=True)
+        self.thread.start()
+
+    def push(self, buffers, key_frame_buffers=None):
+        """
+        Queues buffers for sending. key_frame_buffers is given when buffers
+        start a keyframe and holds everything a decoder needs to join there
+        (parameter sets and the IDR), it replaces buffers after a drop.
+        """
+        with self.condition:
+            if self.closed:
+                return
+            if self.waiting_for_key_frame:
+                if key_frame_buffers is None:
+                    self.dropped_units += len(buffers)
+                    return
+                buffers = key_frame_buffers
+                self.waiting_for_key_frame = False
+
+            size = sum(len(buffer) for buffer in buffers)
+            if self.pending_bytes + size > self.max_pending_bytes:
+                self.dropped_units += len(self.pending) + len(buffers)
+                self.pending.clear()
+                self.pending_bytes = 0
+                if key_frame_buffers is None:
+                    self.waiting_for_key_frame = True
+                    return
+                buffers = key_frame_buffers
+                size = sum(len(buffer) for buffer in buffers)
+
+            self.pending.extend(buffers)
+            self.pending_bytes += size
+            self.condition.notify()
+
+    def send_loop(self):
+        try:
+            while True:
+                with self.condition:
+                    while not self.pending and not self.closed and not self.finishing:
+                        self.condition.wait()
+                    if self.closed or not self.pending:
+                        break
+                    buffers = [self.pending.popleft()
+                               for _ in range(min(len(self.pending), RelaySubscriber.MAX_BUFFERS_PER_SEND))]
+                    self.pending_bytes -= sum(len(buffer) for buffer in buffers)
+                self.send_buffers(buffers)
+        except OSError:
+            pass
+        self.close()
+
+    def send_buffers(self, buffers):
+        # One gather write for the whole batch, the views are never joined into a copy
+        sent_units = len(buffers)
+        while buffers:
+            sent = self.socket.sendmsg(buffers)
+            self.sent_bytes += sent
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            if sent:
+                buffers[0] = buffers[0][sent:]
+        self.sent_units += sent_units
+
+    def finish(self):
+        with self.condition:
+            self.finishing = True
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.pending.clear()
+            self.condition.notify()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        print(f"Subscriber {self.address} closed after {self.sent_units} units, dropped {self.dropped_units}")
+
+
+class StreamRelay:
+    """
+    Fans the units of one ingest stream out to its subscribers. The latest
+    SPS/PPS/IDR and the rest of the current GOP are cached, so a subscriber
+    joining late starts decoding right away instead of waiting for the next
+    keyframe. Cached and live units are memoryviews of the parser's unit
+    payloads and are shared by all subscribers.
+
+    Works as the TCPServer session of one ingest connection: on_data_received
+    parses the stream and close ends it, the subscribers are finished and
+    close_handler is called so the server forgets the stream.
+    """
+
+    def __init__(self, name, max_gop_bytes=16 << 20):
+        self.name = name
+        self.max_gop_bytes = max_gop_bytes
+        self.parser = NALUParser(short_start_codes=True)
+        self.parser.h264_unit_handler = lambda unit, count: self.publish(unit)
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.sps = None
+        self.pps = None
+        self.gop = None  # Units since the latest IDR, led by its parameter sets, None if incomplete
+        self.gop_bytes = 0
+        self.published_units = 0
+        self.ended = False
+        self.close_handler = None  # Called with this relay once its ingest connection ended
+
+    def on_data_received(self, data, count):
+        self.parser.enqueue(data, count)
+
+    def publish(self, unit: H264Unit):
+        view = memoryview(unit.payload)
+        key_frame_buffers = None
+        with self.lock:
+            self.published_units += 1
+            if unit.type == H264Unit.NALUType.SPS:
+                self.sps = view
+            elif unit.type == H264Unit.NALUType.PPS:
+                self.pps = view
+
+            if unit.type == H264Unit.NALUType.IFR and unit.first_mb_in_slice == 0:
+                self.gop = None
+                if self.sps is not None and self.pps is not None:
+                    self.gop = [self.sps, self.pps]
+                    self.gop_bytes = len(self.sps) + len(self.pps)
+                    key_frame_buffers = [self.sps, self.pps, view]
+            if self.gop is not None and unit.type not in (H264Unit.NALUType.SPS, H264Unit.NALUType.PPS):
+                self.gop.append(view)
+                self.gop_bytes += len(view)
+                if self.gop_bytes > self.max_gop_bytes:
+                    # Late joiners wait for the next IDR instead
+                    self.gop = None
+
+            # Pushing under the lock keeps a subscriber that joins now from getting this unit twice
+            self.subscribers = [subscriber for subscriber in self.subscribers if not subscriber.closed]
+            for subscriber in self.subscribers:
+                subscriber.push([view], key_frame_buffers)
+
+    def subscribe(self, subscriber: RelaySubscriber):
+        with self.lock:
+            if self.ended:
+                subscriber.finish()
+                return
+            if self.gop is not None:
+                subscriber.push(list(self.gop), list(self.gop))
+            else:
+                subscriber.waiting_for_key_frame = True
+            self.subscribers.append(subscriber)
+        print(f"Subscriber {subscriber.address} joined stream {self.name}")
+
+    def unsubscribe(self, subscriber: RelaySubscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def close(self):
+        with self.lock:
+            self.ended = True
+            self.gop = None
+            subscribers, self.subscribers = self.subscribers, []
+        for subscriber in subscribers:
+            subscriber.finish()
+        if self.close_handler:
+            self.close_handler(self)
+        print(f"Stream {self.name} ingest closed after {self.published_units} units")
+
+
+class RelayServer(TCPServer):
+    """
+    TCPServer that relays every ingest stream to any number of subscribers
+    without decoding it. Cameras connect to port as before, every ingest
+    connection is its own stream named ip:port, so two cameras behind one
+    address never share a parser. Viewers connect to subscribe_port and send
+    the stream name followed by a newline, then receive the Annex-B stream
+    until the camera disconnects. A bare IP picks the newest stream from that
+    address, an empty line the stream that connected last. A viewer that has
+    not sent its line within name_timeout seconds is disconnected.
+    """
+
+    def __init__(self, host='0.0.0.0', port=6969, subscribe_port=6970, max_pending_bytes=4 << 20, name_timeout=5.0):
+        super().__init__(host, port)
+        self.subscribe_port = subscribe_port
+        self.max_pending_bytes = max_pending_bytes  # Per subscriber
+        self.name_timeout = name_timeout
+        self.streams = {}
+        self.streams_lock = threading.Lock()
+        self.last_stream = None
+        self.subscribe_socket = None
+        self.session_factory = lambda addr: self.open_stream(f"{addr[0]}:{addr[1]}" if addr else 'default')
+
+    def open_stream(self, name):
+        relay = StreamRelay(name)
+        relay.close_handler = self.stream_closed
+        with self.streams_lock:
+            self.streams[name] = relay
+            self.last_stream = name
+        return relay
+
+    def stream_closed(self, relay: StreamRelay):
+        with self.streams_lock:
+            if self.streams.get(relay.name) is relay:
+                del self.streams[relay.name]
+            if self.last_stream == relay.name:
+                self.last_stream = None
+
+    def find_stream(self, name):
+        """The live stream called name, the newest one from host name, or the last one for ''."""
+        with self.streams_lock:
+            if not name:
+                name = self.last_stream
+            if name in self.streams:
+                return self.streams[name]
+            for stream_name in reversed(list(self.streams)):
+                if stream_name.rpartition(':')[0] == name:
+                    return self.streams[stream_name]
+        return None
+
+    def start(self):
+        super().start()
+        self.subscribe_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.subscribe_socket.bind((self.host, self.subscribe_port))
+        self.subscribe_socket.listen()
+        self.subscribe_port = self.subscribe_socket.getsockname()[1]
+        print(f"Listening for subscribers on {self.host}:{self.subscribe_port}")
+        threading.Thread(target=self.accept_subscribers, daemon=True).start()
+
+    def accept_subscribers(self):
+        while self.is_listening:
+            try:
+                client_socket, addr = self.subscribe_socket.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.handle_subscriber, args=(client_socket, addr), daemon=True).start()
+
+    def handle_subscriber(self, client_socket, addr):
+        name = self.read_stream_name(client_socket, self.name_timeout)
+        if name is None:
+            print(f"Subscriber {addr} sent no stream name")
+            client_socket.close()
+            return
+        stream = self.find_stream(name)
+        if stream is None:
+            print(f"Subscriber {addr} asked for unknown stream {name}")
+            client_socket.close()
+            return
+        subscriber = RelaySubscriber(client_socket, addr, self.max_pending_bytes)
+        subscriber.start()
+        stream.subscribe(subscriber)
+
+    @staticmethod
+    def read_stream_name(client_socket, timeout=None, limit=256):
+        """The first line the viewer sent, None when it closed, timed out or sent too much."""
+        request = bytearray()
+        client_socket.settimeout(timeout)
+        try:
+            while b'\n' not in request:
+                data = client_socket.recv(limit - len(request))
+                if not data or len(request) + len(data) >= limit:
+                    return None
+                request += data
+        except OSError:  # socket.timeout is one
+            return None
+        finally:
+            client_socket.settimeout(None)
+        return request[:request.index(b'\n')].decode(errors='replace').strip()
+
+    def stop(self):
+        super().stop()
+        if self.subscribe_socket:
+            try:
+                self.subscribe_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.subscribe_socket.close()
+        with self.streams_lock:
+            streams = list(self.streams.values())
+        for stream in streams:
+            for subscriber in list(stream.subscribers):
+                subscriber.close()
@@ -0,0 +1,87 @@
+import argparse
+import socket
+import threading
+import time
+
+from capture import CaptureReader
+
+
+class ReplayClient:
+    """
+    Sends a capture back to a server. Every captured connection is replayed
+    on its own socket with the original chunk boundaries, either paced by
+    the capture timestamps or as fast as the socket accepts it.
+    """
+    REAL_TIME = 'realtime'
+    MAX_SPEED = 'max'
+
+    def __init__(self, capture_path, host='127.0.0.1', port=6969, mode=REAL_TIME, connections=1, loops=1):
+        self.capture_path = capture_path
+        self.host = host
+        self.port = port
+        self.mode = mode
+        self.connections = connections  # Parallel copies of every captured connection
+        self.loops = loops
+        self.sent_bytes = 0
+        self.sent_chunks = 0
+        self.lock = threading.Lock()
+
+    def run(self):
+        reader = CaptureReader(self.capture_path)
+        threads = [
+            threading.Thread(target=self.replay_connection, args=(reader, connection_id), daemon=True)
+            for connection_id in reader.connection_ids
+            for _ in range(self.connections)
+        ]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        reader.close()
+
+        print(f"Replayed {self.sent_chunks} chunks, {self.sent_bytes} bytes on {len(threads)} connections "
+              f"in {elapsed:.2f}s ({self.sent_bytes * 8 / max(elapsed, 1e-9) / 1e6:.1f} Mbit/s)")
+        return elapsed
+
+    def replay_connection(self, reader, connection_id):
+        sent_bytes = 0
+        sent_chunks = 0
+        with socket.create_connection((self.host, self.port)) as client_socket:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            for _ in range(self.loops):
+                start = time.monotonic_ns()
+                first_timestamp = None
+                for timestamp, _, chunk in reader.records(connection_id):
+                    if self.mode == ReplayClient.REAL_TIME:
+                        if first_timestamp is None:
+                            first_timestamp = timestamp
+                        delay = (timestamp - first_timestamp) - (time.monotonic_ns() - start)
+                        if delay > 0:
+                            time.sleep(delay / 1e9)
+                    client_socket.sendall(chunk)
+                    sent_bytes += len(chunk)
+                    sent_chunks += 1
+                    del chunk
+
+        with self.lock:
+            self.sent_bytes += sent_bytes
+            self.sent_chunks += sent_chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a capture recorded by TCPServer.capture")
+    parser.add_argument('capture', help="capture data file, the index is read from <capture>.idx")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6969)
+    parser.add_argument('--mode', choices=[ReplayClient.REAL_TIME, ReplayClient.MAX_SPEED], default=ReplayClient.REAL_TIME)
+    parser.add_argument('--connections', type=int, default=1, help="parallel copies of every captured connection")
+    parser.add_argument('--loops', type=int, default=1, help="times to send the capture on each connection")
+    args = parser.parse_args()
+
+    ReplayClient(args.capture, args.host, args.port, args.mode, args.connections, args.loops).run()
+
+
+if __name__ == '__main__':
+    main()
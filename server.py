@@ -1,20 +1,57 @@
+import array
+import itertools
 import socket
 import threading
+import time
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    # Windows, unread_bytes has no FIONREAD there
+    fcntl = termios = None
+
+from h264_unit import H264Unit
+from nalu_parser import NALUParser
 
 
 class TCPServer:
+    """
+    Thread per connection server. With framing set to
+    NALUParser.LENGTH_PREFIXED, or AUTO and a client whose stream opens with
+    plausible length prefixes (see detect_framing), every unit is read as a
+    4-byte big-endian length followed by exactly that many bytes, received
+    straight into the unit's own buffer. Units then go to the session's on_unit_received or
+    received_unit_handler instead of the chunk handlers. A length above
+    max_unit_size closes the connection before anything is allocated.
 
-    def __init__(self, host='0.0.0.0', port=6969):
+    Annex-B data of a session with an ingest_buffer is received straight
+    into that buffer, an OverflowError from it closes the connection.
+    """
+    AUTO = 'auto'
+    DETECT_WINDOW = 64  # Bytes peeked at by detect_framing
+
+    def __init__(self, host='0.0.0.0', port=6969, framing=NALUParser.ANNEX_B,
+                 max_unit_size=NALUParser.MAX_UNIT_SIZE, detect_timeout=5.0):
         self.host = host
         self.port = port
+        self.framing = framing
+        self.max_unit_size = max_unit_size
+        self.detect_timeout = detect_timeout  # Seconds AUTO waits for the first bytes before taking Annex-B
         self.server_socket = None
         self.is_listening = False
         self.received_data_handler = None  # Function to handle incoming data
+        self.received_unit_handler = None  # Function to handle length-prefixed units without a session
+        # Called with the client address to create per-connection state, see session.StreamSession
+        self.session_factory = None
+        self.capture = None  # capture.CaptureWriter that records every received chunk
+        self.connection_ids = itertools.count()
 
     def start(self):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.bind((self.host, self.port))
         self.server_socket.listen()
+        self.port = self.server_socket.getsockname()[1]
         self.is_listening = True
         print(f"Listening for connections on {self.host}:{self.port}")
 
@@ -23,12 +60,40 @@ class TCPServer:
 
     def accept_connections(self):
         while self.is_listening:
-            client_socket, addr = self.server_socket.accept()
+            try:
+                client_socket, addr = self.server_socket.accept()
+            except OSError:
+                # The listening socket was shut down by stop()
+                break
             print(f"Connection accepted from {addr}")
             # Start a new thread to handle each client connection
-            threading.Thread(target=self.handle_client, args=(client_socket,), daemon=True).start()
+            threading.Thread(target=self.handle_client, args=(client_socket, addr), daemon=True).start()
+
+    def handle_client(self, client_socket, addr=None):
+        session = None
+        try:
+            session = self.session_factory(addr) if self.session_factory else None
+            data_handler = session.on_data_received if session else self.received_data_handler
+            if hasattr(session, 'attach_socket'):
+                session.attach_socket(client_socket)
+            connection_id = next(self.connection_ids)
+            framing = self.framing
+            if framing == TCPServer.AUTO:
+                framing = self.detect_framing(client_socket)
+            if framing == NALUParser.LENGTH_PREFIXED:
+                unit_handler = session.on_unit_received if session else self.received_unit_handler
+                self.receive_units(client_socket, connection_id, unit_handler)
+            elif session and getattr(session, 'ingest_buffer', None):
+                self.receive_into(client_socket, connection_id, session)
+            else:
+                self.receive_chunks(client_socket, connection_id, data_handler)
+        finally:
+            client_socket.close()
+            if session:
+                session.close()
+            print("Connection closed")
 
-    def handle_client(self, client_socket):
+    def receive_chunks(self, client_socket, connection_id, data_handler):
         count = 0
         while True:
             count += 1
@@ -36,17 +101,238 @@ class TCPServer:
                 data = client_socket.recv(65000)
                 if not data:
                     break
-                # with open("an_data.txt", 'a') as file:
-                #     file.write(str(data))
-                if self.received_data_handler:
-                    self.received_data_handler(data, count)
+                if self.capture:
+                    self.capture.write(connection_id, data)
+                if data_handler:
+                    data_handler(data, count)
             except ConnectionResetError:
                 break
-        client_socket.close()
-        print("Connection closed")
+            except OverflowError as e:
+                print(f"Closing connection {connection_id}: {e}")
+                break
+
+    def receive_into(self, client_socket, connection_id, session):
+        ingest_buffer = session.ingest_buffer
+        count = 0
+        try:
+            while True:
+                count += 1
+                view = ingest_buffer.writable()
+                size = client_socket.recv_into(view)
+                if not size:
+                    break
+                if self.capture:
+                    self.capture.write(connection_id, view[:size])
+                session.on_data_committed(size, count)
+        except ConnectionResetError:
+            pass
+        except OverflowError as e:
+            print(f"Closing connection {connection_id}: {e}")
+
+    def detect_framing(self, client_socket):
+        """
+        Length-prefixed only when the first units' lengths are within
+        max_unit_size and each is followed by a valid NAL header. Everything
+        else, leading junk or a camera joining mid-stream included, is taken
+        as Annex-B, where the parser drops bytes up to the first start code
+        and memory stays bounded.
+        """
+        start = self.peek(client_socket, TCPServer.DETECT_WINDOW, 5, self.detect_timeout)
+        if start.startswith(NALUParser.START_CODE) or start.startswith(NALUParser.SHORT_START_CODE):
+            return NALUParser.ANNEX_B
+        if self.plausible_length_prefixes(start):
+            return NALUParser.LENGTH_PREFIXED
+        return NALUParser.ANNEX_B
+
+    def plausible_length_prefixes(self, window):
+        position = 0
+        while position + 5 <= len(window):
+            length = int.from_bytes(window[position:position + 4], 'big')
+            header = window[position + 4]
+            if not 0 < length <= self.max_unit_size or header & 0x80 or header & 0x1F not in H264Unit.type_map:
+                return False
+            position += 4 + length
+        # At least one length and header were seen
+        return position > 0
+
+    @staticmethod
+    def peek(client_socket, size, min_size, timeout):
+        """Up to size bytes without consuming them, waiting at most timeout seconds for min_size."""
+        deadline = time.monotonic() + timeout
+        start = b''
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                client_socket.settimeout(remaining)
+                # Blocks until data arrives, b'' means the client closed
+                start = client_socket.recv(size, socket.MSG_PEEK)
+                if len(start) >= min_size or not start:
+                    break
+                # Data is pending, so peeking again returns at once, give the client time to send more
+                time.sleep(min(0.01, remaining))
+        except (socket.timeout, ConnectionResetError):
+            pass
+        finally:
+            client_socket.settimeout(None)
+        return start
+
+    def receive_units(self, client_socket, connection_id, unit_handler):
+        header = bytearray(4)
+        header_view = memoryview(header)
+        count = 0
+        try:
+            while self.receive_exactly(client_socket, header_view):
+                count += 1
+                length = int.from_bytes(header, 'big')
+                if length > self.max_unit_size:
+                    print(f"Closing connection {connection_id}: unit length {length} exceeds "
+                          f"the limit of {self.max_unit_size} bytes")
+                    break
+                # Room for the length in front, NALUParser turns it into a start code
+                payload = bytearray(4 + length)
+                payload[:4] = header
+                if not self.receive_exactly(client_socket, memoryview(payload)[4:]):
+                    break
+                if self.capture:
+                    self.capture.write(connection_id, payload)
+                if unit_handler and length:
+                    unit_handler(payload, count)
+        except ConnectionResetError:
+            pass
+
+    @staticmethod
+    def unread_bytes(client_socket):
+        """Bytes the kernel received for the socket that were not read yet, 0 where FIONREAD is missing."""
+        if fcntl is None:
+            return 0
+        size = array.array('i', [0])
+        try:
+            fcntl.ioctl(client_socket.fileno(), termios.FIONREAD, size)
+        except OSError:
+            return 0
+        return size[0]
+
+    @staticmethod
+    def receive_exactly(client_socket, view):
+        position = 0
+        while position < len(view):
+            size = client_socket.recv_into(view[position:])
+            if not size:
+                return False
+            position += size
+        return True
 
     def stop(self):
         self.is_listening = False
         if self.server_socket:
+            try:
+                # Wakes up the thread blocked in accept()
+                self.server_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             self.server_socket.close()
             print("Server stopped")
+
+
+class AsyncTCPServer:
+    """
+    Drop-in alternative to TCPServer that serves every connection from one
+    asyncio event loop thread instead of a thread per client.
+
+    Each connection reads with recv_into into a buffer allocated once, so the
+    received_data_handler gets a memoryview that is only valid during the call
+    and must be copied (as NALUParser.enqueue does) if it is kept.
+    """
+
+    def __init__(self, host='0.0.0.0', port=6969, buffer_size=65000, receive_buffer_size=1 << 20):
+        self.host = host
+        self.port = port
+        self.buffer_size = buffer_size
+        self.receive_buffer_size = receive_buffer_size  # SO_RCVBUF for client sockets
+        self.server_socket = None
+        self.is_listening = False
+        self.received_data_handler = None  # Function to handle incoming data
+        # Called with the client address to create per-connection state, see session.StreamSession
+        self.session_factory = None
+        self.capture = None  # capture.CaptureWriter that records every received chunk
+        self.connection_ids = itertools.count()
+        self.loop = None
+        self.thread = None
+
+    def start(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen()
+        self.server_socket.setblocking(False)
+        self.port = self.server_socket.getsockname()[1]
+        self.is_listening = True
+        print(f"Listening for connections on {self.host}:{self.port}")
+
+        # Loaded here, the thread per connection server never needs it
+        import asyncio
+        self.asyncio = asyncio
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run_loop, daemon=True)
+        self.thread.start()
+
+    def run_loop(self):
+        self.asyncio.set_event_loop(self.loop)
+        self.loop.create_task(self.accept_connections())
+        self.loop.run_forever()
+
+        # stop() was called, cancel the accept loop and all client handlers
+        tasks = self.asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(self.asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    async def accept_connections(self):
+        while self.is_listening:
+            client_socket, addr = await self.loop.sock_accept(self.server_socket)
+            print(f"Connection accepted from {addr}")
+            self.configure_socket(client_socket)
+            self.loop.create_task(self.handle_client(client_socket, addr))
+
+    def configure_socket(self, client_socket):
+        client_socket.setblocking(False)
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size)
+
+    async def handle_client(self, client_socket, addr=None):
+        session = None
+        try:
+            session = self.session_factory(addr) if self.session_factory else None
+            data_handler = session.on_data_received if session else self.received_data_handler
+            if hasattr(session, 'attach_socket'):
+                session.attach_socket(client_socket)
+            buffer = memoryview(bytearray(self.buffer_size))
+            connection_id = next(self.connection_ids)
+            count = 0
+            while True:
+                count += 1
+                size = await self.loop.sock_recv_into(client_socket, buffer)
+                if not size:
+                    break
+                if self.capture:
+                    self.capture.write(connection_id, buffer[:size])
+                if data_handler:
+                    data_handler(buffer[:size], count)
+        except ConnectionResetError:
+            pass
+        finally:
+            client_socket.close()
+            if session:
+                session.close()
+            print("Connection closed")
+
+    def stop(self):
+        if not self.is_listening:
+            return
+        self.is_listening = False
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.server_socket.close()
+        print("Server stopped")
@@ -0,0 +1,225 @@
+import time
+from collections import deque
+
+from access_unit import AccessUnit, AccessUnitAssembler
+from builder import FrameDataBuilder
+from frame_decoder import OutputFormat, StreamingDecoder
+from h264_unit import H264Unit
+from ingest_buffer import IngestBuffer
+from metrics import FrameTrace, StreamMetrics
+from nalu_parser import NALUParser
+from overload import OverloadController
+from server import TCPServer
+
+
+class StreamSession:
+    """
+    Pipeline state of one client connection. The server creates a session
+    when a client connects and closes it when the connection ends, so
+    streams from different cameras never share a parser, builder or decoder.
+    """
+
+    def __init__(self, address, frame_handler=None, decode_pool=None, assemble_access_units=False,
+                 metrics: StreamMetrics = None, report_delivery=True, recorder=None,
+                 output_format=OutputFormat.BGR24, output_size=None, frame_pool=None,
+                 framing=NALUParser.ANNEX_B, overload: OverloadController = None,
+                 decoder: StreamingDecoder = None, snapshots=None, ingest_capacity=None,
+                 overflow=IngestBuffer.RESYNC):
+        self.address = address
+        self.parser = NALUParser(short_start_codes=True, framing=framing)
+        # With an ingest_capacity Annex-B data goes through a fixed IngestBuffer the server
+        # receives into directly, length-prefixed units still go through the parser
+        self.ingest_buffer = None
+        if ingest_capacity:
+            self.ingest_buffer = IngestBuffer(ingest_capacity, overflow)
+            self.ingest_buffer.h264_unit_handler = self.unit_handler
+        self.builder = FrameDataBuilder(incremental=True)
+        self.frame_handler = frame_handler  # Called with every decoded frame and this session
+        # With a frame_pool.FramePool frames are PooledFrame objects the frame_handler has to release
+        self.frame_pool = frame_pool
+        self.frame_count = 0
+        self.parser.h264_unit_handler = self.unit_handler
+        self.recorder = recorder  # Optional SegmentRecorder, gets every unit before decoding
+        self.overload = overload  # Optional OverloadController, drops slices before they are built
+        self.snapshots = snapshots  # Optional snapshot.SnapshotEncoder, offered every decoded frame
+        self.submitted_count = 0
+        self.socket = None  # Set by the server, the unread data in it counts towards the backlog
+        self.frame_bytes = 0  # Running average size of the frames built so far
+
+        # Multi-slice encoders need whole pictures per decode call, at the cost
+        # of holding each picture until the first unit of the next one arrives
+        self.assembler = None
+        if assemble_access_units:
+            self.assembler = AccessUnitAssembler()
+            self.assembler.access_unit_handler = self.access_unit_handler
+
+        # Optional tracing, trace holds the timestamps of the frame being handed to frame_handler.
+        # A frame counts as delivered when frame_handler returns, unless report_delivery is off
+        # and the consumer calls metrics.deliver(trace) itself
+        self.metrics = metrics
+        self.report_delivery = report_delivery
+        self.trace = None
+        self.recv_time = 0
+        self.split_time = 0
+        self.pending_traces = deque()
+
+        # With a DecodeWorkerPool the decoder runs in a worker process instead,
+        # its frame slots are sized from the SPS once the first frame is built
+        self.decode_pool = decode_pool
+        self.stream_id = None
+        if decode_pool:
+            self.decoder = None
+            self.builder.resolution_handler = self.resolution_handler
+        elif decoder:
+            # Opened ahead of time by frame_decoder.warm_up
+            self.decoder = decoder
+        else:
+            # Frames are only converted and scaled as far as the consumer asks for, pool workers always hand out bgr24
+            self.decoder = StreamingDecoder(output_format, *(output_size or (None, None)), frame_pool=frame_pool)
+
+    def on_data_received(self, data, count):
+        if self.metrics:
+            self.recv_time = time.monotonic_ns()
+            self.metrics.bytes_received += len(data)
+            self.metrics.chunks_received += 1
+        (self.ingest_buffer or self.parser).enqueue(data, count)
+
+    def on_data_committed(self, size, count):
+        # size bytes received by TCPServer straight into ingest_buffer.writable()
+        if self.metrics:
+            self.recv_time = time.monotonic_ns()
+            self.metrics.bytes_received += size
+            self.metrics.chunks_received += 1
+        self.ingest_buffer.commit(size, count)
+
+    def on_unit_received(self, payload, count):
+        # One whole length-prefixed unit from TCPServer, no start code search needed
+        if self.metrics:
+            self.recv_time = time.monotonic_ns()
+            self.metrics.bytes_received += len(payload)
+            self.metrics.chunks_received += 1
+        self.parser.unit_received(payload, count)
+
+    def unit_handler(self, unit: H264Unit, count):
+        if self.metrics:
+            self.split_time = time.monotonic_ns()
+            self.metrics.units_parsed += 1
+        if self.recorder:
+            self.recorder.record(unit)
+        if self.overload:
+            # Measured once per picture, the controller decides on its first slice
+            backlog = self.backlog() if unit.is_slice and unit.first_mb_in_slice == 0 else 0
+            if not self.overload.admit(unit, backlog):
+                return
+        if self.assembler:
+            self.assembler.push(unit)
+            return
+        self.decode(self.builder.build(unit))
+
+    def attach_socket(self, client_socket):
+        self.socket = client_socket
+
+    def backlog(self):
+        """Frames received but not decoded yet."""
+        if self.decode_pool:
+            # Frames the pool dropped for lack of slots never come back
+            dropped = self.decode_pool.dropped_frames.get(self.stream_id, 0)
+            return max(0, self.submitted_count - self.frame_count - dropped)
+        # Decoding runs on the receive thread, so a slow decoder leaves the stream waiting in the
+        # socket. Those bytes in frames of average size are how far it is behind
+        pending_slices = self.parser.pending_slices
+        if self.ingest_buffer:
+            pending_slices += self.ingest_buffer.pending_slices
+        if not self.frame_bytes or not self.socket:
+            return pending_slices
+        return pending_slices + int(TCPServer.unread_bytes(self.socket) / self.frame_bytes)
+
+    def access_unit_handler(self, access_unit: AccessUnit):
+        self.decode(self.builder.build_access_unit(access_unit))
+
+    def decode(self, build_data):
+        if build_data is None:
+            return
+        if self.decode_pool and self.stream_id is None and self.builder.sps_info is None:
+            # Pool slots are sized from the SPS, frames wait for one that parses
+            if self.metrics:
+                self.metrics.drop()
+            return
+        # Averaged over about a GOP, so an IDR waiting in the socket does not look like many frames
+        self.frame_bytes = self.frame_bytes * 0.98 + len(build_data) * 0.02 if self.frame_bytes else len(build_data)
+
+        trace = None
+        if self.metrics:
+            trace = FrameTrace(self.recv_time, self.split_time)
+            trace.build = trace.decode_start = time.monotonic_ns()
+            self.metrics.frames_built += 1
+
+        if self.decode_pool:
+            if self.stream_id is None:
+                width, height = self.builder.sps_info.resolution
+                self.stream_id = self.decode_pool.open_stream(self.shared_frame_handler, width * height * 3)
+                # The backlog counts frames of this pool stream only
+                self.submitted_count = self.frame_count
+            if trace:
+                self.pending_traces.append(trace)
+            self.decode_pool.submit(self.stream_id, build_data)
+            self.submitted_count += 1
+            return
+
+        frames = self.decoder.decode_data(build_data)
+        if trace:
+            trace.decode_end = time.monotonic_ns()
+        for frame in frames:
+            self.deliver(frame, trace)
+
+    def deliver(self, frame, trace):
+        self.frame_count += 1
+        self.trace = trace
+        if self.metrics:
+            self.metrics.frames_decoded += 1
+        if self.snapshots:
+            # Before the handler, which may release a pooled frame
+            output_format = self.decoder.converter.output_format if self.decoder else OutputFormat.BGR24
+            self.snapshots.submit(self.address, frame, output_format)
+        if self.frame_handler:
+            self.frame_handler(frame, self)
+        elif self.frame_pool and not self.decode_pool:
+            frame.release()
+        if self.metrics and self.report_delivery:
+            self.metrics.deliver(trace)
+
+    def resolution_handler(self, width, height):
+        # Frames of the new size need larger or smaller slots, the next build opens a new pool stream
+        if self.stream_id is not None:
+            self.decode_pool.close_stream(self.stream_id)
+            self.stream_id = None
+
+    def shared_frame_handler(self, shared_frame):
+        # The array is a view into shared memory, handlers have to copy what they keep
+        trace = None
+        if self.pending_traces:
+            # Frames come back in submission order
+            trace = self.pending_traces.popleft()
+            trace.decode_end = time.monotonic_ns()
+        with shared_frame:
+            self.deliver(shared_frame.array, trace)
+
+    def close(self):
+        if self.assembler:
+            self.assembler.flush()
+        if self.recorder:
+            self.recorder.close()
+        if self.metrics:
+            self.metrics.closed = True
+
+        if self.decode_pool:
+            if self.stream_id is not None:
+                self.decode_pool.close_stream(self.stream_id)
+            print(f"Session {self.address} closed")
+        else:
+            for frame in self.decoder.flush():
+                self.deliver(frame, None)
+            self.decoder.close()
+            print(f"Session {self.address} closed after {self.frame_count} frames")
+        if self.snapshots:
+            self.snapshots.close_stream(self.address)
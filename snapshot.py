@@ -0,0 +1,152 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from frame_decoder import OutputFormat
+from frame_pool import PooledFrame
+
+
+class SnapshotEncoder:
+    """
+    Encodes stills of decoded frames to JPEG, PNG or WebP on a thread pool,
+    cv2.imencode releases the GIL while it works. submit only checks the per
+    stream rate limit and copies the frame, downscaling and encoding happen
+    on the workers, so snapshots never hold up the thread that decodes.
+
+    The newest snapshot of every stream is kept in memory (latest), handed to
+    snapshot_handler when set and, with a directory, written to files in
+    batches of batch_size.
+    """
+    EXTENSIONS = {'jpeg': '.jpg', 'png': '.png', 'webp': '.webp'}
+
+    def __init__(self, image_format='jpeg', quality=85, max_fps=1.0, max_size=None, directory=None,
+                 batch_size=16, worker_count=2, max_pending=8):
+        import cv2
+        self.cv2 = cv2
+        if image_format not in SnapshotEncoder.EXTENSIONS:
+            raise ValueError(f"Unsupported snapshot format {image_format}")
+        self.extension = SnapshotEncoder.EXTENSIONS[image_format]
+        self.params = {
+            'jpeg': [cv2.IMWRITE_JPEG_QUALITY, quality],
+            'png': [cv2.IMWRITE_PNG_COMPRESSION, 3],
+            'webp': [cv2.IMWRITE_WEBP_QUALITY, quality]
+        }[image_format]
+        self.min_interval = 1 / max_fps if max_fps else 0  # Per stream
+        self.max_size = max_size  # (width, height) box the snapshot is scaled down to fit
+        self.directory = directory
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.snapshot_handler = None  # Called on a worker with stream name, timestamp and encoded bytes
+        self.executor = ThreadPoolExecutor(worker_count, thread_name_prefix='snapshot')
+        self.lock = threading.Lock()
+        self.last_submit = {}
+        self.latest = {}  # stream name -> (timestamp, encoded bytes)
+        self.batch = []
+        self.pending = 0
+        self.encoded_count = 0
+        self.skipped_count = 0  # Over the rate limit, with max_pending encodes in flight or not an image
+        self.failed_count = 0  # Encodes that raised, snapshot_handler errors included
+
+    def submit(self, stream_name, frame, pixel_format=OutputFormat.BGR24):
+        """
+        Takes a snapshot of frame (an array, YUV420P planes, an av.VideoFrame
+        or a PooledFrame, which stays owned by the caller) unless the stream's
+        rate limit or the pending limit says otherwise. Returns whether it was
+        taken.
+        """
+        if isinstance(frame, PooledFrame):
+            frame = frame.array
+        if hasattr(frame, 'to_ndarray'):
+            # An av.VideoFrame, decoders hand out a new one every time so the worker can convert it
+            pixel_format = OutputFormat.FRAME
+        elif not isinstance(frame, (np.ndarray, list, tuple)):
+            with self.lock:
+                self.skipped_count += 1
+            return False
+
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_submit.get(stream_name, -self.min_interval) < self.min_interval \
+                    or self.pending >= self.max_pending:
+                self.skipped_count += 1
+                return False
+            self.last_submit[stream_name] = now
+            self.pending += 1
+
+        if isinstance(frame, (list, tuple)):
+            # Separate planes, packed into one I420 array by the copy
+            frame = np.concatenate([plane.reshape(-1) for plane in frame]).reshape(-1, frame[0].shape[1])
+        elif isinstance(frame, np.ndarray):
+            frame = frame.copy()
+        future = self.executor.submit(self.encode, stream_name, time.time(), frame, pixel_format)
+        future.add_done_callback(lambda done: self.encode_done(stream_name, done))
+        return True
+
+    def close_stream(self, stream_name):
+        """Forgets the rate limit of a stream that went away."""
+        with self.lock:
+            self.last_submit.pop(stream_name, None)
+
+    def encode_done(self, stream_name, future):
+        # Nobody waits on the futures, failures would go unnoticed otherwise
+        if not future.cancelled() and future.exception() is not None:
+            with self.lock:
+                self.failed_count += 1
+            print(f"Failed to snapshot {stream_name}: {future.exception()!r}")
+
+    def encode(self, stream_name, timestamp, frame, pixel_format):
+        cv2 = self.cv2
+        try:
+            if pixel_format == OutputFormat.FRAME:
+                frame = frame.to_ndarray(format='bgr24')
+            elif pixel_format == OutputFormat.YUV420P:
+                frame = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420)
+            if self.max_size:
+                height, width = frame.shape[:2]
+                scale = min(self.max_size[0] / width, self.max_size[1] / height)
+                if scale < 1:
+                    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            ok, encoded = cv2.imencode(self.extension, frame, self.params)
+            if not ok:
+                print(f"Failed to encode snapshot of {stream_name}")
+                return
+            data = encoded.tobytes()
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+        batch = None
+        with self.lock:
+            self.encoded_count += 1
+            self.latest[stream_name] = (timestamp, data)
+            if self.directory:
+                self.batch.append((stream_name, timestamp, self.encoded_count, data))
+                if len(self.batch) >= self.batch_size:
+                    batch, self.batch = self.batch, []
+        if self.snapshot_handler:
+            self.snapshot_handler(stream_name, timestamp, data)
+        if batch:
+            self.write_batch(batch)
+
+    def write_batch(self, batch):
+        for stream_name, timestamp, sequence, data in batch:
+            stream = re.sub(r'[^\w.-]+', '_', str(stream_name)).strip('_')
+            name = f"{stream}_{int(timestamp * 1000)}_{sequence}{self.extension}"
+            with open(os.path.join(self.directory, name), 'wb') as file:
+                file.write(data)
+
+    def flush(self):
+        with self.lock:
+            batch, self.batch = self.batch, []
+        if batch:
+            self.write_batch(batch)
+
+    def close(self):
+        """Waits for the encodes in flight and writes the last batch."""
+        self.executor.shutdown()
+        self.flush()
@@ -0,0 +1,79 @@
+from fractions import Fraction
+
+import av
+import numpy as np
+
+from access_unit import AccessUnit, AccessUnitAssembler
+from builder import FrameDataBuilder
+from frame_decoder import StreamingDecoder
+from h264_unit import H264Unit
+from nalu_parser import NALUParser
+
+
+def encode_multi_slice_stream(frame_count, slices):
+    codec = av.CodecContext.create('libx264', 'w')
+    codec.width = 320
+    codec.height = 240
+    codec.pix_fmt = 'yuv420p'
+    codec.time_base = Fraction(1, 30)
+    codec.options = {'slices': str(slices), 'aud': '1', 'tune': 'zerolatency'}
+    packets = []
+    for index in range(frame_count):
+        frame = av.VideoFrame.from_ndarray(np.full((240, 320, 3), index * 8, np.uint8), format='bgr24')
+        packets.extend(codec.encode(frame))
+    packets.extend(codec.encode(None))
+    return b''.join(bytes(packet) for packet in packets)
+
+
+def assemble(stream):
+    access_units = []
+    assembler = AccessUnitAssembler()
+    assembler.access_unit_handler = access_units.append
+
+    parser = NALUParser(short_start_codes=True)
+    parser.h264_unit_handler = lambda unit, count: assembler.push(unit)
+    parser.enqueue(stream + NALUParser.START_CODE, 0)
+    assembler.flush()
+    return access_units
+
+
+def test_multi_slice_pictures_are_decoded_once():
+    access_units = assemble(encode_multi_slice_stream(10, slices=4))
+    assert len(access_units) == 10
+    assert [access_unit.slice_count for access_unit in access_units] == [4] * 10
+    assert access_units[0].is_key_frame and not access_units[1].is_key_frame
+
+    builder = FrameDataBuilder(incremental=True)
+    decoder = StreamingDecoder()
+    decode_calls = 0
+    frames = []
+    for access_unit in access_units:
+        build_data = builder.build_access_unit(access_unit)
+        decode_calls += 1
+        frames.extend(decoder.decode_data(build_data))
+    frames.extend(decoder.flush())
+
+    assert decode_calls == 10
+    assert len(frames) == 10
+    assert all(frame.shape == (240, 320, 3) for frame in frames)
+
+
+def test_first_mb_in_slice_without_aud():
+    stream = encode_multi_slice_stream(3, slices=3)
+    units = []
+    parser = NALUParser(short_start_codes=True)
+    parser.h264_unit_handler = lambda unit, count: units.append(unit)
+    parser.enqueue(stream + NALUParser.START_CODE, 0)
+
+    assembler = AccessUnitAssembler()
+    access_units = []
+    assembler.access_unit_handler = access_units.append
+    for unit in units:
+        if unit.type not in (H264Unit.NALUType.AUD, H264Unit.NALUType.SEI):
+            assembler.push(unit)
+    assembler.flush()
+
+    slices = [unit for unit in units if unit.is_slice]
+    assert [unit.first_mb_in_slice == 0 for unit in slices[:3]] == [True, False, False]
+    assert [access_unit.slice_count for access_unit in access_units] == [3, 3, 3]
+    assert isinstance(access_units[0], AccessUnit)
@@ -0,0 +1,74 @@
+from an_data import test_data
+from builder import FrameDataBuilder
+from frame_decoder import StreamingDecoder
+from h264_unit import H264Unit
+from nalu_parser import NALUParser
+
+
+def parse_units():
+    units = []
+
+    def test_unit_handler(unit: H264Unit, count):
+        if unit.type != H264Unit.NALUType.SEI:
+            units.append(unit)
+
+    parser = NALUParser()
+    parser.h264_unit_handler = test_unit_handler
+    for count, data in enumerate(test_data):
+        parser.enqueue(data, count)
+    return units
+
+
+def emitted_bytes(frame_count, incremental):
+    sps, pps, idr, p_frame = parse_units()
+    builder = FrameDataBuilder(incremental=incremental)
+    total = 0
+    for unit in [sps, pps, idr] + [p_frame] * (frame_count - 1):
+        build_data = builder.build(unit)
+        if build_data is not None:
+            total += len(build_data)
+    return total
+
+
+def test_incremental_builder_is_linear():
+    sps, pps, idr, p_frame = parse_units()
+    header = len(sps.data) + len(pps.data) + len(idr.data)
+
+    for frame_count in [1, 10, 60]:
+        expected = header + (frame_count - 1) * len(p_frame.data)
+        assert emitted_bytes(frame_count, incremental=True) == expected
+
+    # The legacy mode resends the GOP with every P-frame
+    assert emitted_bytes(60, incremental=False) > 20 * emitted_bytes(60, incremental=True)
+
+
+def test_incremental_builder_resends_changed_parameter_sets():
+    sps, pps, idr, p_frame = parse_units()
+    builder = FrameDataBuilder(incremental=True)
+
+    assert builder.build(p_frame) is None
+    builder.build(sps)
+    builder.build(pps)
+    assert builder.build(p_frame) is None
+    assert builder.build(idr) == sps.data + pps.data + idr.data
+    assert builder.build(idr) == idr.data
+
+    builder.build(sps)
+    builder.build(pps)
+    assert builder.build(idr) == idr.data
+
+    changed_pps = H264Unit(pps.data + b'\x80')
+    builder.build(changed_pps)
+    assert builder.build(p_frame) == sps.data + changed_pps.data + p_frame.data
+
+
+def test_incremental_builder_decodes():
+    decoder = StreamingDecoder()
+    builder = FrameDataBuilder(incremental=True)
+    frames = []
+    for unit in parse_units():
+        build_data = builder.build(unit)
+        if build_data is None:
+            continue
+        frames.extend(decoder.decode_data(build_data))
+    assert len(frames) == 2
@@ -0,0 +1,55 @@
+import socket
+import threading
+import time
+
+from an_data import test_data
+from capture import CaptureReader, CaptureWriter
+from replay import ReplayClient
+from server import AsyncTCPServer
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_capture_and_replay(tmp_path):
+    capture_path = str(tmp_path / 'stream.h264cap')
+    received = {}
+    stream = b''.join(test_data)
+
+    def on_data_received(data, count):
+        received.setdefault(threading.get_ident(), bytearray()).extend(data)
+
+    server = AsyncTCPServer(host='127.0.0.1', port=0)
+    server.capture = CaptureWriter(capture_path)
+    server.received_data_handler = on_data_received
+    server.start()
+    for _ in range(2):
+        with socket.create_connection(('127.0.0.1', server.port)) as client:
+            for data in test_data:
+                client.sendall(data)
+    wait_until(lambda: sum(len(data) for data in received.values()) == 2 * len(stream))
+    server.stop()
+    server.capture.close()
+
+    reader = CaptureReader(capture_path)
+    assert reader.connection_ids == [0, 1]
+    for connection_id in reader.connection_ids:
+        assert b''.join(bytes(chunk) for _, _, chunk in reader.records(connection_id)) == stream
+    timestamps = [timestamp for timestamp, _, _ in reader.records()]
+    assert timestamps == sorted(timestamps)
+    reader.close()
+
+    # Replay both captured connections three times in parallel
+    replayed = []
+    replay_server = AsyncTCPServer(host='127.0.0.1', port=0)
+    replay_server.received_data_handler = lambda data, count: replayed.append(len(data))
+    replay_server.start()
+    client = ReplayClient(capture_path, port=replay_server.port, mode=ReplayClient.MAX_SPEED, connections=3)
+    client.run()
+    wait_until(lambda: sum(replayed) == 6 * len(stream))
+    replay_server.stop()
+    assert client.sent_bytes == 6 * len(stream)
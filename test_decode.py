@@ -1,8 +1,13 @@
+import shutil
+
 import cv2
+import numpy as np
+import pytest
 
-from an_data import test_byte_array
-from builder import frame_data_builder
-from frame_decoder import FrameDecoder
+from an_data import test_byte_array, test_data
+from builder import FrameDataBuilder, frame_data_builder
+from frame_decoder import FrameDecoder, OutputFormat, StreamingDecoder
+from frame_processor import FrameProcessor
 from h264_unit import H264Unit
 from nalu_parser import NALUParser
 
@@ -29,5 +34,89 @@ def test():
     parser.enqueue(test_byte_array, 1)
 
 
+def test_streaming_decoder():
+    decoder = StreamingDecoder()
+    shapes = []
+
+    def test_unit_handler(unit: H264Unit, count):
+        for frame in decoder.decode(unit):
+            shapes.append(frame.shape)
+
+    parser = NALUParser()
+    parser.h264_unit_handler = test_unit_handler
+    for count, data in enumerate(test_data):
+        parser.enqueue(data, count)
+
+    # One IDR and one P-frame, each decoded exactly once
+    assert shapes == [(1280, 720, 3), (1280, 720, 3)]
+
+
+def decode_units(decoder):
+    frames = []
+    parser = NALUParser()
+    parser.h264_unit_handler = lambda unit, count: frames.extend(decoder.decode(unit))
+    for count, data in enumerate(test_data):
+        parser.enqueue(data, count)
+    return frames
+
+
+def test_streaming_decoder_output_formats():
+    gray = decode_units(StreamingDecoder(OutputFormat.GRAY8))
+    # The luma plane is handed out as is, without a copy
+    assert gray[0].shape == (1280, 720) and not gray[0].flags.owndata
+
+    y, u, v = decode_units(StreamingDecoder(OutputFormat.YUV420P))[0]
+    assert (y.shape, u.shape, v.shape) == ((1280, 720), (640, 360), (640, 360))
+    assert (y == gray[0]).all()
+
+    scaled = decode_units(StreamingDecoder(OutputFormat.GRAY8, width=360, height=640))
+    assert [frame.shape for frame in scaled] == [(640, 360), (640, 360)]
+    # Only the luma plane is scaled, OpenCV's filter is close to the one libswscale uses for YUV420P
+    scaled_y = decode_units(StreamingDecoder(OutputFormat.YUV420P, width=360, height=640))[0][0]
+    assert np.abs(scaled[0].astype(int) - scaled_y).mean() < 1
+    assert decode_units(StreamingDecoder(width=180, height=320))[0].shape == (320, 180, 3)
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+def test_frame_processor_pipeline():
+    processor = FrameProcessor()
+    builder = FrameDataBuilder(incremental=True)
+
+    def test_unit_handler(unit: H264Unit, count):
+        build_data = builder.build(unit)
+        if build_data is not None:
+            # Never blocks waiting for FFmpeg to emit a frame
+            processor.nal_units_to_cv2_frame(build_data)
+
+    parser = NALUParser()
+    parser.h264_unit_handler = test_unit_handler
+    for count, data in enumerate(test_data):
+        parser.enqueue(data, count)
+    processor.close()
+
+    assert processor.frame_count == 2
+    assert processor.latest_frame.shape == (1280, 720, 3)
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+def test_frame_processor_scaled_gray():
+    processor = FrameProcessor(output_format=OutputFormat.GRAY8, output_size=(360, 640))
+    builder = FrameDataBuilder(incremental=True)
+
+    def test_unit_handler(unit: H264Unit, count):
+        build_data = builder.build(unit)
+        if build_data is not None:
+            processor.nal_units_to_cv2_frame(build_data)
+
+    parser = NALUParser()
+    parser.h264_unit_handler = test_unit_handler
+    for count, data in enumerate(test_data):
+        parser.enqueue(data, count)
+    processor.close()
+
+    assert processor.frame_count == 2
+    assert processor.latest_frame.shape == (640, 360)
+
+
 if __name__ == '__main__':
     test()
\ No newline at end of file
@@ -0,0 +1,138 @@
+import threading
+
+import numpy as np
+
+from an_data import test_data
+from builder import FrameDataBuilder
+from decode_pool import DecodeWorkerPool
+from frame_decoder import StreamingDecoder
+from h264_unit import H264Unit
+from metrics import StreamMetrics
+from nalu_parser import NALUParser
+from session import StreamSession
+
+
+def build_frame_data():
+    build_data = []
+    builder = FrameDataBuilder(incremental=True)
+
+    def test_unit_handler(unit: H264Unit, count):
+        data = builder.build(unit)
+        if data is not None:
+            build_data.append(data)
+
+    parser = NALUParser()
+    parser.h264_unit_handler = test_unit_handler
+    for count, data in enumerate(test_data):
+        parser.enqueue(data, count)
+    return build_data
+
+
+def test_decode_pool_matches_local_decoder():
+    build_data = build_frame_data()
+    decoder = StreamingDecoder()
+    expected = [frame for data in build_data for frame in decoder.decode_data(data)]
+
+    pool = DecodeWorkerPool(worker_count=2, slot_count=2)
+    pool.start()
+    received = {}
+    done = threading.Event()
+
+    def make_handler(name):
+        def frame_handler(shared_frame):
+            with shared_frame:
+                received.setdefault(name, []).append(shared_frame.array.copy())
+            if sum(len(frames) for frames in received.values()) == 2 * len(expected):
+                done.set()
+        return frame_handler
+
+    stream_ids = [pool.open_stream(make_handler(name)) for name in ['a', 'b']]
+    for data in build_data:
+        for stream_id in stream_ids:
+            pool.submit(stream_id, data)
+    assert done.wait(30)
+    dropped_frames = dict(pool.dropped_frames)
+    for stream_id in stream_ids:
+        pool.close_stream(stream_id)
+    pool.stop()
+
+    for name in ['a', 'b']:
+        assert len(received[name]) == len(expected)
+        for frame, expected_frame in zip(received[name], expected):
+            assert np.array_equal(frame, expected_frame)
+    assert dropped_frames == {stream_id: 0 for stream_id in stream_ids}
+    # Closed streams are forgotten
+    assert pool.dropped_frames == {}
+
+
+def test_failing_frame_handler_keeps_collector_running():
+    build_data = build_frame_data()
+
+    class ReleaseCountingPool(DecodeWorkerPool):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.released = threading.Semaphore(0)
+
+        def release(self, stream_id, slot):
+            super().release(stream_id, slot)
+            self.released.release()
+
+    pool = ReleaseCountingPool(worker_count=1, slot_count=1)
+    pool.start()
+    received = []
+
+    def failing_handler(shared_frame):
+        raise RuntimeError("handler failed")
+
+    def frame_handler(shared_frame):
+        with shared_frame:
+            received.append(shared_frame.array.copy())
+
+    failing = pool.open_stream(failing_handler)
+    healthy = pool.open_stream(frame_handler)
+    # With a single slot every frame after the first needs the slot the failed handler gave back
+    for _ in range(3):
+        for data in build_data:
+            pool.submit(failing, data)
+            assert pool.released.acquire(timeout=30)
+    for data in build_data:
+        pool.submit(healthy, data)
+        assert pool.released.acquire(timeout=30)
+    assert pool.collector.is_alive()
+    assert pool.dropped_frames[failing] == 0
+    pool.close_stream(failing)
+    pool.close_stream(healthy)
+    pool.stop()
+
+    assert len(received) == len(build_data)
+
+
+def test_session_waits_for_a_parsed_sps():
+    class RecordingPool:
+        dropped_frames = {}
+
+        def __init__(self):
+            self.submitted = []
+
+        def open_stream(self, frame_handler, slot_size):
+            return 0
+
+        def submit(self, stream_id, data):
+            self.submitted.append(data)
+
+        def close_stream(self, stream_id):
+            pass
+
+    pool = RecordingPool()
+    metrics = StreamMetrics('test')
+    session = StreamSession(('127.0.0.1', 0), decode_pool=pool, metrics=metrics)
+    # As if the SPS failed to parse, the builder still has the raw parameter sets
+    session.builder.update_sps_info = lambda unit: None
+    for count, data in enumerate(test_data):
+        session.on_data_received(data, count)
+    session.on_data_received(NALUParser.START_CODE, len(test_data))
+    session.close()
+
+    assert pool.submitted == []
+    # Every built frame is counted as dropped, the last slice included once the start code ends it
+    assert metrics.frames_dropped == 3 and metrics.frames_built == 0
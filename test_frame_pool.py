@@ -0,0 +1,100 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from an_data import test_data
+from builder import FrameDataBuilder
+from frame_decoder import OutputFormat, StreamingDecoder
+from frame_pool import FramePool
+from frame_processor import FrameProcessor
+from h264_unit import H264Unit
+from nalu_parser import NALUParser
+
+
+def parse(unit_handler):
+    parser = NALUParser()
+    parser.h264_unit_handler = unit_handler
+    for count, data in enumerate(test_data):
+        parser.enqueue(data, count)
+
+
+def test_released_arrays_are_reused():
+    pool = FramePool(max_free=1)
+    first = pool.acquire((4, 4, 3))
+    array = first.array
+    first.release()
+    first.release()
+    with pool.acquire((4, 4, 3)) as second:
+        assert second.array is array
+    # Another format is another free list
+    assert pool.acquire((4, 4, 3), OutputFormat.GRAY8).array is not array
+    assert pool.stats() == {"allocated": 2, "reused": 1, "free": 1}
+
+
+@pytest.mark.parametrize('output_format', [OutputFormat.BGR24, OutputFormat.GRAY8, OutputFormat.YUV420P])
+def test_streaming_decoder_fills_pooled_frames(output_format):
+    pool = FramePool()
+    pooled_decoder = StreamingDecoder(output_format, frame_pool=pool)
+    decoder = StreamingDecoder(output_format)
+    pairs = []
+    parse(lambda unit, count: pairs.extend(zip(pooled_decoder.decode(unit), decoder.decode(unit))))
+
+    assert len(pairs) == 2
+    for pooled, frame in pairs:
+        if output_format == OutputFormat.BGR24:
+            # OpenCV converts pooled frames, it rounds a little differently than libswscale
+            assert pooled.shape == frame.shape
+            assert np.abs(pooled.array.astype(int) - frame).max() <= 4
+        else:
+            expected = np.concatenate([plane.reshape(-1) for plane in frame]) \
+                if output_format == OutputFormat.YUV420P else frame
+            assert pooled.array.tobytes() == np.ascontiguousarray(expected).tobytes()
+        pooled.release()
+    assert pool.stats()["free"] == 2
+
+
+def test_pooled_bgr_frames_are_converted_in_place():
+    pool = FramePool(max_free=1)
+    pooled_decoder = StreamingDecoder(OutputFormat.BGR24, 360, 640, frame_pool=pool)
+    decoder = StreamingDecoder(OutputFormat.BGR24, 360, 640)
+    arrays = []
+    frames = []
+
+    def unit_handler(unit, count):
+        for pooled in pooled_decoder.decode(unit):
+            arrays.append(pooled.array)
+            frames.append(pooled.array.copy())
+            pooled.release()
+        frames.extend(decoder.decode(unit))
+
+    parse(unit_handler)
+    # The second frame was converted into the array the first one gave back
+    assert len(arrays) == 2 and arrays[1] is arrays[0]
+    assert pool.stats()["allocated"] == 1
+    pooled_frame, frame = frames[0], frames[1]
+    assert pooled_frame.shape == frame.shape == (640, 360, 3)
+    # Scaled by OpenCV instead of libswscale, the pictures only roughly agree
+    assert np.abs(pooled_frame.astype(int) - frame).mean() < 4
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+def test_frame_processor_reads_into_pool():
+    pool = FramePool()
+    frames = []
+    processor = FrameProcessor(frame_handler=frames.append, frame_pool=pool)
+    builder = FrameDataBuilder(incremental=True)
+
+    def test_unit_handler(unit: H264Unit, count):
+        build_data = builder.build(unit)
+        if build_data is not None:
+            processor.nal_units_to_cv2_frame(build_data)
+
+    parse(test_unit_handler)
+    processor.close()
+
+    assert [frame.shape for frame in frames] == [(1280, 720, 3), (1280, 720, 3)]
+    for frame in frames:
+        frame.release()
+    # The preallocated arrays served every frame
+    assert pool.stats()["allocated"] == processor.buffer_count
@@ -0,0 +1,52 @@
+import queue
+import threading
+
+import pytest
+
+from frame_queue import FrameQueue
+
+
+def test_drop_oldest():
+    frame_queue = FrameQueue(maxsize=2, policy=FrameQueue.DROP_OLDEST)
+    for frame in range(5):
+        assert frame_queue.put(frame)
+    assert [frame_queue.get(0), frame_queue.get(0)] == [3, 4]
+    assert frame_queue.stats() == {"queued": 0, "put": 5, "dropped": 3}
+    with pytest.raises(queue.Empty):
+        frame_queue.get(0)
+
+
+def test_latest_only():
+    frame_queue = FrameQueue(maxsize=8, policy=FrameQueue.LATEST_ONLY)
+    for frame in range(5):
+        frame_queue.put(frame)
+    assert frame_queue.get(0) == 4
+    assert frame_queue.stats()["dropped"] == 4
+
+
+def test_block():
+    frame_queue = FrameQueue(maxsize=1, policy=FrameQueue.BLOCK)
+    assert frame_queue.put(0)
+    assert not frame_queue.put(1, timeout=0.01)
+
+    consumer = threading.Timer(0.05, frame_queue.get)
+    consumer.start()
+    assert frame_queue.put(2, timeout=5)
+    consumer.join()
+    assert frame_queue.get(0) == 2
+    assert frame_queue.stats() == {"queued": 0, "put": 2, "dropped": 1}
+
+
+def test_drop_handler_gets_every_dropped_frame():
+    dropped = []
+    frame_queue = FrameQueue(maxsize=2, policy=FrameQueue.DROP_OLDEST)
+    frame_queue.drop_handler = dropped.append
+    for frame in range(5):
+        frame_queue.put(frame)
+    assert dropped == [0, 1, 2]
+
+    blocking = FrameQueue(maxsize=1, policy=FrameQueue.BLOCK)
+    blocking.drop_handler = dropped.append
+    blocking.put(5)
+    assert not blocking.put(6, timeout=0.01)
+    assert dropped == [0, 1, 2, 6]
@@ -0,0 +1,85 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from bench import parse_units, synthesize_stream
+from frame_decoder import OutputFormat, StreamingDecoder
+from h264_converter import H264Converter
+
+
+def reference_frames(units, output_format):
+    decoder = StreamingDecoder(output_format)
+    frames = [frame for unit in units for frame in decoder.decode(unit)]
+    return frames + decoder.flush()
+
+
+def test_callback_frames_keep_decode_order():
+    units = parse_units([synthesize_stream(320, 240, frame_count=30, gop=10)])
+    converter = H264Converter(worker_count=4, max_pending=4)
+    frames = []
+    converter.sample_buffer_callback = frames.append
+    for unit in units:
+        assert converter.convert(unit)
+    converter.close()
+
+    expected = reference_frames(units, OutputFormat.BGR24)
+    assert len(frames) == len(expected) == 30
+    assert all(np.array_equal(frame, reference) for frame, reference in zip(frames, expected))
+
+
+def test_async_iterator():
+    units = parse_units([synthesize_stream(320, 240, frame_count=12, gop=6)])
+    converter = H264Converter(worker_count=2, output_format=OutputFormat.GRAY8, width=160, height=120)
+
+    async def consume():
+        return [frame async for frame in converter.frames()]
+
+    async def main():
+        consumer = asyncio.ensure_future(consume())
+        # Let the iterator start waiting before the first frame comes out
+        await asyncio.sleep(0)
+        loop = asyncio.get_running_loop()
+
+        def produce():
+            for unit in units:
+                converter.convert(unit)
+            converter.close()
+
+        await loop.run_in_executor(None, produce)
+        return await consumer
+
+    frames = asyncio.run(main())
+    assert [frame.shape for frame in frames] == [(120, 160)] * 12
+
+
+def test_frames_decoded_before_iteration_are_kept():
+    units = parse_units([synthesize_stream(320, 240, frame_count=12, gop=6)])
+    converter = H264Converter(worker_count=2, max_pending=64)
+    for unit in units:
+        converter.convert(unit)
+    converter.close()
+
+    async def consume():
+        return [frame async for frame in converter.frames()]
+
+    assert len(asyncio.run(consume())) == 12
+
+
+def test_callback_error_is_raised():
+    units = parse_units([synthesize_stream(320, 240, frame_count=30, gop=10)])
+    converter = H264Converter(max_pending=2)
+
+    def sample_buffer_callback(frame):
+        raise ValueError("consumer failed")
+
+    converter.sample_buffer_callback = sample_buffer_callback
+    with pytest.raises(ValueError):
+        # The pipeline keeps draining, so this fails instead of blocking on full queues
+        for unit in units:
+            converter.convert(unit, timeout=5)
+        converter.close()
+    # Closing still drains and stops the threads, then reports the error again
+    with pytest.raises(ValueError):
+        converter.close()
+    assert not converter.threads
@@ -0,0 +1,51 @@
+from fractions import Fraction
+
+import av
+import numpy as np
+
+from an_data import test_data
+from builder import FrameDataBuilder
+from h264_unit import H264Unit
+from nalu_parser import NALUParser
+
+
+def encode_stream(width, height, profile, pix_fmt='yuv420p'):
+    codec = av.CodecContext.create('libx264', 'w')
+    codec.width = width
+    codec.height = height
+    codec.pix_fmt = pix_fmt
+    codec.time_base = Fraction(1, 30)
+    codec.options = {'profile': profile}
+    frame = av.VideoFrame.from_ndarray(np.zeros((height, width, 3), np.uint8), format='bgr24')
+    packets = codec.encode(frame.reformat(format=pix_fmt)) + codec.encode(None)
+    return b''.join(bytes(packet) for packet in packets)
+
+
+def test_sps_geometry():
+    sps_info = H264Unit(test_data[0]).sps_info
+    assert (sps_info.profile_idc, sps_info.level_idc) == (66, 31)
+    assert sps_info.resolution == (720, 1280)
+    assert H264Unit(test_data[3]).sps_info is None
+
+
+def test_sps_cropping_and_high_profiles():
+    for width, height, profile, pix_fmt in [(1920, 1080, 'high', 'yuv420p'),
+                                             (642, 362, 'baseline', 'yuv420p'),
+                                             (330, 250, 'high422', 'yuv422p'),
+                                             (320, 240, 'high444', 'yuv444p')]:
+        sps_info = H264Unit.find_sps(encode_stream(width, height, profile, pix_fmt))
+        assert sps_info.resolution == (width, height)
+
+
+def test_builder_reports_resolution_changes():
+    resolutions = []
+    builder = FrameDataBuilder(incremental=True)
+    builder.resolution_handler = lambda width, height: resolutions.append((width, height))
+
+    sps = H264Unit(test_data[0])
+    builder.build(sps)
+    builder.build(sps)
+    parser = NALUParser(short_start_codes=True)
+    parser.h264_unit_handler = lambda unit, count: builder.build(unit)
+    parser.enqueue(encode_stream(640, 360, 'baseline') + NALUParser.START_CODE, 0)
+    assert resolutions == [(720, 1280), (640, 360)]
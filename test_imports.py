@@ -0,0 +1,25 @@
+import subprocess
+import sys
+
+from frame_decoder import StreamingDecoder, warm_up
+from frame_pool import FramePool
+
+
+def loaded_modules(statement):
+    code = f"import sys; {statement}; print(' '.join(sys.modules))"
+    return set(subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.split())
+
+
+def test_ingest_path_skips_codec_and_gui_libraries():
+    heavy = {'cv2', 'ffmpeg', 'av', 'numpy', 'asyncio'}
+    assert not heavy & loaded_modules("import server, nalu_parser, h264_unit, builder")
+    # Sessions load NumPy, the codec library is loaded by the first decoder
+    assert not {'cv2', 'ffmpeg', 'av'} & loaded_modules("import session")
+
+
+def test_warm_up():
+    pool = FramePool(max_free=2)
+    decoders = warm_up(2, pool, [((720, 1280, 3), 'bgr24')])
+    assert len(decoders) == 2 and all(isinstance(decoder, StreamingDecoder) for decoder in decoders)
+    assert all(decoder.codec.is_open for decoder in decoders)
+    assert pool.stats()["free"] == 2
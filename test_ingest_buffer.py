@@ -0,0 +1,108 @@
+import socket
+import threading
+
+import pytest
+
+from an_data import test_data
+from h264_unit import H264Unit
+from ingest_buffer import IngestBuffer
+from nalu_parser import NALUParser
+from server import TCPServer
+from session import StreamSession
+
+
+def ingest_chunks(chunks, capacity=1 << 16, overflow=IngestBuffer.RESYNC, short_start_codes=True):
+    units = []
+
+    def test_unit_handler(unit: H264Unit, count):
+        assert isinstance(unit.payload, memoryview)
+        units.append(bytes(unit.payload))
+
+    ingest_buffer = IngestBuffer(capacity, overflow, short_start_codes)
+    ingest_buffer.h264_unit_handler = test_unit_handler
+    for count, data in enumerate(chunks):
+        # Received the way TCPServer does, straight into the free space
+        while data:
+            view = ingest_buffer.writable()
+            size = min(len(view), len(data))
+            view[:size] = data[:size]
+            data = data[size:]
+            ingest_buffer.commit(size, count)
+    return units, ingest_buffer
+
+
+def parser_units(stream, short_start_codes=True):
+    units = []
+    parser = NALUParser(short_start_codes=short_start_codes)
+    parser.h264_unit_handler = lambda unit, count: units.append(bytes(unit.payload))
+    parser.enqueue(stream, 0)
+    return units
+
+
+def test_chunk_splits_match_parser():
+    stream = b''.join(test_data)
+    for short_start_codes in [True, False]:
+        expected = parser_units(stream, short_start_codes)
+        for chunk_size in [1, 2, 3, 5, 7, 1000]:
+            chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+            units, _ = ingest_chunks(chunks, short_start_codes=short_start_codes)
+            assert units == expected
+
+
+def test_compaction_keeps_units_intact():
+    stream = b''.join(test_data) * 20
+    largest = max(len(data) for data in test_data)
+    # Small enough that the buffer has to move data back to the front many times
+    units, ingest_buffer = ingest_chunks([stream[i:i + 100] for i in range(0, len(stream), 100)],
+                                         capacity=largest * 2)
+    assert units == parser_units(stream)
+    assert ingest_buffer.overflow_count == 0
+
+
+def test_leading_garbage_is_counted():
+    stream = b''.join(test_data)
+    units, ingest_buffer = ingest_chunks([b'\x17\x42\x00\x00', stream])
+    assert units == parser_units(stream)
+    assert ingest_buffer.discarded_bytes == 4
+
+
+def test_overflow_resyncs_to_next_start_code():
+    stream = b''.join(test_data)
+    oversized = NALUParser.START_CODE + b'\x41' + b'\xff' * 10000
+    units, ingest_buffer = ingest_chunks([oversized, stream, NALUParser.START_CODE], capacity=4096)
+    assert ingest_buffer.overflow_count == 1
+    assert ingest_buffer.discarded_bytes >= 4096
+    # Only the units that fit the buffer come through
+    assert units == [unit for unit in parser_units(stream + NALUParser.START_CODE) if len(unit) <= 4096]
+
+
+def test_overflow_disconnects():
+    oversized = NALUParser.START_CODE + b'\x41' + b'\xff' * 10000
+    with pytest.raises(OverflowError):
+        ingest_chunks([oversized], capacity=4096, overflow=IngestBuffer.DISCONNECT)
+
+
+def test_server_receives_into_ingest_buffer():
+    closed = []
+    all_closed = threading.Event()
+
+    class RecordingSession(StreamSession):
+        def close(self):
+            super().close()
+            closed.append((self.frame_count, self.ingest_buffer.overflow_count))
+            if len(closed) == 2:
+                all_closed.set()
+
+    server = TCPServer(host='127.0.0.1', port=0)
+    server.session_factory = lambda addr: RecordingSession(addr, ingest_capacity=4096,
+                                                           overflow=IngestBuffer.DISCONNECT)
+    server.start()
+    stream = b''.join(test_data) + NALUParser.START_CODE
+    oversized = NALUParser.START_CODE + b'\x41' + b'\xff' * 10000
+    for data in [stream, oversized]:
+        with socket.create_connection(('127.0.0.1', server.port)) as client:
+            client.sendall(data)
+    assert all_closed.wait(5)
+    server.stop()
+
+    assert sorted(closed) == [(0, 1), (2, 0)]
@@ -0,0 +1,61 @@
+import time
+
+from bench import synthesize_stream
+from loadgen import CameraSender, SoakHarness, split_pictures
+from server import TCPServer
+
+
+class SteppingClock:
+    """Time as far as the harness has slept, whatever the real sleeps took."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+        self.now += seconds
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_split_pictures():
+    pictures = split_pictures(synthesize_stream(160, 128, frame_count=10, gop=5))
+    assert len(pictures) == 10
+    # Parameter sets travel with the IDR that follows them
+    assert pictures[0][4] & 0x1F == 7
+
+
+def test_sender_reconnects():
+    pictures = split_pictures(synthesize_stream(160, 128, frame_count=10, gop=5))
+    server = TCPServer(host='127.0.0.1', port=0)
+    server.received_data_handler = lambda data, count: None
+    server.start()
+    sender = CameraSender(pictures, '127.0.0.1', server.port, fps=100, reconnect_interval=0.05)
+    sender.start()
+    wait_for(lambda: sender.connections >= 3)
+    sender.stop()
+    server.stop()
+    assert sender.errors == 0
+
+
+def test_soak_harness_decodes_all_streams():
+    pictures = split_pictures(synthesize_stream(160, 128, frame_count=10, gop=5))
+    clock = SteppingClock()
+    harness = SoakHarness(pictures, stream_count=2, sample_interval=0.5, clock=clock, sleep=clock.sleep,
+                          fps=50, segment_size=100, burst_probability=0.2, burst_frames=3)
+    report = harness.run(1.2)
+
+    # Two full intervals and a shorter one to the end of the run
+    assert [sample["elapsed_s"] for sample in report["samples"]] == [0.5, 1.0, 1.2]
+    assert all(sample["rss_mb"] > 0 for sample in report["samples"])
+    assert report["connections"] >= 2
+    assert 0 < report["frames_decoded"] <= report["frames_sent"]
+    assert report["latency_p99_ms"] is not None
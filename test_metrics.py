@@ -0,0 +1,62 @@
+import threading
+import urllib.request
+
+from an_data import test_data
+from metrics import FrameTrace, Histogram, MetricsRegistry, StreamMetrics
+from session import StreamSession
+
+
+def test_session_traces_frames():
+    registry = MetricsRegistry()
+    metrics = registry.stream(('127.0.0.1', 5000))
+    traces = []
+    session = StreamSession(('127.0.0.1', 5000), frame_handler=lambda frame, s: traces.append(s.trace),
+                            metrics=metrics)
+    for count, data in enumerate(test_data):
+        session.on_data_received(data, count)
+    session.close()
+
+    assert metrics.bytes_received == sum(len(data) for data in test_data)
+    assert metrics.chunks_received == len(test_data)
+    assert metrics.frames_decoded == metrics.frames_delivered == 2
+    for trace in traces:
+        assert trace.recv <= trace.split <= trace.build <= trace.decode_start <= trace.decode_end <= trace.delivered
+    assert metrics.latency['total'].count == 2
+    assert metrics.summary()['frames_delivered'] == 2
+
+    registry.serve(port=0)
+    with urllib.request.urlopen(f"http://127.0.0.1:{registry.http_server.server_port}/metrics") as response:
+        body = response.read().decode()
+    registry.stop()
+    assert 'h264_frames_decoded_total{stream="(\'127.0.0.1\', 5000)"} 2' in body
+    assert 'stage="decode",le="+Inf"} 2' in body
+
+    # Closed streams are dropped once the next connection registers
+    registry.stream(('127.0.0.1', 5001))
+    assert list(registry.streams) == ["('127.0.0.1', 5001)"]
+
+
+def test_drops_from_other_threads_are_all_counted():
+    metrics = StreamMetrics('test')
+
+    def drop_frames():
+        for _ in range(10000):
+            metrics.drop(FrameTrace(recv=1, split=2))
+
+    threads = [threading.Thread(target=drop_frames) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics.frames_dropped == 40000
+    assert metrics.latency['split'].count == 40000
+
+
+def test_histogram_quantiles():
+    histogram = Histogram()
+    for value in [0.0005] * 98 + [0.3, 10]:
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 0.001
+    assert histogram.quantile(0.99) == 0.5
+    assert histogram.quantile(1.0) == float('inf')
+    assert list(FrameTrace(recv=1, split=2).stages()) == [('split', 1e-9)]
@@ -0,0 +1,83 @@
+import pytest
+
+from an_data import test_data
+from h264_unit import H264Unit
+from nalu_parser import NALUParser
+
+
+def length_prefixed(units):
+    return b''.join(len(unit[4:]).to_bytes(4, 'big') + unit[4:] for unit in units)
+
+
+def parse_chunks(chunks, framing=NALUParser.ANNEX_B):
+    units = []
+
+    def test_unit_handler(unit: H264Unit, count):
+        units.append(bytes(unit.payload))
+
+    parser = NALUParser(framing=framing)
+    parser.h264_unit_handler = test_unit_handler
+    for count, data in enumerate(chunks):
+        parser.enqueue(data, count)
+    return units
+
+
+def test_start_code_split_across_chunks():
+    stream = b''.join(test_data)
+    expected = parse_chunks([stream])
+    assert [unit[4] & 0x1F for unit in expected] == [7, 8, 6, 5, 1]
+
+    for chunk_size in [1, 2, 3, 5, 7, 1000]:
+        chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+        assert parse_chunks(chunks) == expected
+
+
+def test_leading_garbage_is_dropped():
+    stream = b''.join(test_data)
+    assert parse_chunks([b'\x17\x00\x00', stream]) == parse_chunks([stream])
+
+
+def test_short_start_codes():
+    stream = b''.join(test_data)
+    units = []
+
+    def test_unit_handler(unit: H264Unit, count):
+        units.append(unit)
+
+    parser = NALUParser(short_start_codes=True)
+    parser.h264_unit_handler = test_unit_handler
+    # Everything after the SPS uses 3-byte start codes, split at odd offsets
+    short_stream = stream[:14] + stream[14:].replace(b'\x00\x00\x00\x01', b'\x00\x00\x01')
+    for count, offset in enumerate(range(0, len(short_stream), 5)):
+        parser.enqueue(short_stream[offset:offset + 5], count)
+
+    assert [(unit.type_number, unit.header_offset) for unit in units] == [(7, 4), (8, 3), (6, 3), (5, 3), (1, 3)]
+    assert [bytes(unit.payload[unit.header_offset:]) for unit in units] == \
+           [unit[4:] for unit in parse_chunks([stream])]
+
+
+def test_rbsp_strips_emulation_prevention():
+    unit = H264Unit(b'\x00\x00\x01\x06\x05\x00\x00\x03\x00\x00\x03\x01\x80', header_offset=3)
+    assert unit.type_number == 6
+    assert unit.rbsp == b'\x05\x00\x00\x00\x00\x01\x80'
+
+
+def test_length_prefixed_framing():
+    expected = parse_chunks([b''.join(test_data)])
+    stream = length_prefixed(expected)
+    for chunk_size in [1, 3, 4, 7, 1000, len(stream)]:
+        chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+        # Same units with start codes in front, and the last one is not held back
+        assert parse_chunks(chunks, NALUParser.LENGTH_PREFIXED) == expected
+
+
+def test_oversized_length_prefix_is_rejected():
+    expected = parse_chunks([b''.join(test_data)])
+    units = []
+    parser = NALUParser(framing=NALUParser.LENGTH_PREFIXED, max_unit_size=4096)
+    parser.h264_unit_handler = lambda unit, count: units.append(bytes(unit.payload))
+    with pytest.raises(OverflowError):
+        parser.enqueue(length_prefixed(expected[:2]) + b'\xff\xff\xff\xf0\x65', 0)
+    # Units in front of the bad length are still handed out, nothing is buffered for it
+    assert units == expected[:2]
+    assert len(parser.data_stream) < 4096
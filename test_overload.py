@@ -0,0 +1,114 @@
+import socket
+import threading
+import time
+
+from an_data import test_data
+from bench import synthesize_stream
+from frame_decoder import StreamingDecoder
+from h264_unit import H264Unit
+from metrics import StreamMetrics
+from nalu_parser import NALUParser
+from overload import OverloadController
+from server import TCPServer
+from session import StreamSession
+
+
+def unit(nal_type, nal_ref_idc=2):
+    # Header, then first_mb_in_slice 0 as a 1-bit exp-Golomb code
+    return H264Unit(b'\x00\x00\x00\x01' + bytes([nal_ref_idc << 5 | nal_type, 0x80]))
+
+
+def run(controller, pictures, backlog=0):
+    return ''.join('+' if controller.admit(picture, backlog) else '-' for picture in pictures)
+
+
+def test_non_reference_slices_go_first():
+    controller = OverloadController(drop_backlog=2, skip_backlog=8)
+    pictures = [unit(5, 3), unit(1), unit(1, 0), unit(1), unit(1, 0)]
+    assert run(controller, pictures, backlog=0) == '+++++'
+    assert run(controller, pictures, backlog=3) == '++-+-'
+    # Parameter sets always pass
+    assert controller.admit(unit(7, 3), backlog=100)
+    assert controller.dropped[OverloadController.DROPPED_NON_REFERENCE] == 2
+
+
+def test_growing_backlog_skips_to_next_idr():
+    metrics = StreamMetrics('test')
+    controller = OverloadController(drop_backlog=2, skip_backlog=8, metrics=metrics)
+    assert run(controller, [unit(1)], backlog=8) == '-'
+    # The backlog is gone but the references are missing until the next IDR
+    assert run(controller, [unit(1), unit(1), unit(5, 3), unit(1)]) == '--++'
+    assert controller.dropped[OverloadController.DROPPED_UNTIL_IDR] == 3
+    assert metrics.frames_dropped == 3
+
+
+def test_max_fps():
+    pictures = [unit(5, 3), unit(1), unit(1, 0), unit(1), unit(1, 0), unit(1), unit(5, 3)]
+    controller = OverloadController(max_fps=2)
+    # A second worth of pictures fits the bucket, then the non-reference pictures go
+    # while the reference ones borrow, the stream keeps its GOP structure
+    assert run(controller, pictures) == '++-+-++'
+    assert controller.dropped == {OverloadController.DROPPED_NON_REFERENCE: 0,
+                                  OverloadController.DROPPED_UNTIL_IDR: 0,
+                                  OverloadController.DROPPED_RATE: 2}
+    assert controller.tokens < 0
+
+    # Over the rate with a backlog too, only the next IDR gets through
+    controller = OverloadController(max_fps=2, drop_backlog=1)
+    assert run(controller, [unit(5, 3), unit(1)]) == '++'
+    assert run(controller, [unit(1), unit(1), unit(5, 3)], backlog=1) == '--+'
+    assert controller.dropped[OverloadController.DROPPED_RATE] == 1
+    assert controller.dropped[OverloadController.DROPPED_UNTIL_IDR] == 1
+
+
+def test_slices_follow_their_picture():
+    controller = OverloadController(drop_backlog=1)
+    second_slice = H264Unit(b'\x00\x00\x00\x01\x01\x40')  # first_mb_in_slice 1
+    assert run(controller, [unit(1, 0), second_slice, unit(1), second_slice], backlog=1) == '--++'
+
+
+def test_session_decodes_at_rate():
+    session = StreamSession(('127.0.0.1', 0), overload=OverloadController(max_fps=1))
+    for count, data in enumerate(test_data):
+        session.on_data_received(data, count)
+    session.on_data_received(NALUParser.START_CODE, len(test_data))
+    session.close()
+    # The IDR takes the only token, the P-frame after it is over the rate but borrows
+    # one since the decoder keeps up, dropping it would cost the rest of the GOP
+    assert session.frame_count == 2
+    assert session.overload.tokens < 0
+
+
+def test_slow_decoder_skips_to_next_idr():
+    stream = synthesize_stream(160, 128, frame_count=120, gop=40)
+    closed = threading.Event()
+    sessions = []
+
+    class SlowDecoder(StreamingDecoder):
+        def decode_data(self, data):
+            time.sleep(0.01)
+            return super().decode_data(data)
+
+    class RecordingSession(StreamSession):
+        def close(self):
+            super().close()
+            closed.set()
+
+    def session_factory(addr):
+        overload = OverloadController(skip_backlog=8)
+        sessions.append(RecordingSession(addr, decoder=SlowDecoder(), overload=overload))
+        return sessions[-1]
+
+    server = TCPServer(host='127.0.0.1', port=0)
+    server.session_factory = session_factory
+    server.start()
+    # The whole stream arrives at once and waits in the socket, far ahead of the decoder
+    with socket.create_connection(('127.0.0.1', server.port)) as client:
+        client.sendall(stream + NALUParser.START_CODE)
+    assert closed.wait(10)
+    server.stop()
+
+    session = sessions[0]
+    assert session.overload.dropped[OverloadController.DROPPED_UNTIL_IDR] > 0
+    # Every IDR still gets through
+    assert 3 <= session.frame_count < 120
@@ -0,0 +1,94 @@
+import av
+
+from bench import parse_units, synthesize_stream
+from nalu_parser import NALUParser
+from recorder import SegmentRecorder
+
+
+def record_stream(stream, directory, container_format, segment_seconds):
+    recorder = SegmentRecorder(str(directory), container_format=container_format, segment_seconds=segment_seconds)
+    parser = NALUParser(short_start_codes=True)
+    parser.h264_unit_handler = lambda unit, count: recorder.record(unit)
+    parser.enqueue(stream + NALUParser.START_CODE, 0)
+    recorder.close()
+    return recorder
+
+
+def test_segments_start_on_keyframes(tmp_path):
+    stream = synthesize_stream(320, 240, frame_count=30, gop=10)
+    # Every IDR is past the zero second limit, so each GOP gets its own segment
+    recorder = record_stream(stream, tmp_path, 'mp4', segment_seconds=0)
+    assert recorder.segment_count == 3
+    assert recorder.dropped_units == 0
+
+    decoded = 0
+    for path in recorder.segment_paths:
+        with av.open(path) as container:
+            video = container.streams.video[0]
+            assert (video.codec_context.width, video.codec_context.height) == (320, 240)
+            packets = [packet for packet in container.demux(video) if packet.size]
+            assert packets[0].is_keyframe
+            decoded += sum(len(video.codec_context.decode(packet)) for packet in packets)
+            decoded += len(video.codec_context.decode(None))
+    assert decoded == 30
+
+
+def test_mkv_single_segment(tmp_path):
+    stream = synthesize_stream(320, 240, frame_count=20, gop=10)
+    recorder = record_stream(stream, tmp_path, 'mkv', segment_seconds=60)
+    assert recorder.segment_count == 1
+    with av.open(recorder.segment_paths[0]) as container:
+        assert sum(1 for packet in container.demux(video=0) if packet.size) == 20
+
+
+def test_pts_follow_each_pictures_own_arrival(tmp_path):
+    stream = synthesize_stream(320, 240, frame_count=10, gop=10)
+    recorder = SegmentRecorder(str(tmp_path), segment_seconds=60)
+    # Pictures arrive at uneven times, picture k at k * k * 5 ms
+    picture = -1
+    for unit in parse_units([stream]):
+        if unit.is_slice and unit.first_mb_in_slice == 0:
+            picture += 1
+        recorder.units.put((unit, max(picture, 0) ** 2 * 5_000_000))
+    recorder.close()
+
+    with av.open(recorder.segment_paths[0]) as container:
+        packets = [packet for packet in container.demux(video=0) if packet.size]
+        times = sorted(round(float(packet.pts * packet.time_base) * 1000) for packet in packets)
+    assert times == [k * k * 5 for k in range(10)]
+
+
+def test_worker_survives_a_failing_unit(tmp_path):
+    stream = synthesize_stream(320, 240, frame_count=20, gop=10)
+
+    class FlakyRecorder(SegmentRecorder):
+        failures = 1
+
+        def write_access_unit(self, access_unit):
+            if self.container is not None and self.failures:
+                self.failures -= 1
+                raise ValueError("muxing failed")
+            super().write_access_unit(access_unit)
+
+    recorder = FlakyRecorder(str(tmp_path), segment_seconds=60, max_queue=8)
+    parser = NALUParser(short_start_codes=True)
+    parser.h264_unit_handler = lambda unit, count: recorder.units.put((unit.detach(), 0))
+    parser.enqueue(stream + NALUParser.START_CODE, 0)
+    recorder.close(timeout=5)
+
+    assert not recorder.thread.is_alive()
+    assert recorder.failed_units == 1
+    # The first segment ends at the failure, the next one starts at the second IDR
+    assert recorder.segment_count == 2
+    with av.open(recorder.segment_paths[1]) as container:
+        assert sum(1 for packet in container.demux(video=0) if packet.size) == 10
+
+
+def test_close_does_not_hang_on_a_dead_worker(tmp_path):
+    recorder = SegmentRecorder(str(tmp_path), max_queue=1)
+    recorder.units.put(None)
+    recorder.thread.join(5)
+    recorder.units.put(None)
+    # The queue is full and nobody drains it
+    recorder.close(timeout=0.1)
+    assert not recorder.thread.is_alive()
@@ -0,0 +1,121 @@
+import socket
+import time
+
+import av
+
+from bench import parse_units, synthesize_stream
+from relay import RelayServer, RelaySubscriber
+
+
+def receive_until_closed(client):
+    received = bytearray()
+    while True:
+        data = client.recv(65536)
+        if not data:
+            return bytes(received)
+        received += data
+
+
+def decode_frame_count(stream):
+    codec = av.CodecContext.create('h264', 'r')
+    frames = 0
+    for packet in codec.parse(stream) + codec.parse(None):
+        frames += len(codec.decode(packet))
+    return frames + len(codec.decode(None))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_late_subscriber_starts_at_cached_keyframe():
+    stream = synthesize_stream(320, 240, frame_count=40, gop=20)
+    first_gop_end = len(stream) * 3 // 4  # Inside the second GOP
+    server = RelayServer(host='127.0.0.1', port=0, subscribe_port=0)
+    server.start()
+
+    with socket.create_connection(('127.0.0.1', server.port)) as camera:
+        wait_for(lambda: server.find_stream('127.0.0.1'))
+        relay = server.find_stream('127.0.0.1')
+        assert relay.name == f"127.0.0.1:{camera.getsockname()[1]}"
+        early = socket.create_connection(('127.0.0.1', server.subscribe_port))
+        early.sendall(b'127.0.0.1\n')
+        wait_for(lambda: relay.subscribers)
+        camera.sendall(stream[:first_gop_end])
+        # The parser holds back the last unit of the prefix until more data arrives
+        prefix_units = len(parse_units([stream[:first_gop_end]])) - 1
+        wait_for(lambda: relay.published_units == prefix_units)
+        late = socket.create_connection(('127.0.0.1', server.subscribe_port))
+        late.sendall(b'\n')
+        wait_for(lambda: len(relay.subscribers) == 2)
+        camera.sendall(stream[first_gop_end:])
+    # Subscribers get everything queued and are closed once the camera is gone
+    early_frames = decode_frame_count(receive_until_closed(early))
+    late_frames = decode_frame_count(receive_until_closed(late))
+    early.close()
+    late.close()
+    wait_for(lambda: not server.streams)
+    server.stop()
+    # The parser holds back the last unit until the next start code arrives
+    assert early_frames == 39
+    # The late subscriber joined in the second GOP and got all of it
+    assert late_frames == 19
+
+
+def test_cameras_on_one_host_are_separate_streams():
+    stream = synthesize_stream(320, 240, frame_count=10, gop=5)
+    server = RelayServer(host='127.0.0.1', port=0, subscribe_port=0)
+    server.start()
+    cameras = [socket.create_connection(('127.0.0.1', server.port)) for _ in range(2)]
+    names = [f"127.0.0.1:{camera.getsockname()[1]}" for camera in cameras]
+    wait_for(lambda: len(server.streams) == 2)
+    assert sorted(server.streams) == sorted(names)
+
+    viewer = socket.create_connection(('127.0.0.1', server.subscribe_port))
+    viewer.sendall(names[0].encode() + b'\n')
+    wait_for(lambda: server.streams[names[0]].subscribers)
+    # Interleaved sends would corrupt a shared parser
+    for offset in range(0, len(stream), 1000):
+        for camera in cameras:
+            camera.sendall(stream[offset:offset + 1000])
+    for camera in cameras:
+        camera.close()
+    # The last unit waits for a start code that never comes
+    assert decode_frame_count(receive_until_closed(viewer)) == 9
+    viewer.close()
+    wait_for(lambda: not server.streams)
+
+    unknown = socket.create_connection(('127.0.0.1', server.subscribe_port))
+    unknown.sendall(b'127.0.0.1\n')
+    assert receive_until_closed(unknown) == b''
+    unknown.close()
+    server.stop()
+
+
+def test_silent_viewer_is_disconnected():
+    server = RelayServer(host='127.0.0.1', port=0, subscribe_port=0, name_timeout=0.1)
+    server.start()
+    with socket.create_connection(('127.0.0.1', server.subscribe_port)) as viewer:
+        viewer.settimeout(5)
+        # Never sends a stream name, the server gives up on it
+        assert receive_until_closed(viewer) == b''
+    server.stop()
+
+
+def test_slow_subscriber_drops_to_next_keyframe():
+    subscriber = RelaySubscriber(None, max_pending_bytes=100)
+    subscriber.push([memoryview(b'k' * 60)], [memoryview(b'k' * 60)])
+    subscriber.push([memoryview(b'p' * 60)])
+    assert subscriber.waiting_for_key_frame
+    assert subscriber.dropped_units == 2 and not subscriber.pending
+
+    subscriber.push([memoryview(b'p' * 10)])
+    assert subscriber.dropped_units == 3
+
+    parameter_sets = [memoryview(b's' * 5), memoryview(b'i' * 20)]
+    subscriber.push([parameter_sets[1]], parameter_sets)
+    assert list(subscriber.pending) == parameter_sets
+    assert subscriber.pending_bytes == 25
@@ -0,0 +1,183 @@
+import socket
+import threading
+
+from an_data import test_data
+from nalu_parser import NALUParser
+import server as server_module
+from server import AsyncTCPServer, TCPServer
+from session import StreamSession
+from test_nalu_parser import length_prefixed, parse_chunks
+
+
+def send_and_stop(server):
+    received = bytearray()
+    done = threading.Event()
+
+    def on_data_received(data, count):
+        received.extend(data)
+        if len(received) == len(stream):
+            done.set()
+
+    stream = b''.join(test_data)
+    server.received_data_handler = on_data_received
+    server.start()
+    with socket.create_connection(('127.0.0.1', server.port)) as client:
+        client.sendall(stream)
+        assert done.wait(5)
+    server.stop()
+    return bytes(received) == stream
+
+
+def test_tcp_server():
+    server = TCPServer(host='127.0.0.1', port=0)
+    assert send_and_stop(server)
+
+
+def test_async_tcp_server():
+    server = AsyncTCPServer(host='127.0.0.1', port=0, buffer_size=1000)
+    assert send_and_stop(server)
+    assert not server.thread.is_alive()
+
+
+def test_sessions_are_isolated():
+    closed = []
+    all_closed = threading.Event()
+
+    class RecordingSession(StreamSession):
+        def close(self):
+            super().close()
+            closed.append(self.frame_count)
+            if len(closed) == 2:
+                all_closed.set()
+
+    server = AsyncTCPServer(host='127.0.0.1', port=0)
+    server.session_factory = RecordingSession
+    server.start()
+    clients = [socket.create_connection(('127.0.0.1', server.port)) for _ in range(2)]
+    # Interleave the two streams chunk by chunk
+    for data in test_data:
+        for client in clients:
+            client.sendall(data)
+    for client in clients:
+        client.sendall(b'\x00\x00\x00\x01')
+        client.close()
+    assert all_closed.wait(5)
+    server.stop()
+
+    assert closed == [2, 2]
+
+
+def test_framing_is_detected_per_connection():
+    closed = []
+    all_closed = threading.Event()
+
+    class RecordingSession(StreamSession):
+        def close(self):
+            super().close()
+            closed.append(self.frame_count)
+            if len(closed) == 2:
+                all_closed.set()
+
+    server = TCPServer(host='127.0.0.1', port=0, framing=TCPServer.AUTO)
+    server.session_factory = RecordingSession
+    server.start()
+    annex_b = b''.join(test_data) + NALUParser.START_CODE
+    for stream in [annex_b, length_prefixed(parse_chunks([annex_b]))]:
+        with socket.create_connection(('127.0.0.1', server.port)) as client:
+            # Split inside the first length prefix
+            client.sendall(stream[:2])
+            client.sendall(stream[2:])
+    assert all_closed.wait(5)
+    server.stop()
+
+    assert closed == [2, 2]
+
+
+def test_oversized_length_prefix_closes_connection():
+    received = []
+    server = TCPServer(host='127.0.0.1', port=0, framing=NALUParser.LENGTH_PREFIXED, max_unit_size=4096)
+    server.received_unit_handler = lambda payload, count: received.append(bytes(payload))
+    server.start()
+    units = parse_chunks([b''.join(test_data)])
+    with socket.create_connection(('127.0.0.1', server.port)) as client:
+        # A 4 GiB length after one valid unit, the server hangs up instead of allocating
+        client.sendall(length_prefixed(units[:1]) + b'\xff\xff\xff\xff\x65')
+        client.settimeout(5)
+        try:
+            # Closed with unread data, so it may come as a reset
+            assert client.recv(1) == b''
+        except ConnectionResetError:
+            pass
+    server.stop()
+
+    # Without a session the handler gets the unit with its length prefix
+    assert received == [length_prefixed(units[:1])]
+
+
+def test_detect_framing():
+    server = TCPServer(detect_timeout=0.2)
+    annex_b = b''.join(test_data)
+    cases = [
+        (annex_b, NALUParser.ANNEX_B),
+        (length_prefixed(parse_chunks([annex_b])), NALUParser.LENGTH_PREFIXED),
+        # Junk in front of the first start code, and a camera joining in the middle of a slice
+        (b'\x12\x34\x56\x78\x65' + annex_b, NALUParser.ANNEX_B),
+        (test_data[3][100:] + annex_b, NALUParser.ANNEX_B),
+        # Too few bytes to decide within the timeout
+        (b'\x00\x00', NALUParser.ANNEX_B)
+    ]
+    for data, framing in cases:
+        reader, writer = socket.socketpair()
+        with reader, writer:
+            writer.sendall(data)
+            assert server.detect_framing(reader) == framing
+            # Nothing was consumed and the socket blocks again
+            assert reader.recv(len(data), socket.MSG_WAITALL) == data
+            assert reader.gettimeout() is None
+
+
+def test_unread_bytes(monkeypatch):
+    reader, writer = socket.socketpair()
+    with reader, writer:
+        writer.sendall(b'\x00' * 100)
+        assert TCPServer.unread_bytes(reader) == 100
+        # Platforms without fcntl, like Windows, report nothing unread
+        monkeypatch.setattr(server_module, 'fcntl', None)
+        assert TCPServer.unread_bytes(reader) == 0
+
+
+def test_failing_session_is_closed(monkeypatch):
+    closed = threading.Event()
+    thread_errors = []
+    thread_failed = threading.Event()
+
+    def excepthook(args):
+        thread_errors.append(args.exc_type)
+        thread_failed.set()
+
+    # The exception still ends the connection thread after the cleanup
+    monkeypatch.setattr(threading, 'excepthook', excepthook)
+
+    class FailingSession(StreamSession):
+        def on_data_received(self, data, count):
+            raise RuntimeError("decode failed")
+
+        def close(self):
+            super().close()
+            closed.set()
+
+    server = TCPServer(host='127.0.0.1', port=0)
+    server.session_factory = FailingSession
+    server.start()
+    with socket.create_connection(('127.0.0.1', server.port)) as client:
+        client.sendall(b''.join(test_data))
+        assert closed.wait(5)
+        client.settimeout(5)
+        # The server side of the connection was closed too
+        try:
+            assert client.recv(1) == b''
+        except ConnectionResetError:
+            pass
+    assert thread_failed.wait(5)
+    server.stop()
+    assert thread_errors == [RuntimeError]
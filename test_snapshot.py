@@ -0,0 +1,83 @@
+import os
+
+import cv2
+import numpy as np
+
+from an_data import test_data
+from frame_decoder import OutputFormat
+from frame_pool import FramePool
+from nalu_parser import NALUParser
+from session import StreamSession
+from snapshot import SnapshotEncoder
+
+
+def test_rate_limit_and_downscale():
+    snapshots = SnapshotEncoder(max_fps=1, max_size=(160, 160))
+    frame = np.full((240, 320, 3), 128, np.uint8)
+    assert snapshots.submit('a', frame)
+    # Over the rate of stream a, stream b has its own budget
+    assert not snapshots.submit('a', frame)
+    assert snapshots.submit('b', frame)
+    snapshots.close()
+
+    assert snapshots.encoded_count == 2 and snapshots.skipped_count == 1
+    image = cv2.imdecode(np.frombuffer(snapshots.latest['a'][1], np.uint8), cv2.IMREAD_COLOR)
+    assert image.shape == (120, 160, 3)
+
+
+def test_batched_files(tmp_path):
+    snapshots = SnapshotEncoder(image_format='png', max_fps=None, directory=str(tmp_path), batch_size=3,
+                                max_pending=16)
+    pool = FramePool()
+    for index in range(4):
+        with pool.acquire((16, 16), OutputFormat.GRAY8) as frame:
+            frame.array[:] = index
+            assert snapshots.submit(('127.0.0.1', 5000), frame, OutputFormat.GRAY8)
+    snapshots.executor.shutdown()
+    # One full batch is written, the rest waits for the next batch or close
+    assert len(os.listdir(tmp_path)) == 3
+    snapshots.close()
+
+    names = sorted(os.listdir(tmp_path))
+    assert len(names) == 4 and all(name.startswith('127.0.0.1_5000_') and name.endswith('.png') for name in names)
+    values = {int(cv2.imread(str(tmp_path / name), cv2.IMREAD_UNCHANGED)[0, 0]) for name in names}
+    assert values == {0, 1, 2, 3}
+
+
+def test_session_snapshots_yuv_frames():
+    snapshots = SnapshotEncoder(image_format='webp', max_fps=None)
+    session = StreamSession('camera', output_format=OutputFormat.YUV420P, snapshots=snapshots)
+    for count, data in enumerate(test_data):
+        session.on_data_received(data, count)
+    session.on_data_received(NALUParser.START_CODE, len(test_data))
+    session.close()
+    snapshots.close()
+
+    assert snapshots.encoded_count == 2
+    image = cv2.imdecode(np.frombuffer(snapshots.latest['camera'][1], np.uint8), cv2.IMREAD_COLOR)
+    assert image.shape == (1280, 720, 3)
+
+
+def test_session_snapshots_video_frames():
+    snapshots = SnapshotEncoder(max_fps=None)
+    session = StreamSession('camera', output_format=OutputFormat.FRAME, snapshots=snapshots)
+    for count, data in enumerate(test_data):
+        session.on_data_received(data, count)
+    session.on_data_received(NALUParser.START_CODE, len(test_data))
+    session.close()
+    snapshots.close()
+
+    assert snapshots.encoded_count == 2 and snapshots.failed_count == 0
+    image = cv2.imdecode(np.frombuffer(snapshots.latest['camera'][1], np.uint8), cv2.IMREAD_COLOR)
+    assert image.shape == (1280, 720, 3)
+    # The closed stream's rate limit is forgotten
+    assert snapshots.last_submit == {}
+
+
+def test_failed_encodes_are_counted():
+    snapshots = SnapshotEncoder(max_fps=None)
+    snapshots.snapshot_handler = lambda stream_name, timestamp, data: 1 / 0
+    assert snapshots.submit('a', np.zeros((16, 16, 3), np.uint8))
+    assert not snapshots.submit('a', object())
+    snapshots.close()
+    assert snapshots.encoded_count == 1 and snapshots.failed_count == 1 and snapshots.skipped_count == 1